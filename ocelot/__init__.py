@@ -5,7 +5,7 @@ general ocelot description
 __version__ = '20.11.2'
 
 
-__all__ = ['Twiss', "Beam", "Particle", "get_current", "get_envelope", "generate_parray",           # beam
+__all__ = ['Twiss', "TwissTable", "Beam", "Particle", "get_current", "get_envelope", "generate_parray",           # beam
             "ellipse_from_twiss", "ParticleArray",  "global_slice_analysis", 'gauss_from_twiss',    # beam
 
             "save_particle_array", "load_particle_array", "write_lattice",                          # io
@@ -21,12 +21,13 @@ __all__ = ['Twiss', "Beam", "Particle", "get_current", "get_envelope", "generate
 
             "tracking_step", "create_track_list", "track_nturns", "freq_analysis",           # track
             "contour_da", "track_nturns_mpi", "nearest_particle", "stable_particles",        # track
-            "spectrum", "track",                                                             # track
+            "spectrum", "track", "track_nturns_array", "track_nturns_pool", "da_pool",       # track
+            "fma_pool", "find_tunes", "da_rays",                                             # track
             "pi", "m_e_eV", "m_e_MeV", "m_e_GeV", "speed_of_light",                             # globals
             "compensate_chromaticity",                                                          # chromaticity
             "EbeamParams",                                                                      # beam_params
             "CSR",                                                                              # csr
-            "SpaceCharge", "LSC",                                                               # sc
+            "SpaceCharge", "SpaceCharge25D", "LSC",                                             # sc
             "Wake", "WakeTable", "WakeKick", "WakeTableDechirperOffAxis",                       # wake
             "BeamTransform", "SmoothBeam", "EmptyProc", "PhysProc", "LaserHeater",
             "LaserModulator", "SpontanRadEffects", "PhaseSpaceAperture",
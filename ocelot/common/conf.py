@@ -3,9 +3,11 @@ __author__ = 'Sergey Tomin'
 import os
 import multiprocessing
 
-num_thread_default = str(int(multiprocessing.cpu_count()/2))
+num_thread_default = str(max(int(multiprocessing.cpu_count()/2), 1))
 
 
 OCELOT_NUM_THREADS = os.environ.get("OCELOT_NUM_THREADS", num_thread_default)
 os.environ["NUMEXPR_NUM_THREADS"] = OCELOT_NUM_THREADS
 os.environ["NUMBA_NUM_THREADS"] = OCELOT_NUM_THREADS
+# directory of the on-disk cache of the calculated tables (see ocelot.cpbd.table_cache), None - no cache
+OCELOT_CACHE_DIR = os.environ.get("OCELOT_CACHE_DIR", None)
@@ -10,6 +10,7 @@ from scipy.signal import savgol_filter
 from scipy.stats import truncnorm
 from ocelot.common.ocelog import *
 from ocelot.cpbd.reswake import pipe_wake
+from ocelot.cpbd.binning import get_binning
 
 _logger = logging.getLogger(__name__)
 
@@ -139,6 +140,67 @@ class Twiss:
         return val
 
 
+class TwissTable:
+    """
+    Columnar container of the Twiss parameters along the lattice.
+    Every numerical attribute of Twiss is stored as a float64 array (e.g. tws.beta_x, tws.s), element ids are
+    stored in the list tws.id.
+
+    For backward compatibility TwissTable behaves as a list of Twiss objects:
+    len(tws), tws[i] -> Twiss, tws[i:j] -> TwissTable, iteration over Twiss objects.
+    Twiss objects are created on request and are copies, i.e. tws[i].beta_x = 1 does not change the table.
+
+    :param n: number of rows
+    """
+    columns = tuple(key for key, value in Twiss().__dict__.items() if isinstance(value, float))
+
+    def __init__(self, n=0):
+        for name in self.columns:
+            self.__dict__[name] = np.zeros(n)
+        self.id = [""] * n
+
+    def __len__(self):
+        return len(self.id)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            ids = self.id[item]
+            table = TwissTable(len(ids))
+            for name in self.columns:
+                table.__dict__[name] = self.__dict__[name][item].copy()
+            table.id = ids
+            return table
+        tws = Twiss()
+        for name in self.columns:
+            tws.__dict__[name] = float(self.__dict__[name][item])
+        tws.id = self.id[item]
+        return tws
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @classmethod
+    def from_list(cls, tws_list):
+        """
+        convert list of Twiss objects to TwissTable
+
+        :param tws_list: list of Twiss objects
+        :return: TwissTable
+        """
+        table = cls(len(tws_list))
+        for name in cls.columns:
+            table.__dict__[name] = np.array([getattr(tw, name) for tw in tws_list], dtype=float)
+        table.id = [tw.id for tw in tws_list]
+        return table
+
+    def to_list(self):
+        """
+        :return: list of Twiss objects
+        """
+        return list(self)
+
+
 class Particle:
     """
     particle
@@ -623,6 +685,14 @@ class ParticleArray:
         self.E = 0.0
         self.lost_particle_recorder = self.LostParticleRecorder(n)
 
+    def binning(self):
+        """
+        longitudinal binning of the particles shared by the physics processes of one step,
+        see ocelot.cpbd.binning.LongitudinalBinning
+
+        :return: LongitudinalBinning
+        """
+        return get_binning(self)
 
     def rm_tails(self, xlim, ylim, px_lim, py_lim):
         """
@@ -633,13 +703,10 @@ class ParticleArray:
         px = abs(self.px())
         y = abs(self.y())
         py = abs(self.py())
-        ind_angles = np.append(np.argwhere(px > px_lim), np.argwhere(py > py_lim))
-        p_idxs = np.unique(np.append(np.argwhere(x > xlim), np.append(np.argwhere(y > ylim),
-                                                                      np.append(np.argwhere(x != x),
-                                                                                np.append(np.argwhere(y != y),
-                                                                                          ind_angles)))))
-        # e_idxs = [append([], x) for x in array([6*p_idxs, 6*p_idxs+1, 6*p_idxs+2, 6*p_idxs+3, 6*p_idxs+4, 6*p_idxs+5])]
-        self.rparticles = np.delete(self.rparticles, p_idxs, axis=1)
+        lost = (x > xlim) | (y > ylim) | (px > px_lim) | (py > py_lim) | (x != x) | (y != y)
+        p_idxs = np.flatnonzero(lost)
+        if len(p_idxs) > 0:
+            self.rparticles = self.rparticles[:, ~lost]
         return p_idxs
 
     def __getitem__(self, idx):
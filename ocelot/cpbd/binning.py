@@ -0,0 +1,252 @@
+"""
+Longitudinal binning of the ParticleArray shared by the collective effects (Wake, CSR, LSC, SmoothBeam)
+applied on the same step.
+
+The binning is attached to the ParticleArray (ParticleArray.binning()) and is calculated on demand:
+the sorted index of the particles and the line densities of the charge weighted with 1, x, y, xy, x^2 - y^2, ...
+for a given grid are calculated once and reused by the next physics processes. All requested line densities
+are deposited in one pass over the particles.
+The binning is invalidated when the particles move (x, y, tau), are lost or the charges change.
+"""
+
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numba as nb
+    nb_flag = True
+except:
+    logger.debug("binning.py: module NUMBA is not installed. Install it to speed up calculation")
+    nb_flag = False
+
+
+def _weight_q(X, Y, q):
+    return q
+
+
+def _weight_x(X, Y, q):
+    return q * X
+
+
+def _weight_y(X, Y, q):
+    return q * Y
+
+
+def _weight_xy(X, Y, q):
+    return q * (X * Y)
+
+
+def _weight_x2_y2(X, Y, q):
+    return q * (X ** 2 - Y ** 2)
+
+
+def _weight_x2(X, Y, q):
+    return q * X ** 2
+
+
+def _weight_y2(X, Y, q):
+    return q * Y ** 2
+
+
+# charge weights of the line densities: weight(X, Y, q)
+weights = {"q": _weight_q, "x": _weight_x, "y": _weight_y, "xy": _weight_xy, "x2-y2": _weight_x2_y2,
+           "x2": _weight_x2, "y2": _weight_y2}
+
+
+def project_on_grid_multi_py(Ro, I0, dI0, Q):
+    """
+    linear projection of the charges Q[k] on the grids Ro[k] in one pass over the particles,
+    see wake3D.project_on_grid()
+
+    :param Ro: array (m, n_points) - grids
+    :param I0: grid index for each particle
+    :param dI0: coefficient how particle close to Ro[k, i+1]
+    :param Q: array (m, Np) - charges
+    :return: Ro
+    """
+    m, Np = Q.shape
+    for i in range(Np):
+        i0 = int(I0[i])
+        di0 = dI0[i]
+        for k in range(m):
+            Ro[k, i0] = Ro[k, i0] + (1 - di0) * Q[k, i]
+            Ro[k, i0 + 1] = Ro[k, i0 + 1] + di0 * Q[k, i]
+    return Ro
+
+
+project_on_grid_multi = project_on_grid_multi_py if not nb_flag else nb.jit(nopython=True)(project_on_grid_multi_py)
+
+
+def triang_filter(x, filter_order):
+    Ns = x.shape[0]
+    for i in range(filter_order):
+        x[1:Ns] = (x[1:Ns] + x[0:Ns - 1]) * 0.5
+        x[0:Ns - 1] = (x[1:Ns] + x[0:Ns - 1]) * 0.5
+    return x
+
+
+def s2currents(s_array, q_arrays, n_points, filter_order, mean_vel):
+    """
+    generalized currents of several charge arrays on the same grid, see wake3D.s2current()
+
+    :param s_array: s-vector, coordinates in longitudinal direction
+    :param q_arrays: array (m, Np) - charge-vectors
+    :param n_points: number of sampling points
+    :param filter_order: filter order
+    :param mean_vel: mean velocity
+    :return: list of m arrays (n_points + 2*floor(filter_order/2), 2) - [s, I]
+    """
+    q_arrays = np.atleast_2d(q_arrays)
+    s0 = np.min(s_array)
+    s1 = np.max(s_array)
+    NF2 = int(np.floor(filter_order / 2.))
+    n_points = n_points + 2 * NF2
+
+    ds = (s1 - s0) / (n_points - 2 - 2 * NF2)
+    s = s0 + np.arange(-NF2, n_points - NF2) * ds
+    Ip = (s_array - s0) / ds
+    I0 = np.floor(Ip)
+    dI0 = Ip - I0
+    I0 = I0 + NF2
+    Ro = np.zeros((q_arrays.shape[0], n_points))
+    Ro = project_on_grid_multi(Ro, I0, dI0, np.ascontiguousarray(q_arrays))
+    currents = []
+    for k in range(q_arrays.shape[0]):
+        if filter_order > 0:
+            triang_filter(Ro[k], filter_order)
+        I = np.zeros([n_points, 2])
+        I[:, 0] = s
+        I[:, 1] = Ro[k] * mean_vel / ds
+        currents.append(I)
+    return currents
+
+
+_ramps = {}
+
+
+def _ramp(n):
+    if n not in _ramps:
+        _ramps.clear()
+        _ramps[n] = np.arange(1., n + 1.)
+    return _ramps[n]
+
+
+def fingerprint(p_array):
+    """
+    cheap state of the longitudinal and transverse positions and of the charges of the particles.
+    The positions are summed with the weights 1, 2, ... n, so a permutation of the particles changes the state as well.
+    Copies of the ParticleArray with the same particles have the same state and can share the binning.
+
+    :param p_array: ParticleArray
+    :return: tuple
+    """
+    ps = p_array.rparticles
+    n = ps.shape[1]
+    w = _ramp(n)
+    return (n, float(np.dot(ps[0], w)), float(np.dot(ps[2], w)), float(np.dot(ps[4], w)),
+            float(np.dot(p_array.q_array, w)))
+
+
+class LongitudinalBinning:
+    """
+    Cached longitudinal binning of the particle distribution, see ParticleArray.binning()
+
+    binning.sort_index() - indices of the particles sorted by tau
+    binning.currents(n_points, filter_order, mean_vel, ["q", "x", "y"]) - generalized currents (see s2currents())
+                                                                         with the charge weights from binning.weights
+    binning.info() -> {'sorts': 1, 'depositions': 1, 'hits': 4}
+    The binning is not copied with the ParticleArray (deepcopy or pickle).
+
+    :param p_array: ParticleArray
+    """
+    def __init__(self, p_array):
+        self.p_array = p_array
+        self.state = fingerprint(p_array)
+        self.sorts = 0
+        self.depositions = 0
+        self.hits = 0
+        self._sort_index = None
+        self._currents = {}
+        self._lock = threading.RLock()
+
+    def __deepcopy__(self, memo):
+        return None
+
+    def __reduce__(self):
+        return _no_binning, ()
+
+    def is_valid(self, p_array=None):
+        """
+        :param p_array: None or ParticleArray, the binning is valid if the particles are the same as in p_array
+        """
+        return self.state == fingerprint(self.p_array if p_array is None else p_array)
+
+    def sort_index(self):
+        """
+        indices of the particles sorted by tau, np.argsort(p_array.tau())
+
+        :return: read-only array
+        """
+        with self._lock:
+            if self._sort_index is None:
+                self._sort_index = np.argsort(self.p_array.tau(), kind="quicksort")
+                self._sort_index.setflags(write=False)
+                self.sorts += 1
+            else:
+                self.hits += 1
+            return self._sort_index
+
+    def currents(self, n_points, filter_order, mean_vel, names=("q",)):
+        """
+        generalized currents of the charges weighted with binning.weights[name] on the grid of s2currents().
+        The missing currents are deposited in one pass over the particles.
+
+        :param n_points: number of sampling points
+        :param filter_order: filter order
+        :param mean_vel: mean velocity
+        :param names: names of the weights, see binning.weights
+        :return: list of read-only arrays (n_points + 2*floor(filter_order/2), 2)
+        """
+        grid = (int(n_points), int(filter_order), float(mean_vel))
+        with self._lock:
+            missing = [name for name in names if (grid, name) not in self._currents]
+            self.hits += len(names) - len(missing)
+            if missing:
+                ps = self.p_array.rparticles
+                Q = np.array([weights[name](ps[0], ps[2], self.p_array.q_array) for name in missing])
+                for name, I in zip(missing, s2currents(ps[4], Q, n_points, filter_order, mean_vel)):
+                    I.setflags(write=False)
+                    self._currents[(grid, name)] = I
+                self.depositions += 1
+            return [self._currents[(grid, name)] for name in names]
+
+    def info(self):
+        """
+        :return: dict with the number of sorts, depositions and reused results
+        """
+        return {"sorts": self.sorts, "depositions": self.depositions, "hits": self.hits}
+
+
+def _no_binning():
+    return None
+
+
+_lock = threading.Lock()
+
+
+def get_binning(p_array):
+    """
+    binning of the ParticleArray from the cache, a new binning is created if the particles have moved
+
+    :param p_array: ParticleArray
+    :return: LongitudinalBinning
+    """
+    with _lock:
+        binning = getattr(p_array, "_binning", None)
+        if binning is None or not binning.is_valid(p_array):
+            binning = LongitudinalBinning(p_array)
+            p_array._binning = binning
+        return binning
@@ -0,0 +1,139 @@
+"""
+Convolution engine of the longitudinal profiles with the wake functions and the kernels, shared by Wake, CSR and LSC.
+
+Short arrays are convolved directly (np.convolve), long arrays with the real FFT of the zero-padded arrays.
+The FFT size is the next fast length for the real transforms, the arrays are truncated to the requested number
+of output points, so the result has no wrap-around.
+With PYFFTW the FFTW plans and the aligned padded buffers are cached per FFT size and per thread.
+"""
+
+import logging
+import threading
+import numpy as np
+from scipy.fft import next_fast_len
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyfftw
+    pyfftw_flag = True
+except:
+    logger.debug("convolution.py: module PYFFTW is not installed. Install it to speed up calculation")
+    pyfftw_flag = False
+
+# convolution is calculated directly if the shortest array has not more than direct_max points
+direct_max = 64
+# maximum number of the cached FFT sizes per thread
+max_plans = 32
+fftw_planner = "FFTW_ESTIMATE"
+
+_local = threading.local()
+
+
+def fft_size(n):
+    """
+    the smallest fast length of the real FFT >= n
+
+    :param n: minimal size
+    :return: size
+    """
+    return next_fast_len(int(n), real=True)
+
+
+def fft_plan(n):
+    """
+    FFTW plans of the real FFT of size n from the cache of the current thread
+
+    :param n: FFT size
+    :return: a, b, fft, ifft - a is the real buffer (n), b is the half spectrum (n//2 + 1),
+             fft: a -> b, ifft: b -> a
+    """
+    plans = getattr(_local, "plans", None)
+    if plans is None:
+        plans = _local.plans = {}
+    if n not in plans:
+        if len(plans) >= max_plans:
+            plans.clear()
+        a = pyfftw.empty_aligned(n, dtype="float64")
+        b = pyfftw.empty_aligned(n // 2 + 1, dtype="complex128")
+        fft = pyfftw.FFTW(a, b, direction="FFTW_FORWARD", flags=(fftw_planner,))
+        ifft = pyfftw.FFTW(b, a, direction="FFTW_BACKWARD", flags=(fftw_planner,))
+        plans[n] = (a, b, fft, ifft)
+    return plans[n]
+
+
+def rfft(x, n):
+    """
+    real FFT of the array x zero-padded (or cropped) to n points, as np.fft.rfft(x, n)
+
+    :param x: real array
+    :param n: FFT size
+    :return: complex array (n//2 + 1)
+    """
+    if pyfftw_flag:
+        a, b, fft, ifft = fft_plan(n)
+        m = min(len(x), n)
+        a[:m] = x[:m]
+        a[m:] = 0.
+        return fft().copy()
+    return np.fft.rfft(x, n)
+
+
+def irfft(y, n):
+    """
+    inverse of rfft(), as np.fft.irfft(y, n)
+
+    :param y: complex array (n//2 + 1)
+    :param n: FFT size
+    :return: real array (n)
+    """
+    if pyfftw_flag:
+        a, b, fft, ifft = fft_plan(n)
+        b[:] = y[:n // 2 + 1]
+        return ifft().copy()
+    return np.fft.irfft(y, n)
+
+
+def convolve(a, b, n=None, method="auto"):
+    """
+    linear convolution c[k] = sum_j a[j] * b[k - j], the same as np.convolve(a, b)[:n]
+
+    :param a: array
+    :param b: array
+    :param n: None or number of the first points of the convolution, None - len(a) + len(b) - 1 points
+    :param method: "auto" - "direct" for the short arrays (see direct_max) otherwise "fft", "direct" or "fft"
+    :return: array
+    """
+    L = len(a) + len(b) - 1
+    n = L if n is None else min(int(n), L)
+    # the points c[n:] are not needed, so are not the points a[n:] and b[n:]. The leading and trailing zeros
+    # of a and b are cut off, the convolution outside of the support is exactly zero
+    ia, ja = _support(a[:n])
+    ib, jb = _support(b[:n])
+    c = np.zeros(n)
+    if ia + ib >= n or ja == ia or jb == ib:
+        return c
+    a = a[ia:min(ja, n - ib)]
+    b = b[ib:min(jb, n - ia)]
+    L = len(a) + len(b) - 1
+    if method == "auto":
+        method = "direct" if min(len(a), len(b)) <= direct_max else "fft"
+    if method == "direct":
+        cs = np.convolve(a, b)
+    else:
+        K = fft_size(L)
+        fa = rfft(a, K)
+        cs = irfft(fa * rfft(b, K), K)
+    m = min(L, n - ia - ib)
+    c[ia + ib:ia + ib + m] = cs[:m]
+    return c
+
+
+def _support(x):
+    """
+    first and last + 1 indices of the nonzero elements, (0, 0) if all elements are zero
+    """
+    nz = np.flatnonzero(x)
+    if len(nz) == 0:
+        return 0, 0
+    return nz[0], nz[-1] + 1
@@ -6,6 +6,11 @@ import time
 import copy
 import importlib
 import logging
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from scipy import interpolate
@@ -15,14 +20,16 @@ from scipy.optimize import curve_fit
 
 from ocelot.common.globals import pi, speed_of_light, m_e_eV, m_e_GeV
 from ocelot.common import math_op
+from ocelot.common import conf
 from ocelot.cpbd.beam import Particle, s_to_cur
-from ocelot.cpbd.high_order import arcline, rk_track_in_field
+from ocelot.cpbd.high_order import arcline_npoints, arcline_segment, rk_track_in_field
 from ocelot.cpbd.magnetic_lattice import (Undulator, Bend, RBend, SBend,
                                           XYQuadrupole)
 from ocelot.cpbd.physics_proc import PhysProc
+from ocelot.cpbd.convolution import convolve
 from ocelot.rad.radiation_py import und_field
 
-# Try to import numba, pyfftw and numexpr for improved performance
+# Try to import numba and numexpr for improved performance
 logger = logging.getLogger(__name__)
 
 try:
@@ -33,16 +40,6 @@ except:
                 " Install it to speed up calculation")
     nb_flag = False
 
-try:
-
-    from pyfftw.interfaces.numpy_fft import fft
-    from pyfftw.interfaces.numpy_fft import ifft
-except:
-    logger.info("csr.py: module PYFFTW is not installed."
-                " Install it to speed up calculation.")
-    from numpy.fft import ifft
-    from numpy.fft import fft
-
 try:
     import numexpr as ne
     ne_flag = True
@@ -63,15 +60,8 @@ def nextpow2(p):
 
 
 def csr_convolution(a, b):
-    P = len(a)
-    Q = len(b)
-    L = P + Q - 1
-    K = 2 ** nextpow2(L)
-    a_pad = np.pad(a, (0, K - P), 'constant', constant_values=(0))
-    b_pad = np.pad(b, (0, K - Q), 'constant', constant_values=(0))
-    c = ifft(fft(a_pad)*fft(b_pad))
-    c = c[0:L-1].real
-    return c
+    L = len(a) + len(b) - 1
+    return convolve(a, b, L - 1)
 
 
 def sample_0(i, a, b):
@@ -351,8 +341,8 @@ class K0_fin_anf:
         self.print_log = False
         if nb_flag:
             logger.debug("K0_fin_anf: NUMBA")
-            self.K0_1 = nb.jit()(self.K0_1_jit)
-            self.K0_0 = nb.jit()(self.K0_0_jit)
+            self.K0_1 = nb.jit(nogil=True)(self.K0_1_jit)
+            self.K0_0 = nb.jit(nogil=True)(self.K0_0_jit)
             self.eval = self.K0_fin_anf_opt
         elif ne_flag:
             logger.debug("K0_fin_anf: NumExpr")
@@ -615,6 +605,158 @@ class K0_fin_anf:
         return i_0
 
 
+def log_grid_round(x, rtol):
+    """
+    rounds the positive value to the logarithmic grid (1 + rtol)**n, so the close values give the same key of the cache
+
+    :param x: value
+    :param rtol: relative step of the grid, 0 - x is returned
+    :return: rounded value
+    """
+    if rtol <= 0:
+        return x
+    dlog = np.log1p(rtol)
+    return float(np.exp(np.round(np.log(x) / dlog) * dlog))
+
+
+class KernelCache:
+    """
+    Cache of the CSR kernels K1 shared between CSR instances and tracking runs.
+
+    The kernel of the trajectory point i depends only on the trajectory, the mesh [N, dW] and the energy,
+    so the key is (trajectory hash, i, N, dW, gamma), dW and gamma are rounded by CSR.kernel() to the grids
+    with the relative steps CSR.kernel_dw_tol and CSR.kernel_gamma_tol. The kernels are kept in memory (LRU) and, if cache_dir
+    is set, in the files cache_dir/<trajectory hash>/<i>_<N>_<dW>_<gamma>.npy, so the next runs with the same
+    geometry and binning, e.g. in a parameter scan, skip the kernel calculation.
+    Copies of the cache (e.g. deepcopy of the CSR object by Navigator) refer to the same cache.
+
+    cache.info() -> {'hits': 10, 'disk_hits': 0, 'misses': 2, 'size': 2, 'maxsize': 20000,
+                     'nbytes': 4800, 'max_bytes': 268435456}
+
+    :param maxsize: maximum number of the kernels in memory
+    :param cache_dir: directory of the on-disk store, None - memory only
+    :param max_bytes: maximum total size of the kernels in memory in bytes
+    """
+    def __init__(self, maxsize=20000, cache_dir=None, max_bytes=2**28):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.enabled = True
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @staticmethod
+    def traj_hash(traj):
+        """
+        hash of the trajectory array
+        """
+        return hashlib.sha1(np.ascontiguousarray(traj).tobytes()).hexdigest()[:20]
+
+    def filename(self, key):
+        traj_hash, i, N, dW, gamma = key
+        name = "_".join([str(i), str(N), float(dW).hex(), float(gamma).hex()]) + ".npy"
+        return os.path.join(self.cache_dir, traj_hash, name)
+
+    def get(self, key, func):
+        """
+        kernel from the cache
+
+        :param key: (trajectory hash, i, N, dW, gamma)
+        :param func: function without arguments which calculates the kernel if it is not in the cache
+        :return: kernel, read-only array
+        """
+        if not self.enabled:
+            return func()
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+        value = None
+        if self.cache_dir is not None:
+            filename = self.filename(key)
+            if os.path.isfile(filename):
+                try:
+                    value = np.load(filename)
+                except (OSError, ValueError):
+                    logger.warning("KernelCache: can not read " + filename)
+        if value is None:
+            value = func()
+            if self.cache_dir is not None:
+                self.save(filename, value)
+            with self._lock:
+                self.misses += 1
+        else:
+            with self._lock:
+                self.disk_hits += 1
+        value.setflags(write=False)
+        with self._lock:
+            if key not in self._data:
+                self._data[key] = value
+                self.nbytes += value.nbytes
+            while self._data and (len(self._data) > self.maxsize or self.nbytes > self.max_bytes):
+                self.nbytes -= self._data.popitem(last=False)[1].nbytes
+        return value
+
+    def save(self, filename, value):
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            tmp = filename + "." + str(os.getpid()) + ".tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, value)
+            os.replace(tmp, filename)
+        except OSError:
+            logger.warning("KernelCache: can not write " + filename)
+
+    def info(self):
+        """
+        cache statistics
+
+        :return: dict with number of hits in memory and on disk, misses, current and maximum number of the kernels,
+                 current and maximum size of the kernels in bytes
+        """
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "size": len(self._data),
+                "maxsize": self.maxsize, "nbytes": self.nbytes, "max_bytes": self.max_bytes}
+
+    def clear(self):
+        """
+        remove all kernels from the memory (not from the disk) and reset statistics
+        """
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+
+
+csr_kernel_cache = KernelCache()
+
+# trajectories of the reference particle, key - geometry of the elements and parameters of the trajectory (memory only)
+csr_traj_cache = KernelCache(maxsize=16)
+
+_kernel_pools = {}
+
+
+def kernel_pool(nthreads):
+    """
+    thread pool for the CSR kernels, shared between CSR objects
+
+    :param nthreads: number of threads
+    :return: ThreadPoolExecutor
+    """
+    if nthreads not in _kernel_pools:
+        _kernel_pools[nthreads] = ThreadPoolExecutor(max_workers=nthreads)
+    return _kernel_pools[nthreads]
+
+
 class CSR(PhysProc):
     """
     coherent synchrotron radiation
@@ -623,6 +765,19 @@ class CSR(PhysProc):
         self.sigma_min = 1.e-4  - minimal sigma if gauss filtering applied
         self.traj_step = 0.0002 [m] - trajectory step or, other words, integration step for calculation of the CSR-wake
         self.apply_step = 0.0005 [m] - step of the calculation CSR kick, to calculate average CSR kick
+        self.kernel_cache = None - KernelCache of the CSR kernels, None - no cache. csr.kernel_cache = csr_kernel_cache
+                                   enables the cache shared between CSR objects (up to 256 MB in memory),
+                                   csr_kernel_cache.cache_dir = "dir" enables the on-disk store
+        self.kernel_threads = None - number of threads for the kernels of the trajectory points within one step,
+                                     None - OCELOT_NUM_THREADS
+        self.kernel_gamma_tol = 1e-6 - relative step of the energy grid for the cached kernels, with the kernel_cache
+                                       the kernels are calculated for the energy rounded to the grid
+                                       (1 + kernel_gamma_tol)**n and reused for the close energies, 0 - exact energy
+        self.kernel_dw_tol = 1e-6 - relative step of the grid of the mesh step dW for the cached kernels,
+                                    see kernel_gamma_tol
+        self.traj_cache = csr_traj_cache - cache of the reference trajectories shared between CSR objects,
+                                           the key is the geometry of the elements, traj_step and energy.
+                                           None - the trajectory is calculated in each prepare()
     """
     def __init__(self):
         PhysProc.__init__(self)
@@ -660,6 +815,14 @@ class CSR(PhysProc):
         self.pict_debug = False     # if True trajectory of the reference particle will be produced
                                     # and CSR wakes will be saved in the working folder on each spep
 
+        self.kernel_cache = None
+        self.kernel_gamma_tol = 1e-6
+        self.kernel_dw_tol = 1e-6
+        self.kernel_threads = None
+        self.traj_hash = None
+        self.traj_cache = csr_traj_cache
+        self.kick_additive = True
+
         self.sub_bin = SubBinning(x_qbin=self.x_qbin, n_bin=self.n_bin, m_bin=self.m_bin)
         self.bin_smoth = Smoothing()
         self.k0_fin_anf = K0_fin_anf()
@@ -836,35 +999,95 @@ class CSR(PhysProc):
 
         return K1
 
-    def prepare(self, lat):
+    def kernel(self, i, NdW, gamma):
         """
-        calculation of trajectory in rectangular coordinates
-        calculation of the z_csr_start
-        :param lat: Magnetic Lattice
-        :return: self.csr_traj: trajectory. traj[0,:] - longitudinal coordinate,
-                                 traj[1,:], traj[2,:], traj[3,:] - rectangular coordinates, \
-                                 traj[4,:], traj[5,:], traj[6,:] - tangential unit vectors
+        CSR_K1() of the trajectory self.csr_traj from the kernel cache
+
+        :param i: index of the trajectory point
+        :param NdW: list [N, dW], see CSR_K1()
+        :param gamma: Lorentz factor
+        :return: K1
         """
+        if self.kernel_cache is None:
+            return self.CSR_K1(i, self.csr_traj, NdW, gamma=gamma)
+        gamma = log_grid_round(gamma, self.kernel_gamma_tol)
+        NdW = [NdW[0], log_grid_round(NdW[1], self.kernel_dw_tol)]
+        key = (self.traj_hash, int(i), int(NdW[0]), float(NdW[1]), float(gamma))
+        return self.kernel_cache.get(key, lambda: self.CSR_K1(i, self.csr_traj, NdW, gamma=gamma))
+
+    def kernels(self, itr_ra, NdW, gamma):
+        """
+        kernels of the trajectory points, calculated in parallel with self.kernel_threads threads
 
-        # if pict_debug = True import matplotlib
-        if self.pict_debug:
-            self.plt = importlib.import_module("matplotlib.pyplot")
-            self.napply = 0
-            self.total_wake = 0
+        :param itr_ra: indices of the trajectory points
+        :param NdW: list [N, dW], see CSR_K1()
+        :param gamma: Lorentz factor
+        :return: list of K1 in the order of itr_ra
+        """
+        nthreads = self.kernel_threads if self.kernel_threads is not None else int(conf.OCELOT_NUM_THREADS)
+        if nthreads > 1 and len(itr_ra) > 1:
+            return list(kernel_pool(nthreads).map(lambda i: self.kernel(i, NdW, gamma), itr_ra))
+        return [self.kernel(i, NdW, gamma) for i in itr_ra]
 
+    def is_rk_elem(self, elem):
+        return elem.__class__ in [Bend, RBend, SBend, XYQuadrupole, Undulator] and self.energy is not None and self.rk_traj
 
-        self.z_csr_start = sum([p.l for p in lat.sequence[:self.indx0]])
+    def traj_npoints(self, elem):
+        """
+        number of the trajectory points in the element
+
+        :param elem: Element
+        :return: N, 0 if the element is skipped
+        """
+        if elem.l == 0:
+            return 0
+        delta_s = elem.l
+        if self.is_rk_elem(elem):
+            if elem.l < 1e-10:
+                return 0
+            if elem.__class__ == Undulator:
+                gamma = self.energy/m_e_GeV
+                delta_s = elem.lperiod * elem.nperiods * (1 + 0.25*(elem.Kx/gamma) ** 2)
+        return arcline_npoints(delta_s, self.traj_step)
+
+    def traj_key(self, elems):
+        """
+        key of the trajectory in self.traj_cache: geometry of the elements and parameters of the trajectory
+
+        :param elems: list of the elements
+        :return: tuple or None if the key can not be built
+        """
+        attrs = ["l", "angle", "tilt", "k1", "x_offs", "y_offs", "lperiod", "nperiods", "Kx", "Ky"]
+        key = (self.traj_step, self.energy, self.rk_traj, self.end_poles,
+               tuple((elem.__class__.__name__,) + tuple(getattr(elem, a, None) for a in attrs) for elem in elems))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def trajectory(self, elems):
+        """
+        trajectory of the reference particle through the elements. The array is allocated once
+        with the number of points traj_npoints() of the elements and filled in place.
+
+        :param elems: list of the elements
+        :return: trajectory, see prepare()
+        """
         p = Particle()
         beta = 1. if self.energy is None else np.sqrt(1. - 1./(self.energy/m_e_GeV)**2)
-        self.csr_traj = np.transpose([[0, p.x, p.y, p.s, p.px, p.py, 1.]])
-        if Undulator in [elem.__class__ for elem in lat.sequence[self.indx0:self.indx1+1]]:
-            self.rk_traj = True
-        for elem in lat.sequence[self.indx0:self.indx1+1]:
-
-            if elem.l == 0:
+        npoints = [self.traj_npoints(elem) for elem in elems]
+        traj = np.zeros((7, 1 + sum(npoints)))
+        traj[:, 0] = [0, p.x, p.y, p.s, p.px, p.py, 1.]
+        k = 1
+        step = self.traj_step
+        for elem, N in zip(elems, npoints):
+            if N == 0:
                 continue
             delta_s = elem.l
-            step = self.traj_step
+            sre0 = traj[:, k - 1]
+            SRE2 = traj[:, k:k + N]
+            k += N
             if elem.__class__ in [Bend, RBend, SBend] and not self.rk_traj:
                 if elem.angle != 0:
                     R = -elem.l/elem.angle
@@ -874,16 +1097,13 @@ class CSR(PhysProc):
                 Ry = R * np.sin(elem.tilt)
                 #B = energy*1e9*beta/(R*speed_of_light)
                 R_vect = [-Ry, Rx, 0]
-                self.csr_traj = arcline(self.csr_traj, delta_s, step, R_vect)
+                arcline_segment(sre0, delta_s, step, R_vect, out=SRE2)
 
-            elif elem.__class__ in [Bend, RBend, SBend, XYQuadrupole, Undulator] and self.energy is not None and self.rk_traj:
+            elif self.is_rk_elem(elem):
                 """
                 rk_track_in_field accepts initial conditions (initial coordinates) in the ParticleArray.rparticles format
                 from another hand the csr module use trajectory in another format (see csr.py)
                 """
-
-                if elem.l < 1e-10:
-                    continue
                 delta_z = delta_s
                 if elem.__class__ is XYQuadrupole:
                     hx = elem.k1 * elem.x_offs
@@ -893,12 +1113,8 @@ class CSR(PhysProc):
                     mag_field = lambda x, y, z: (Bx, By, 0)
 
                 elif elem.__class__ == Undulator:
-                    gamma = self.energy/m_e_GeV
                     ku = 2 * np.pi / elem.lperiod
                     delta_z = elem.lperiod * elem.nperiods
-                    # delta_s += 0.5* delta_z / (gamma ) ** 2 * (1 + 0.5 * (elem.Kx ) ** 2)
-
-                    delta_s = delta_z * (1 + 0.25*(elem.Kx/gamma) ** 2)
 
                     By = elem.Kx * m_e_eV * 2. * pi / (elem.lperiod * speed_of_light)
                     Bx = elem.Ky * m_e_eV * 2. * pi / (elem.lperiod * speed_of_light)
@@ -917,20 +1133,15 @@ class CSR(PhysProc):
                     Bx = -self.energy * 1e9 * beta * hy / speed_of_light
                     mag_field = lambda x, y, z: (Bx, By , 0)
 
-                sre0 = self.csr_traj[:, -1]
-                N = int(max(1, np.round(delta_s / step)))
-                SRE2 = np.zeros((7, N))
-
-                rparticle0 = np.array([[self.csr_traj[1, -1]], [self.csr_traj[4, -1] / self.csr_traj[6, -1]],
-                                       [self.csr_traj[2, -1]], [self.csr_traj[5, -1] / self.csr_traj[6, -1]], [0], [0]])
-                traj = rk_track_in_field(rparticle0, s_stop=delta_z, N=N + 1, energy=self.energy, mag_field=mag_field,
-                                         s_start=0)
+                rparticle0 = np.array([[sre0[1]], [sre0[4] / sre0[6]], [sre0[2]], [sre0[5] / sre0[6]], [0], [0]])
+                rk_traj = rk_track_in_field(rparticle0, s_stop=delta_z, N=N + 1, energy=self.energy,
+                                            mag_field=mag_field, s_start=0)
 
-                x = traj[0::9].flatten()
-                y = traj[2::9].flatten()
-                xp = traj[1::9].flatten()
-                yp = traj[3::9].flatten()
-                z = traj[4::9].flatten()
+                x = rk_traj[0::9].flatten()
+                y = rk_traj[2::9].flatten()
+                xp = rk_traj[1::9].flatten()
+                yp = rk_traj[3::9].flatten()
+                z = rk_traj[4::9].flatten()
                 xp2 = xp * xp
                 yp2 = yp * yp
                 zp = np.sqrt(1./(1. + xp2 + yp2))
@@ -959,10 +1170,37 @@ class CSR(PhysProc):
                 SRE2[4, :] = xp[1:]
                 SRE2[5, :] = yp[1:]
                 SRE2[6, :] = zp_s[1:]
-                self.csr_traj = np.append(self.csr_traj, SRE2, axis=1)
             else:
                 R_vect = [0, 0, 0.]
-                self.csr_traj = arcline(self.csr_traj, delta_s, step, R_vect )
+                arcline_segment(sre0, delta_s, step, R_vect, out=SRE2)
+        return traj
+
+    def prepare(self, lat):
+        """
+        calculation of trajectory in rectangular coordinates
+        calculation of the z_csr_start
+        :param lat: Magnetic Lattice
+        :return: self.csr_traj: trajectory. traj[0,:] - longitudinal coordinate,
+                                 traj[1,:], traj[2,:], traj[3,:] - rectangular coordinates, \
+                                 traj[4,:], traj[5,:], traj[6,:] - tangential unit vectors
+        """
+
+        # if pict_debug = True import matplotlib
+        if self.pict_debug:
+            self.plt = importlib.import_module("matplotlib.pyplot")
+            self.napply = 0
+            self.total_wake = 0
+
+
+        self.z_csr_start = sum([p.l for p in lat.sequence[:self.indx0]])
+        elems = lat.sequence[self.indx0:self.indx1+1]
+        if Undulator in [elem.__class__ for elem in elems]:
+            self.rk_traj = True
+        key = self.traj_key(elems)
+        if self.traj_cache is None or key is None:
+            self.csr_traj = self.trajectory(elems)
+        else:
+            self.csr_traj = self.traj_cache.get(key, lambda: self.trajectory(elems))
         # plot trajectory of the refernece particle
         if self.pict_debug:
             fig = self.plt.figure(figsize=(10, 8))
@@ -982,6 +1220,7 @@ class CSR(PhysProc):
             self.plt.show()
             # data = np.array([np.array(self.s), np.array(self.total_wake)])
             # np.savetxt("trajectory_cos.txt", self.csr_traj)
+        self.traj_hash = KernelCache.traj_hash(self.csr_traj)
         return self.csr_traj
 
     def apply(self, p_array, delta_s):
@@ -990,7 +1229,8 @@ class CSR(PhysProc):
             return
         s_cur = self.z0 - self.z_csr_start
         z = -p_array.tau()
-        ind_z_sort = np.argsort(z)
+        # particles sorted by tau from the binning shared with the other physics processes, z = -tau
+        ind_z_sort = p_array.binning().sort_index()[::-1]
         #SBINB, NBIN = subbin_bound(p_array.q_array, z[ind_z_sort], self.x_qbin, self.n_bin, self.m_bin)
         #B_params = [self.x_qbin, self.n_bin, self.m_bin, self.ip_method, self.sp, self.sigma_min]
         #s1, s2, Ns, lam_ds = Q2EQUI(p_array.q_array[ind_z_sort], B_params, SBINB, NBIN)
@@ -1008,11 +1248,12 @@ class CSR(PhysProc):
         h = max(1., self.apply_step/self.traj_step)
 
 
-        itr_ra = np.unique(-np.round(np.arange(-indx, -indx_prev, h))).astype(np.int)
+        itr_ra = np.unique(-np.round(np.arange(-indx, -indx_prev, h))).astype(int)
 
+        # the sum in the fixed order of itr_ra does not depend on the number of threads
         K1 = 0
-        for it in itr_ra:
-            K1 += self.CSR_K1(it, self.csr_traj, Ndw, gamma=gamma)
+        for K in self.kernels(itr_ra, Ndw, gamma):
+            K1 += K
         K1 /= len(itr_ra)
 
 
@@ -12,6 +12,11 @@ class Element(object):
     Element is a basic beamline building element
     Accelerator optics elements are subclasses of Element
     Arbitrary set of additional parameters can be attached if necessary
+
+    Assignment of any attribute (except transfer_map) marks the element as modified (self._modified = True),
+    so MagneticLattice.update_transfer_maps() recalculates only transfer maps of the modified elements.
+    In-place changes of the lists and arrays of numbers (e.g. Multipole.kn[1] = 0.1) are found by comparison with
+    the copies made by the lattice, see magnetic_lattice.element_snapshot().
     """
 
     def __init__(self, eid=None):
@@ -28,6 +33,12 @@ class Element(object):
         self.dtilt = 0.
         self.params = {}
 
+    def __setattr__(self, name, value):
+        # any change of the element parameters is recorded for MagneticLattice.update_transfer_maps()
+        object.__setattr__(self, name, value)
+        if name not in ("transfer_map", "_modified"):
+            object.__setattr__(self, "_modified", True)
+
     def __hash__(self):
         return hash(id(self))
         # return hash((self.id, self.__class__))
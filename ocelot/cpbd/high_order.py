@@ -6,6 +6,7 @@ from scipy import optimize
 from ocelot.common.globals import m_e_GeV, m_e_eV, speed_of_light
 from numpy.linalg import norm
 from ocelot.common.ocelog import *
+from ocelot.cpbd.r_matrix import MatrixCache
 
 _logger = logging.getLogger(__name__)
 
@@ -18,6 +19,8 @@ except:
     
 __MAD__ = True
 
+t_matrix_cache = MatrixCache(maxsize=2048)
+
 """
 differential equation:
 
@@ -88,6 +91,7 @@ I34  = Gy * sy    = (sy - s*cy)/(2*ky2)
 I346 = Gy * dx*sy = h/kx2*(I34 - I314)
 """
 
+@t_matrix_cache
 def t_nnn_transport(L, h, k1, k2, energy=0):
     """
     here is used the following set of variables:
@@ -452,6 +456,7 @@ def t_nnn_transport(L, h, k1, k2, energy=0):
     return T
 
 
+@t_matrix_cache
 def t_nnn_mad(L, h, k1, k2, energy=0):
     """
     Universal function to return second order matrix.
@@ -941,7 +946,7 @@ def moments_py(bx, by, Bx, By, Bz, dzk):
 moments = moments_py if not nb_flag else nb.jit(moments_py)
 
 
-def rk_track_in_field(y0, s_stop, N, energy, mag_field, s_start=0.):
+def rk_track_in_field(y0, s_stop, N, energy, mag_field, s_start=0., endpoint=False):
     """
     Runge-Kutta solver of the exact trajectory equations in the fixed coordinate system {X, Y, Z]}.
     X, Y - transverse coordinates, Z - longitudinal.
@@ -962,9 +967,12 @@ def rk_track_in_field(y0, s_stop, N, energy, mag_field, s_start=0.):
     :param energy: energy of particle in [GeV]
     :param mag_field: function. Bx, By, Bz = mag_field(X, Y, Z)
     :param s_start: starting longitudinal coordinate
+    :param endpoint: if True only two points of the trajectory are stored during the integration and
+                    the final point is returned together with the path length
     :return: array with length N*9- coordinates and magnetic fields on the trajectory
             [x, x', y, y', z, dE/pc, Bx, By, Bz, ...
             xn, xn', yn, yn', zn, zn', Bxn, Byn, Bzn]
+            if endpoint: array with length 10 - [xn, xn', yn, yn', zn, zn', Bxn, Byn, Bzn, path length]
     """
 
     # pc_ref = np.sqrt(energy**2 - m_e_GeV**2)
@@ -974,7 +982,8 @@ def rk_track_in_field(y0, s_stop, N, energy, mag_field, s_start=0.):
     gamma0 = energy/m_e_GeV
     charge = 1
     mass = 1 #in electron mass
-    u = np.zeros((N*9, np.shape(y0)[1]))
+    u = np.zeros((2*9 if endpoint else N*9, np.shape(y0)[1]))
+    path = np.zeros(np.shape(y0)[1])
     dz = h
     beta0 = np.sqrt(1. - 1./(gamma0*gamma0))
     gammai = gamma0*(1 + y0[5]*beta0)
@@ -987,11 +996,13 @@ def rk_track_in_field(y0, s_stop, N, energy, mag_field, s_start=0.):
     u[5, :] = y0[5]
     dzk = dz*k
     for i in range(N-1):
-        X = u[i*9 + 0]
-        Y = u[i*9 + 2]
-        Z = u[i*9 + 4]
-        bxconst = u[i*9 + 1]
-        byconst = u[i*9 + 3]
+        # with endpoint=True two rows of the array are used alternately
+        i0, i1 = ((i % 2) * 9, ((i + 1) % 2) * 9) if endpoint else (i * 9, (i + 1) * 9)
+        X = u[i0 + 0]
+        Y = u[i0 + 2]
+        Z = u[i0 + 4]
+        bxconst = u[i0 + 1]
+        byconst = u[i0 + 3]
         #bz = u[i*6 + 5]
         bx = bxconst
         by = byconst
@@ -999,9 +1010,9 @@ def rk_track_in_field(y0, s_stop, N, energy, mag_field, s_start=0.):
         ky1 = by*dz
         Bx, By, Bz = mag_field(X, Y, Z)
         mx1, my1 = moments(bx, by, Bx, By, Bz, dzk)
-        u[i*9 + 6] = Bx
-        u[i*9 + 7] = By
-        u[i*9 + 8] = Bz
+        u[i0 + 6] = Bx
+        u[i0 + 7] = By
+        u[i0 + 8] = Bz
         #K2
         bx = bxconst + mx1/2.
         by = byconst + my1/2.
@@ -1025,16 +1036,21 @@ def rk_track_in_field(y0, s_stop, N, energy, mag_field, s_start=0.):
         Bx, By, Bz = mag_field(X + kx3, Y + ky3, Z_n)
         mx4, my4 = moments(bx, by, Bx, By, Bz, dzk)
 
-        u[(i + 1) * 9 + 0] = X + 1/6.*(kx1 + 2.*(kx2 + kx3) + kx4)
-        u[(i + 1) * 9 + 1] = bxconst + 1/6.*(mx1 + 2.*(mx2 + mx3) + mx4) #// conversion in mrad
-        u[(i + 1) * 9 + 2] = Y + 1/6.*(ky1 + 2.*(ky2 + ky3) + ky4)
-        u[(i + 1) * 9 + 3] = byconst + 1/6.*(my1 + 2.*(my2 + my3) + my4)
-        u[(i + 1) * 9 + 4] = Z_n #u[i*9 + 4] + dz*np.sqrt(1 + u[(i+1)*9 + 1]**2 + u[(i+1)*9 + 3]**2)
-        u[(i + 1) * 9 + 5] = y0[5]
+        u[i1 + 0] = X + 1/6.*(kx1 + 2.*(kx2 + kx3) + kx4)
+        u[i1 + 1] = bxconst + 1/6.*(mx1 + 2.*(mx2 + mx3) + mx4) #// conversion in mrad
+        u[i1 + 2] = Y + 1/6.*(ky1 + 2.*(ky2 + ky3) + ky4)
+        u[i1 + 3] = byconst + 1/6.*(my1 + 2.*(my2 + my3) + my4)
+        u[i1 + 4] = Z_n #u[i*9 + 4] + dz*np.sqrt(1 + u[(i+1)*9 + 1]**2 + u[(i+1)*9 + 3]**2)
+        u[i1 + 5] = y0[5]
         # beta_z as 6-th coordinate
         #u[(i+1)*9 + 5] = betai/np.sqrt(1 + u[(i+1)*9 + 1]*u[(i+1)*9 + 1] + u[(i+1)*9 + 3]*u[(i+1)*9 + 3])#dGamma2 - (u[(i+1)*9 + 1]*u[(i+1)*9 + 1] + u[(i+1)*9 + 3]*u[(i+1)*9 + 3])/2.
 
-    u[(N-1)*9 + 6], u[(N-1)*9 + 7], u[(N-1)*9 + 8] = mag_field(u[(N-1)*9 + 0], u[(N-1)*9 + 2], u[(N-1)*9 + 4])
+        if endpoint:
+            path += (u[i1 + 4] - Z)*np.sqrt(1 + u[i1 + 1]*u[i1 + 1] + u[i1 + 3]*u[i1 + 3])
+    n = ((N - 1) % 2) * 9 if endpoint else (N - 1) * 9
+    u[n + 6], u[n + 7], u[n + 8] = mag_field(u[n + 0], u[n + 2], u[n + 4])
+    if endpoint:
+        return np.vstack((u[n:n + 9], path))
     return u
 
 
@@ -1058,28 +1074,24 @@ def rk_field(rparticles, s_start, s_stop, N, energy, mag_field, long_dynamics=Tr
     ref_path = 0
 
     if long_dynamics:
-        traj_ref = rk_track_in_field(np.array([[0], [0], [0], [0], [0], [0]]), s_stop, N, energy, mag_field, s_start=s_start)
-        x1 = traj_ref[1+9::9]
-        y1 = traj_ref[3+9::9]
-        dz = traj_ref[4+9::9] - traj_ref[4:-9:9]
-        ref_path = np.sum(dz*np.sqrt(1 + x1*x1 + y1*y1))
+        traj_ref = rk_track_in_field(np.array([[0], [0], [0], [0], [0], [0]]), s_stop, N, energy, mag_field,
+                                     s_start=s_start, endpoint=True)
+        ref_path = traj_ref[9, 0]
 
-    traj_data = rk_track_in_field(rparticles, s_stop, N, energy, mag_field, s_start=s_start)
+    # only the final coordinates and the path length are needed
+    traj_data = rk_track_in_field(rparticles, s_stop, N, energy, mag_field, s_start=s_start, endpoint=True)
 
     z_fin = rparticles[4, :]
 
     if long_dynamics:
-        x1 = traj_data[1+9::9, :]
-        y1 = traj_data[3+9::9, :]
-        dz = traj_data[4+9::9, :] - traj_data[4:-9:9, :]
-        z_fin += traj_data[4, :] + np.sum(dz*np.sqrt(1 + x1*x1 + y1*y1), axis=0) - ref_path
-
-    rparticles[0, :] = traj_data[(N-1)*9 + 0, :]
-    rparticles[1, :] = traj_data[(N-1)*9 + 1, :]
-    rparticles[2, :] = traj_data[(N-1)*9 + 2, :]
-    rparticles[3, :] = traj_data[(N-1)*9 + 3, :]
+        z_fin += s_start + traj_data[9, :] - ref_path
+
+    rparticles[0, :] = traj_data[0, :]
+    rparticles[1, :] = traj_data[1, :]
+    rparticles[2, :] = traj_data[2, :]
+    rparticles[3, :] = traj_data[3, :]
     rparticles[4, :] = z_fin
-    rparticles[5, :] = traj_data[(N-1)*9 + 5, :]
+    rparticles[5, :] = traj_data[5, :]
     return rparticles
 
 
@@ -1505,13 +1517,40 @@ def arcline( SREin, Delta_S, dS, R_vect ):
     :param R_vect: radius
     :return:
     """
+    SRE2 = arcline_segment(SREin[:, -1], Delta_S, dS, R_vect)
+    SRE = np.append(SREin, SRE2, axis=1)
+
+    return SRE
+
+
+def arcline_npoints(Delta_S, dS):
+    """
+    number of the trajectory points added by arcline()
+
+    :param Delta_S: length of the arc
+    :param dS: step
+    :return: N
+    """
+    return int(max(1, np.round(Delta_S/dS)))
+
+
+def arcline_segment(sre0, Delta_S, dS, R_vect, out=None):
+    """
+    points of the arc (or straight line) starting after the trajectory point sre0, see arcline()
+
+    :param sre0: last point of the trajectory, array (7)
+    :param Delta_S: length of the arc
+    :param dS: step
+    :param R_vect: radius
+    :param out: None or array (7, N) to be filled in place, N = arcline_npoints(Delta_S, dS)
+    :return: array (7, N)
+    """
 
     epsilon = 1e-8
 
-    sre0 = SREin[:, -1]
-    N = int(max(1, np.round(Delta_S/dS)))
+    N = arcline_npoints(Delta_S, dS)
     dS = float(Delta_S)/N
-    SRE2 = np.zeros((7, N))
+    SRE2 = np.zeros((7, N)) if out is None else out
     SRE2[0,:] = sre0[0] + np.arange(1, N+1)*dS
 
     R_vect_valid = False
@@ -1549,6 +1588,4 @@ def arcline( SREin, Delta_S, dS, R_vect ):
         SRE2[6-1, :] = e1[1]*co + e2[1]*si
         SRE2[7-1, :] = e1[2]*co + e2[2]*si
 
-    SRE = np.append(SREin, SRE2, axis=1)
-
-    return SRE
+    return SRE2
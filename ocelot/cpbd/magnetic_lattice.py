@@ -1,4 +1,4 @@
-from ocelot.cpbd.optics import MethodTM, lattice_transfer_map
+from ocelot.cpbd.optics import MethodTM, SecondTM, lattice_transfer_map, transfer_maps_mult, sym_matrix, unsym_matrix
 from ocelot.cpbd.elements import *
 import logging
 import numpy as np
@@ -105,6 +105,51 @@ flatten = lambda *n: (e for a in n
                       for e in (flatten(*a) if isinstance(a, (tuple, list)) else (a,)))
 
 
+def element_snapshot(element):
+    """
+    copy of the numerical mutable attributes of the element (lists, tuples and arrays of numbers, e.g. Multipole.kn,
+    Matrix.r) to detect their changes in place, which are not recorded by Element.__setattr__
+
+    :param element: Element
+    :return: dict
+    """
+    snapshot = {}
+    for name, value in element.__dict__.items():
+        if isinstance(value, np.ndarray):
+            snapshot[name] = value.copy()
+        elif isinstance(value, (list, tuple)):
+            try:
+                snapshot[name] = np.array(value, dtype=float)
+            except (TypeError, ValueError):
+                continue
+    return snapshot
+
+
+def same_snapshot(snapshot, snapshot_ref):
+    """
+    :return: True if the snapshots (see element_snapshot()) are equal
+    """
+    if snapshot_ref is None or snapshot.keys() != snapshot_ref.keys():
+        return False
+    for name, value in snapshot.items():
+        value_ref = snapshot_ref[name]
+        if value.shape != value_ref.shape or not np.array_equal(value, value_ref):
+            return False
+    return True
+
+
+def method_snapshot(method):
+    """
+    the method object and a copy of its parameters which define the transfer maps of the elements,
+    see MethodTM.create_tm()
+
+    :param method: MethodTM
+    :return: tuple
+    """
+    return (method, getattr(method, "global_method", None), getattr(method, "nkick", None),
+            dict(getattr(method, "params", {})))
+
+
 class MagneticLattice:
     """
     sequence - list of the elements,
@@ -121,6 +166,11 @@ class MagneticLattice:
 
         # create transfer map and calculate lattice length
         self.totalLen = 0
+        self._transfer_maps = {}
+        self._snapshots = {}
+        self._method_snapshot = None
+        self._tm_version = 0
+        self._prefix_maps = None
         if not EdgeUtil.check(self):
             EdgeUtil.add(self)
 
@@ -155,28 +205,191 @@ class MagneticLattice:
         except:
             return None
 
-    def update_transfer_maps(self):
+    def update_transfer_maps(self, full=False):
+        """
+        Method recalculates transfer maps of the elements and the lattice length.
+        By default, only transfer maps of the modified elements (see Element.__setattr__ and element_snapshot())
+        and elements which transfer maps were not created by this lattice are recalculated. Edges and CouplerKicks
+        are updated together with their Bends and Cavities. All transfer maps are recalculated if lattice.method
+        or its parameters were changed since the last update (see method_snapshot()).
+
+        :param full: if True, transfer maps of all elements are recalculated. Use it if
+                    non-numerical mutable attributes of the elements were changed in place.
+        :return: self
+        """
+        n = len(self.sequence)
+        snapshot = method_snapshot(self.method)
+        if self._method_snapshot is None or snapshot != self._method_snapshot:
+            full = True
+        modified = [full or self._is_modified(element) for element in self.sequence]
+        dirty = list(modified)
+        for i, element in enumerate(self.sequence):
+            if element.__class__ in (Edge, CouplerKick) and not dirty[i]:
+                dirty[i] = (i > 0 and modified[i - 1]) or (i < n - 1 and modified[i + 1])
+
         self.totalLen = 0
         for i, element in enumerate(self.sequence):
-            if element.__class__ == Undulator:
-                if element.field_file is not None:
-                    element.l = element.field_map.l * element.field_map.field_file_rep
-                    if element.field_map.units == "mm":
-                        element.l = element.l*0.001
+            if dirty[i]:
+                if element.__class__ == Undulator:
+                    if element.field_file is not None:
+                        element.l = element.field_map.l * element.field_map.field_file_rep
+                        if element.field_map.units == "mm":
+                            element.l = element.l*0.001
+
+                if element.__class__ == Edge:
+
+                    self.update_endings(lat_index=i, element=element, body_elements=(Bend, RBend, SBend), element_util=EdgeUtil)
+
+                if element.__class__ == CouplerKick:
+                    self.update_endings(lat_index=i, element=element, body_elements=(Cavity, ), element_util=CouplerKickUtil)
+
+                element.transfer_map = self.method.create_tm(element)
+                _logger.debug("update: " + element.transfer_map.__class__.__name__)
+                if 'pulse' in element.__dict__: element.transfer_map.pulse = element.pulse
             self.totalLen += element.l
 
-            if element.__class__ == Edge:
+        for i, element in enumerate(self.sequence):
+            if dirty[i]:
+                element._modified = False
+                self._snapshots[element] = element_snapshot(element)
+        self._transfer_maps = {element: element.transfer_map for element in self.sequence}
+        self._snapshots = {element: self._snapshots[element] for element in self._transfer_maps}
+        self._method_snapshot = snapshot
+        if any(dirty):
+            self._tm_version += 1
+        self.update_element_positions()
+        return self
 
-                self.update_endings(lat_index=i, element=element, body_elements=(Bend, RBend, SBend), element_util=EdgeUtil)
+    def _is_modified(self, element):
+        """
+        element has to be updated if its parameters were changed (also in place, e.g. Multipole.kn[1] = 0.1)
+        or its transfer map was not created by this lattice
+        """
+        if getattr(element, "_modified", True) or "transfer_map" not in element.__dict__:
+            return True
+        if self._transfer_maps.get(element) is not element.transfer_map:
+            return True
+        return not same_snapshot(element_snapshot(element), self._snapshots.get(element))
 
-            if element.__class__ == CouplerKick:
-                self.update_endings(lat_index=i, element=element, body_elements=(Cavity, ), element_util=CouplerKickUtil)
+    def update_element_positions(self):
+        """
+        Method updates the cumulative positions of the element boundaries and the map element -> index.
+        It is called from update_transfer_maps(). Call it if lattice.sequence was changed in another way.
 
-            element.transfer_map = self.method.create_tm(element)
-            _logger.debug("update: " + element.transfer_map.__class__.__name__)
-            if 'pulse' in element.__dict__: element.transfer_map.pulse = element.pulse
+        self.s_positions[i] - position of the i-th element entrance, self.s_positions[-1] is the end of the lattice
+        self.elem_indices[elem] - index of the first appearance of the element in the lattice.sequence
+        :return: self
+        """
+        self.s_positions = np.concatenate(([0.], np.cumsum([element.l for element in self.sequence])))
+        self.elem_indices = {}
+        for i, element in enumerate(self.sequence):
+            if element not in self.elem_indices:
+                self.elem_indices[element] = i
         return self
 
+    def get_elem_index(self, element):
+        """
+        Method returns index of the element in lattice.sequence. Works as lattice.sequence.index(element) but O(1).
+
+        :param element: Element
+        :return: int
+        """
+        try:
+            return self.elem_indices[element]
+        except KeyError:
+            raise ValueError(str(element.id) + " is not in lattice.sequence")
+
+    def get_transfer_maps(self, start=None, stop=None, energy=0., order=1):
+        """
+        Method returns transfer maps from the entrance of the element start to the exit of the element stop.
+        The maps are calculated from the cumulative maps at the element boundaries which are cached in the lattice:
+        R(a -> b) = Rb * Ra^-1, B(a -> b) = Bb - R(a -> b) * Ba and T(a -> b) is found from the composition rule of
+        the second order maps (see transfer_maps_mult()).
+        The cumulative maps are calculated on demand up to the element stop and are recalculated only downstream
+        the first element which transfer map was changed by update_transfer_maps().
+        Note: call update_transfer_maps() after changing the element parameters or element.transfer_map.
+
+        :param start: Element, the first element. If None, the lattice start
+        :param stop: Element, the last element. If None, the lattice end
+        :param energy: beam energy at the lattice start [GeV]
+        :param order: 1 - only R and B are calculated, T is zero, 2 - R, T and B. T is calculated as in
+                      lattice_transfer_map(), i.e. lattice.T
+        :return: R - (6, 6), T - (6, 6, 6), B - (6, 1)
+        """
+        ia = 0 if start is None else self.get_elem_index(start)
+        ib = len(self.sequence) if stop is None else self.get_elem_index(stop) + 1
+        if ib < ia:
+            raise ValueError("element start must be upstream of element stop")
+        pm = self._update_prefix_maps(energy, ib, order)
+        R = np.copy(pm["R"][ib])
+        B = np.copy(pm["B"][ib])
+        T = np.copy(pm["T"][ib]) if order > 1 else np.zeros((6, 6, 6))
+        if ia > 0:
+            Ra_inv = np.linalg.inv(pm["R"][ia])
+            R = np.dot(R, Ra_inv)
+            B = B - np.dot(R, pm["B"][ia])
+            if order > 1:
+                T = T - np.einsum('in,njk->ijk', R, pm["T"][ia])
+                T = np.einsum('ijk,jl,km->ilm', T, Ra_inv, Ra_inv)
+        if order > 1:
+            T = unsym_matrix(T)
+        return R, T, B
+
+    def get_energy(self, stop=None, energy=0.):
+        """
+        Method returns the beam energy at the exit of the element stop, see get_transfer_maps()
+
+        :param stop: Element, the last element. If None, the lattice end
+        :param energy: beam energy at the lattice start [GeV]
+        :return: energy [GeV]
+        """
+        ib = len(self.sequence) if stop is None else self.get_elem_index(stop) + 1
+        pm = self._update_prefix_maps(energy, ib, 1)
+        return pm["E"][ib]
+
+    def _update_prefix_maps(self, energy, stop, order):
+        """
+        Method updates the cached cumulative transfer maps at the element boundaries up to boundary stop
+
+        :return: dict with cumulative maps
+        """
+        n = len(self.sequence)
+        pm = self._prefix_maps
+        if pm is None or pm["energy"] != energy or pm["order"] < order or len(pm["tms"]) != n:
+            pm = {"energy": energy, "order": order, "valid": 1, "tms": [None] * n,
+                  "R": np.zeros((n + 1, 6, 6)), "B": np.zeros((n + 1, 6, 1)), "E": np.zeros(n + 1),
+                  "T": np.zeros((n + 1, 6, 6, 6)) if order > 1 else None,
+                  "version": self._tm_version}
+            pm["R"][0] = np.eye(6)
+            pm["E"][0] = energy
+            self._prefix_maps = pm
+
+        # the maps are valid up to the first element which transfer map was changed by update_transfer_maps()
+        if pm["version"] != self._tm_version:
+            for i in range(pm["valid"] - 1):
+                if self.sequence[i].transfer_map is not pm["tms"][i]:
+                    pm["valid"] = i + 1
+                    break
+            pm["version"] = self._tm_version
+
+        for i in range(pm["valid"], stop + 1):
+            tm = self.sequence[i - 1].transfer_map
+            E = pm["E"][i - 1]
+            Rb = tm.R(E)
+            if pm["order"] > 1:
+                if isinstance(tm, SecondTM):
+                    Tb = sym_matrix(np.copy(tm.T_tilt(E)))
+                else:
+                    Tb = np.zeros((6, 6, 6))
+                pm["R"][i], pm["T"][i] = transfer_maps_mult(pm["R"][i - 1], pm["T"][i - 1], Rb, Tb)
+            else:
+                pm["R"][i] = np.dot(Rb, pm["R"][i - 1])
+            pm["B"][i] = np.dot(Rb, pm["B"][i - 1]) + tm.B(E)
+            pm["E"][i] = E + tm.delta_e
+            pm["tms"][i - 1] = tm
+        pm["valid"] = max(pm["valid"], stop + 1)
+        return pm
+
     def update_endings(self, lat_index, element, body_elements, element_util):
 
         if element_util.suffix_1 in element.id:
@@ -102,7 +102,9 @@ def match(lat, constr, vars, tw, verbose=True, max_iter=1000, method='simplex',
         err = 0.0
         if "periodic" in constr.keys():
             if constr["periodic"] == True:
-                tw_loc = periodic_twiss(tw_loc, lattice_transfer_map(lat, tw.E))
+                # the cached maps of the lattice are refreshed only by update_transfer_maps()
+                lat.update_transfer_maps()
+                tw_loc = periodic_twiss(tw_loc, lat.get_transfer_maps(energy=tw.E)[0])
                 tw0 = deepcopy(tw_loc)
                 if tw_loc == None:
                     print("########")
@@ -334,7 +336,9 @@ def match_beam(lat, constr, vars, p_array, navi, verbose=True, max_iter=1000, me
         err = 0.0
         if "periodic" in constr.keys():
             if constr["periodic"] is True:
-                tw_loc = periodic_twiss(tw_loc, lattice_transfer_map(lat, tw_loc.E))
+                # the cached maps of the lattice are refreshed only by update_transfer_maps()
+                lat.update_transfer_maps()
+                tw_loc = periodic_twiss(tw_loc, lat.get_transfer_maps(energy=tw_loc.E)[0])
                 tw0 = deepcopy(tw_loc)
                 if tw_loc is None:
                     print("########")
@@ -570,16 +574,21 @@ def closed_orbit(lattice, eps_xy=1.e-7, eps_angle=1.e-7, energy=0):
     :param eps_angle: tolerance on the angles of beam in the start and end of lattice
     :return: class Particle
     """
-    R = lattice_transfer_map(lattice, energy)
+    R, T, B = lattice.get_transfer_maps(energy=energy, order=2)
+    # the lattice attributes which are set by lattice_transfer_map()
+    lattice.R, lattice.T, lattice.B = R, T, B
+    lattice.T_sym = sym_matrix(np.copy(T))
+    lattice.E = lattice.get_energy(energy=energy)
     smult = SecondOrderMult()
+    sparse = sparse_second_order(T)
 
     ME = np.eye(4) - R[:4, :4]
-    P = np.dot(inv(ME), lattice.B[:4])
+    P = np.dot(inv(ME), B[:4])
 
     def errf(x):
         X = np.array([[x[0]], [x[1]], [x[2]], [x[3]], [0], [0]] )
-        smult.numpy_apply(X, R, lattice.T)
-        X += lattice.B
+        smult.numpy_apply(X, R, T, sparse=sparse)
+        X += B
         err = np.sum([1000*(X[i, 0] - x[i])**2 for i in range(4)])
         return err
 
@@ -2,7 +2,7 @@ __author__ = 'Sergey'
 
 from numpy.linalg import inv
 from math import factorial
-from ocelot.cpbd.beam import Particle, Twiss, ParticleArray
+from ocelot.cpbd.beam import Particle, Twiss, ParticleArray, TwissTable
 from ocelot.cpbd.physics_proc import RectAperture, EllipticalAperture
 from ocelot.cpbd.high_order import *
 from ocelot.cpbd.r_matrix import *
@@ -21,44 +21,130 @@ except ImportError as error:
     nb_flag = False
 
 
+def sparse_second_order(T):
+    """
+    Function returns sparse representation of the second order matrix T.
+    Symmetric terms T[i, j, k] and T[i, k, j] are merged and only pairs (j, k), j <= k, with at least
+    one nonzero coefficient are kept, so that
+
+    sum_jk T[i, j, k] * X[j] * X[k] = sum_p coefs[i, p] * X[pairs[p, 0]] * X[pairs[p, 1]]
+
+    :param T: second order matrix (6, 6, 6)
+    :return: pairs - int array (n, 2), coefs - array (6, n)
+    """
+    Tm = T + np.transpose(T, (0, 2, 1))
+    diag = np.arange(6)
+    Tm[:, diag, diag] = T[:, diag, diag]
+    j, k = np.triu_indices(6)
+    coefs = Tm[:, j, k]
+    nonzero = np.any(coefs != 0., axis=0)
+    pairs = np.ascontiguousarray(np.vstack((j[nonzero], k[nonzero])).T)
+    return pairs, np.ascontiguousarray(coefs[:, nonzero])
+
+
+def sparse_second_order_mult_py(X, R, pairs, coefs, dx=0., dy=0., cos_tilt=1., sin_tilt=0.):
+    """
+    In place transformation X -> R*X + T*X*X, where T is given by its sparse representation (pairs, coefs),
+    see sparse_second_order(). The misalignments are applied to every particle as in
+    transform_vec_ent() and transform_vec_ext().
+    """
+    npairs = pairs.shape[0]
+    misaligned = dx != 0. or dy != 0. or sin_tilt != 0.
+    x = np.zeros(6)
+    xx = np.zeros(npairs)
+    for n in range(X.shape[1]):
+        for i in range(6):
+            x[i] = X[i, n]
+        if misaligned:
+            x0 = x[0] - dx
+            x2 = x[2] - dy
+            x1 = x[1]
+            x3 = x[3]
+            x[0] = cos_tilt * x0 + sin_tilt * x2
+            x[1] = cos_tilt * x1 + sin_tilt * x3
+            x[2] = -sin_tilt * x0 + cos_tilt * x2
+            x[3] = -sin_tilt * x1 + cos_tilt * x3
+        for p in range(npairs):
+            xx[p] = x[pairs[p, 0]] * x[pairs[p, 1]]
+        for i in range(6):
+            x_new = 0.
+            for j in range(6):
+                x_new += R[i, j] * x[j]
+            for p in range(npairs):
+                x_new += coefs[i, p] * xx[p]
+            X[i, n] = x_new
+        if misaligned:
+            x0 = X[0, n]
+            x1 = X[1, n]
+            x2 = X[2, n]
+            x3 = X[3, n]
+            X[0, n] = cos_tilt * x0 - sin_tilt * x2 + dx
+            X[1, n] = cos_tilt * x1 - sin_tilt * x3
+            X[2, n] = sin_tilt * x0 + cos_tilt * x2 + dy
+            X[3, n] = sin_tilt * x1 + cos_tilt * x3
+
+
+sparse_second_order_mult = sparse_second_order_mult_py if nb_flag is not True else nb.njit(sparse_second_order_mult_py)
+
+
 class SecondOrderMult:
     """
-    The class includes three different methods for transforming the particle
-    coordinates:
+    The class includes two different methods for transforming the particle
+    coordinates with the first (R) and second (T) order matrices:
 
-    1. NUMBA module - DEACTIVATED, because new numpy implementation shows higher performance.
-        Slightly faster than NUMPY for simulations with a large number of time
-        steps. Uses full matrix multiplication.
+    1. NUMBA module - used if NUMBA is installed.
+        Loop over particles with the sparse representation of the T matrix.
 
     2. NUMPY module
-        Base method to be used.
-        Uses full matrix multiplication.
-
+        Base method.
+        Only nonzero terms of the T matrix are applied, see sparse_second_order(). The products X[j]*X[k] are written
+        into one buffer and R and T are applied with one matrix multiplication.
+
+    The sparse representation of T can be passed as the argument sparse=(pairs, coefs), otherwise it is
+    calculated from T (see SecondTM.sparse_second_order() which calculates it once per T matrix).
+    The NUMBA kernel includes misalignments (dx, dy, tilt) in the loop over particles and does not allocate
+    arrays of the particle size. The NUMPY method processes the particles in chunks of chunk_size through one
+    buffer, the misalignments are applied to each chunk.
     """
     def __init__(self):
         self.full_matrix = False
+        self.chunk_size = 4096
 
-        if nb_flag and False:
+        if nb_flag:
             # print("SecondTM: NUMBA")
-            self.tmat_multip = nb.njit()(self.numba_apply)
+            self.tmat_multip = self.numba_apply
         else:
             # print("SecondTM: Numpy")
             self.tmat_multip = self.numpy_apply
 
-    @staticmethod
-    def numba_apply(X, R, T):
-        Xcopy = np.copy(X)
-        for n in range(X.shape[1]):
-            for i in range(6):
-                x_new = 0
-                for j in range(6):
-                    x_new += R[i, j]*Xcopy[j, n]
-                    for k in range(6):
-                        x_new += T[i, j, k] * Xcopy[j, n] * Xcopy[k, n]
-                X[i, n] = x_new
-
-    def numpy_apply(self, X, R, T):
-        X[:] = np.matmul(R, X) + np.einsum('ijk,j...,k...->i...', T, X, X)
+    def numba_apply(self, X, R, T, dx=0., dy=0., tilt=0., sparse=None):
+        pairs, coefs = sparse_second_order(T) if sparse is None else sparse
+        sparse_second_order_mult(X, np.ascontiguousarray(R), pairs, coefs, dx, dy, np.cos(tilt), np.sin(tilt))
+
+    def numpy_apply(self, X, R, T, dx=0., dy=0., tilt=0., sparse=None):
+        pairs, coefs = sparse_second_order(T) if sparse is None else sparse
+        misaligned = dx != 0 or dy != 0 or tilt != 0
+        RT = np.hstack((R, coefs))
+        if misaligned:
+            d = np.array([[dx], [0.], [dy], [0.], [0.], [0.]])
+            rot_ent = rot_mtx(tilt)
+            rot_ext = rot_mtx(-tilt)
+        n = X.shape[1]
+        # Y = [X, X[j0]*X[k0], X[j1]*X[k1], ...], X = [R, coefs] * Y, one buffer for all chunks of the particles
+        Y = np.empty((6 + len(pairs), min(n, self.chunk_size)))
+        for start in range(0, n, self.chunk_size):
+            Xc = X[:, start:start + self.chunk_size]
+            Yc = Y[:, :Xc.shape[1]]
+            if misaligned:
+                np.matmul(rot_ent, Xc - d, out=Yc[:6])
+            else:
+                Yc[:6] = Xc
+            for p, (j, k) in enumerate(pairs):
+                np.multiply(Yc[j], Yc[k], out=Yc[6 + p])
+            if misaligned:
+                Xc[:] = np.matmul(rot_ext, np.matmul(RT, Yc)) + d
+            else:
+                np.matmul(RT, Yc, out=Xc)
 
 
 def transform_vec_ent(X, dx, dy, tilt):
@@ -101,7 +187,56 @@ def transfer_maps_mult_py(Ra, Ta, Rb, Tb):
     return Rc, Tc
 
 
-transfer_maps_mult = transfer_maps_mult_py if nb_flag is not True else nb.jit(transfer_maps_mult_py)
+def transfer_maps_mult_np(Ra, Ta, Rb, Tb):
+    """
+    NumPy version of transfer_maps_mult_py()
+
+    cell = [A, B]
+    Rc = Rb * Ra
+    Tc_ijk = Rb_il * Ta_ljk + Tb_ilm * Ra_lj * Ra_mk
+    """
+    Rc = np.dot(Rb, Ra)
+    Tc = np.tensordot(Rb, Ta, axes=(1, 0))
+    Tc += np.tensordot(np.tensordot(Tb, Ra, axes=(1, 0)), Ra, axes=(1, 0))
+    return Rc, Tc
+
+
+transfer_maps_mult = transfer_maps_mult_np if nb_flag is not True else nb.jit(transfer_maps_mult_py)
+
+
+def transfer_maps_mult_batch(Rs, Ts, Bs=None):
+    """
+    Composition of the stack of maps [M_0, M_1, ..., M_n-1] (M_0 is the first) in one map M = M_n-1 o ... o M_0.
+    Neighbouring maps are composed pairwise for all pairs at once (see transfer_maps_mult()), so the number of
+    the (batched) steps is log2(n).
+
+    :param Rs: array (n, 6, 6) - first order matrices
+    :param Ts: array (n, 6, 6, 6) - second order matrices
+    :param Bs: None or array (n, 6, 1) - offsets, X1 = R*X0 + B
+    :return: R, T, B (if Bs is not None)
+    """
+    Rs = np.asarray(Rs, dtype=float)
+    Ts = np.asarray(Ts, dtype=float)
+    if Bs is not None:
+        Bs = np.asarray(Bs, dtype=float)
+    if len(Rs) == 0:
+        if Bs is None:
+            return np.eye(6), np.zeros((6, 6, 6))
+        return np.eye(6), np.zeros((6, 6, 6)), np.zeros((6, 1))
+    while len(Rs) > 1:
+        npair = len(Rs) // 2
+        Ra, Ta = Rs[0:2 * npair:2], Ts[0:2 * npair:2]
+        Rb, Tb = Rs[1:2 * npair:2], Ts[1:2 * npair:2]
+        Rc = np.matmul(Rb, Ra)
+        Tc = np.einsum('nil,nljk->nijk', Rb, Ta) + np.einsum('nilm,nlj,nmk->nijk', Tb, Ra, Ra, optimize=True)
+        if Bs is not None:
+            Bc = np.matmul(Rb, Bs[0:2 * npair:2]) + Bs[1:2 * npair:2]
+            Bs = np.concatenate((Bc, Bs[2 * npair:]))
+        Rs = np.concatenate((Rc, Rs[2 * npair:]))
+        Ts = np.concatenate((Tc, Ts[2 * npair:]))
+    if Bs is None:
+        return Rs[0], Ts[0]
+    return Rs[0], Ts[0], Bs[0]
 
 
 def transfer_map_rotation(R, T, tilt):
@@ -291,14 +426,24 @@ class SecondTM(TransferMap):
 
         self.T_tilt = lambda energy: transfer_map_rotation(self.r_z_no_tilt(self.length, energy),
                                                              self.t_mat_z_e(self.length, energy), self.tilt)[1]
+        self.sparse_T = None
 
-    def t_apply(self, R, T, X, dx, dy, tilt, U5666=0.):
-        if dx != 0 or dy != 0 or tilt != 0:
-            X = transform_vec_ent(X, dx, dy, tilt)
-        self.multiplication(X, R, T)
-        if dx != 0 or dy != 0 or tilt != 0:
-            X = transform_vec_ext(X, dx, dy, tilt)
+    def sparse_second_order(self, T):
+        """
+        sparse representation of the matrix T (see sparse_second_order()). It is calculated once and
+        recalculated only if T is changed, e.g. for another energy.
+
+        :param T: second order matrix
+        :return: pairs, coefs
+        """
+        sparse_T = self.sparse_T
+        if sparse_T is None or (sparse_T[0] is not T and not np.array_equal(sparse_T[0], T)):
+            sparse_T = (T,) + sparse_second_order(T)
+            self.sparse_T = sparse_T
+        return sparse_T[1:]
 
+    def t_apply(self, R, T, X, dx, dy, tilt, U5666=0.):
+        self.multiplication(X, R, T, dx, dy, tilt, sparse=self.sparse_second_order(T))
         return X
 
     def __call__(self, s):
@@ -901,6 +1046,10 @@ def lattice_transfer_map(lattice, energy):
     Ta = np.zeros((6, 6, 6))
     Ba = np.zeros((6, 1))
     E = energy
+    if nb_flag is not True:
+        # without NUMBA the element maps are composed by batched pairwise reduction
+        n = len(lattice.sequence)
+        Rs, Ts, Bs = np.zeros((n, 6, 6)), np.zeros((n, 6, 6, 6)), np.zeros((n, 6, 1))
     for i, elem in enumerate(lattice.sequence):
         Rb = elem.transfer_map.R(E)
         Bb = elem.transfer_map.B(E)
@@ -908,11 +1057,16 @@ def lattice_transfer_map(lattice, energy):
         if isinstance(elem.transfer_map, SecondTM):  # elem.transfer_map.__class__ == SecondTM:
             Tb = np.copy(elem.transfer_map.T_tilt(E))
             Tb = sym_matrix(Tb)
-            Ra, Ta = transfer_maps_mult(Ra, Ta, Rb, Tb)
         else:
-            Ra, Ta = transfer_maps_mult(Ra, Ta, Rb, Tb=np.zeros((6, 6, 6)))
-        Ba = np.dot(Rb, Ba) + Bb
+            Tb = np.zeros((6, 6, 6))
+        if nb_flag is not True:
+            Rs[i], Ts[i], Bs[i] = Rb, Tb, Bb
+        else:
+            Ra, Ta = transfer_maps_mult(Ra, Ta, Rb, Tb)
+            Ba = np.dot(Rb, Ba) + Bb
         E += elem.transfer_map.delta_e
+    if nb_flag is not True:
+        Ra, Ta, Ba = transfer_maps_mult_batch(Rs, Ts, Bs)
     lattice.E = E
     lattice.T_sym = Ta
     lattice.T = unsym_matrix(deepcopy(Ta))
@@ -1001,14 +1155,95 @@ def periodic_twiss(tws, R):
     return tws
 
 
-def twiss(lattice, tws0=None, nPoints=None):
+def cumulative_matmul(A):
+    """
+    Cumulative matrix product C[i] = A[i] * A[i-1] * ... * A[0], calculated by log2(N) batched multiplications.
+
+    :param A: array of matrices (N, n, n)
+    :return: array (N, n, n)
+    """
+    C = np.array(A, dtype=float)
+    d = 1
+    while d < len(C):
+        C[d:] = np.matmul(C[d:], C[:-d])
+        d *= 2
+    return C
+
+
+def twiss_table(lattice, tws0):
+    """
+    Vectorized propagation of the twiss parameters through the lattice (twiss parameters at the end of each element).
+    The R matrices of all elements are stacked in (N, 6, 6) array, the optical functions are calculated from
+    the cumulative products of the horizontal and vertical blocks. The result is the same as for
+    trace_obj(lattice, tws0), see TransferMap.map_x_twiss().
+
+    :param lattice: MagneticLattice
+    :param tws0: initial Twiss
+    :return: TwissTable
+    """
+    n = len(lattice.sequence)
+    M = np.zeros((n, 6, 6))
+    E = np.zeros(n + 1)
+    length = np.zeros(n)
+    E[0] = tws0.E
+    for i, elem in enumerate(lattice.sequence):
+        tm = elem.transfer_map
+        M[i] = tm.R(E[i])
+        length[i] = tm.length
+        E[i + 1] = E[i]
+        if abs(tm.delta_e) > 1.e-10:
+            k = np.sqrt((E[i] + tm.delta_e) / E[i])
+            M[i, 0:2, 0:2] *= k
+            M[i, 2:4, 2:4] *= k
+            E[i + 1] = E[i] + tm.delta_e
+
+    table = TwissTable(n + 1)
+    for name in TwissTable.columns:
+        getattr(table, name)[0] = getattr(tws0, name)
+    for name in ["emit_x", "emit_y", "emit_xn", "emit_yn", "x", "y", "xp", "yp", "p"]:
+        getattr(table, name)[1:] = getattr(tws0, name)
+    table.E[:] = E
+    table.s[1:] = tws0.s + np.cumsum(length)
+    table.id = [tws0.id] + [elem.id for elem in lattice.sequence]
+
+    for i, (beta, alpha, gamma, D, Dp, mu) in enumerate([("beta_x", "alpha_x", "gamma_x", "Dx", "Dxp", "mux"),
+                                                          ("beta_y", "alpha_y", "gamma_y", "Dy", "Dyp", "muy")]):
+        j = 2 * i
+        A = np.zeros((n, 3, 3))
+        A[:, :2, :2] = M[:, j:j + 2, j:j + 2]
+        A[:, :2, 2] = M[:, j:j + 2, 5]
+        A[:, 2, 2] = 1.
+        C = cumulative_matmul(A)
+        b0, a0, g0 = getattr(tws0, beta), getattr(tws0, alpha), getattr(tws0, gamma)
+        b = C[:, 0, 0] * C[:, 0, 0] * b0 - 2 * C[:, 0, 1] * C[:, 0, 0] * a0 + C[:, 0, 1] * C[:, 0, 1] * g0
+        a = -C[:, 0, 0] * C[:, 1, 0] * b0 + (C[:, 0, 1] * C[:, 1, 0] + C[:, 1, 1] * C[:, 0, 0]) * a0 - C[:, 0, 1] * C[:, 1, 1] * g0
+        getattr(table, beta)[1:] = b
+        getattr(table, alpha)[1:] = a
+        getattr(table, gamma)[1:] = (1. + a * a) / b
+        getattr(table, D)[1:] = C[:, 0, 0] * getattr(tws0, D) + C[:, 0, 1] * getattr(tws0, Dp) + C[:, 0, 2]
+        getattr(table, Dp)[1:] = C[:, 1, 0] * getattr(tws0, D) + C[:, 1, 1] * getattr(tws0, Dp) + C[:, 1, 2]
+
+        # phase advance of each element
+        b_prev = np.append(b0, b[:-1])
+        a_prev = np.append(a0, a[:-1])
+        denom = M[:, j, j] * b_prev - M[:, j, j + 1] * a_prev
+        with np.errstate(divide='ignore', invalid='ignore'):
+            d_mu = np.where(denom == 0., np.pi / 2. * np.sign(M[:, j, j + 1]), np.arctan(M[:, j, j + 1] / denom))
+        d_mu[d_mu < 0] += np.pi
+        getattr(table, mu)[1:] = getattr(tws0, mu) + np.cumsum(d_mu)
+    return table
+
+
+def twiss(lattice, tws0=None, nPoints=None, return_table=False):
     """
     twiss parameters calculation
 
     :param lattice: lattice, MagneticLattice() object
     :param tws0: initial twiss parameters, Twiss() object. If None, try to find periodic solution.
     :param nPoints: number of points per cell. If None, then twiss parameters are calculated at the end of each element.
-    :return: list of Twiss() objects
+    :param return_table: if True, returns TwissTable. If nPoints is None, the twiss parameters are calculated
+                        with vectorized propagation, see twiss_table()
+    :return: list of Twiss() objects or TwissTable
     """
     if tws0 is None:
         tws0 = periodic_twiss(tws0, lattice_transfer_map(lattice, energy=0.))
@@ -1024,6 +1259,10 @@ def twiss(lattice, tws0=None, nPoints=None):
             tws0.gamma_x = (1. + tws0.alpha_x ** 2) / tws0.beta_x
             tws0.gamma_y = (1. + tws0.alpha_y ** 2) / tws0.beta_y
 
+        if return_table:
+            if nPoints is None:
+                return twiss_table(lattice, tws0)
+            return TwissTable.from_list(trace_obj(lattice, tws0, nPoints))
         twiss_list = trace_obj(lattice, tws0, nPoints)
         return twiss_list
     else:
@@ -1031,14 +1270,14 @@ def twiss(lattice, tws0=None, nPoints=None):
         return None
 
 
-def twiss_fast(lattice, tws0=None):
+def twiss_fast(lattice, tws0=None, return_table=False):
     """
     twiss parameters calculation
 
     :param lattice: lattice, MagneticLattice() object
     :param tws0: initial twiss parameters, Twiss() object. If None, try to find periodic solution.
-    :param nPoints: number of points per cell. If None, then twiss parameters are calculated at the end of each element.
-    :return: list of Twiss() objects
+    :param return_table: if True, returns TwissTable
+    :return: list of Twiss() objects or TwissTable
     """
     if tws0 is None:
         tws0 = periodic_twiss(tws0, lattice_transfer_map(lattice, energy=0.))
@@ -1059,6 +1298,8 @@ def twiss_fast(lattice, tws0=None):
             tws0 = e.transfer_map * tws0
             tws0.id = e.id
             obj_list.append(tws0)
+        if return_table:
+            return TwissTable.from_list(obj_list)
         return obj_list
     else:
         _logger.warning(' twiss_fast: Twiss: no periodic solution')
@@ -1093,10 +1334,10 @@ class ProcessTable:
     def add_physics_proc(self, physics_proc, elem1, elem2):
         physics_proc.start_elem = elem1
         physics_proc.end_elem = elem2
-        physics_proc.indx0 = self.lat.sequence.index(elem1)
-        physics_proc.indx1 = self.lat.sequence.index(elem2)
-        physics_proc.s_start = np.sum(np.array([elem.l for elem in self.lat.sequence[:physics_proc.indx0]]))
-        physics_proc.s_stop = np.sum(np.array([elem.l for elem in self.lat.sequence[:physics_proc.indx1]]))
+        physics_proc.indx0 = self.lat.get_elem_index(elem1)
+        physics_proc.indx1 = self.lat.get_elem_index(elem2)
+        physics_proc.s_start = self.lat.s_positions[physics_proc.indx0]
+        physics_proc.s_stop = self.lat.s_positions[physics_proc.indx1]
         self.searching_kick_proc(physics_proc, elem1)
         physics_proc.counter = physics_proc.step
         physics_proc.prepare(self.lat)
@@ -1113,6 +1354,11 @@ class Navigator:
     lattice - MagneticLattice
     Attributes:
         unit_step = 1 [m] - unit step for all physics processes
+        compiled = False - if True, consecutive linear transfer maps between two stops of the Navigator are fused
+                   in one matrix multiplication (ParticleArray tracking only)
+        proc_threads = 1 - number of threads for the kick-additive physics processes (PhysProc.kick_additive)
+                   applied on the same stop, 1 - the processes are applied one by one,
+                   e.g. OCELOT_NUM_THREADS - the processes are calculated concurrently
     Methods:
         add_physics_proc(physics_proc, elem1, elem2)
             physics_proc - physics process, can be CSR, SpaceCharge or Wake,
@@ -1131,6 +1377,8 @@ class Navigator:
         self.unit_step = 1  # unit step for physics processes
         self.proc_kick_elems = []
         self.kill_process = False # for case when calculations are needed to terminated e.g. from gui
+        self.compiled = False  # if True, linear transfer maps between stops are fused in one map, see fuse_linear_maps()
+        self.proc_threads = 1  # threads for the kick-additive physics processes, see apply_phys_procs()
 
     def reset_position(self):
         """
@@ -1176,8 +1424,8 @@ class Navigator:
         :param stop: element, activate apertures up to 'stop' element
         :return:
         """
-        id1 = self.lat.sequence.index(start) if start is not None else None
-        id2 = self.lat.sequence.index(stop) if stop is not None else None
+        id1 = self.lat.get_elem_index(start) if start is not None else None
+        id2 = self.lat.get_elem_index(stop) if stop is not None else None
         for elem in self.lat.sequence[id1:id2]:
             if elem.__class__ is Aperture:
                 if elem.type == "rect":
@@ -1193,7 +1441,7 @@ class Navigator:
         phys_steps_red = phys_steps - dz
         if len(processes) != 0:
             nearest_stop_elem = min([proc.indx1 for proc in processes])
-            L_stop = np.sum(np.array([elem.l for elem in self.lat.sequence[:nearest_stop_elem]]))
+            L_stop = self.lat.s_positions[nearest_stop_elem]
             if self.z0 + dz > L_stop:
                dz = L_stop - self.z0
 
@@ -1209,10 +1457,10 @@ class Navigator:
 
         phys_steps = phys_steps_red + dz
 
-        # check kick processes
+        # check kick processes. kick_proc_list is sorted by s_start (see ProcessTable.searching_kick_proc)
         kick_list = self.process_table.kick_proc_list
         kick_pos = np.array([proc.s_start for proc in kick_list])
-        indx = np.argwhere(self.z0 < kick_pos)
+        indx = np.arange(np.searchsorted(kick_pos, self.z0, side="right"), len(kick_pos)).reshape(-1, 1)
 
         if 0 in kick_pos and self.z0 == 0 and self.n_elem == 0:
             indx0 = np.argwhere(self.z0 == kick_pos)
@@ -1297,7 +1545,7 @@ class Navigator:
             processes = proc_list
             n_elems = len(self.lat.sequence)
             if n_elems >= self.n_elem + 1:
-                L = np.sum(np.array([elem.l for elem in self.lat.sequence[:self.n_elem + 1]]))
+                L = self.lat.s_positions[self.n_elem + 1]
             else:
                 L = self.lat.totalLen
             dz = L - self.z0
@@ -1364,6 +1612,53 @@ def merge_maps(t_maps):
     return t_maps_new
 
 
+def fuse_linear_maps(t_maps, energy):
+    """
+    Function fuses runs of consecutive linear transfer maps (class TransferMap) into one TransferMap with
+    R and B matrices precalculated for the given energy. Non-linear maps are kept as they are.
+    Beam energy is propagated through all maps, so the fused maps are valid only for the energy "energy"
+    at the beginning of the list.
+
+    :param t_maps: list of TransferMaps, e.g. from get_map()
+    :param energy: beam energy [GeV] at the beginning of the t_maps
+    :return: new list of TransferMaps
+    """
+    t_maps_new = []
+    run = []
+    E = energy
+    E_run = energy
+    for tm in t_maps + [None]:
+        if tm.__class__ == TransferMap:
+            if len(run) == 0:
+                E_run = E
+            run.append(tm)
+            E += tm.delta_e
+            continue
+
+        if len(run) == 1:
+            t_maps_new.append(run[0])
+        elif len(run) > 1:
+            R = np.eye(6)
+            B = np.zeros((6, 1))
+            E_i = E_run
+            for tm_i in run:
+                Ri = tm_i.R(E_i)
+                B = np.dot(Ri, B) + tm_i.B(E_i)
+                R = np.dot(Ri, R)
+                E_i += tm_i.delta_e
+            fused = TransferMap()
+            fused.R = lambda energy, R=R: R
+            fused.B = lambda energy, B=B: B
+            fused.length = np.sum([tm_i.length for tm_i in run])
+            fused.delta_e = E_i - E_run
+            t_maps_new.append(fused)
+        run = []
+        if tm is not None:
+            t_maps_new.append(tm)
+            E += tm.delta_e
+    return t_maps_new
+
+
 '''
 returns two solutions for a periodic fodo, given the mean beta
 initial betas are at the center of the focusing quad
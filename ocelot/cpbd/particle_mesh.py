@@ -0,0 +1,227 @@
+"""
+Particle <-> mesh operations for the PIC solvers: charge deposition on the 3D mesh and field gather
+at the particle positions with NGP (order=0), CIC (order=1) and TSC (order=2) shape functions.
+
+Particle coordinates are given in units of the mesh steps, the mesh node i is at the coordinate i.
+The mesh nodes outside of the array are ignored (zero field, charge is lost).
+With NUMBA the loops over the particles are parallel, the number of threads is OCELOT_NUM_THREADS.
+The number of numba threads is set only for the call and restored after it.
+The parallel deposition accumulates the charge of every thread in its own copy of the mesh, so it needs
+nthreads times the memory of the mesh. The number of copies is limited by private_mesh_bytes.
+"""
+
+import logging
+from contextlib import contextmanager
+import numpy as np
+from ocelot.common import conf
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numba as nb
+    from numba import prange
+    nb_flag = True
+except:
+    logger.debug("particle_mesh.py: module NUMBA is not installed. Install it to speed up calculation")
+    prange = range
+    nb_flag = False
+
+
+# maximum total size in bytes of the private meshes of the threads in deposit()
+private_mesh_bytes = 2**28
+
+
+def _nthreads():
+    nthreads = max(int(conf.OCELOT_NUM_THREADS), 1)
+    if nb_flag:
+        nthreads = min(nthreads, nb.config.NUMBA_NUM_THREADS)
+    return nthreads
+
+
+@contextmanager
+def _numba_threads(nthreads):
+    """
+    number of the numba threads inside the context, the previous number is restored on exit
+    """
+    nthreads_prev = nb.get_num_threads()
+    nb.set_num_threads(nthreads)
+    try:
+        yield
+    finally:
+        nb.set_num_threads(nthreads_prev)
+
+
+def shape_weights(x, order):
+    """
+    Index of the first mesh node and the weights of the shape function
+
+    :param x: coordinate in units of the mesh step
+    :param order: 0 - NGP, 1 - CIC, 2 - TSC
+    :return: i0, w0, w1, w2 - the nodes are i0, i0+1, i0+2 with weights w0, w1, w2
+    """
+    if order == 0:
+        return int(np.floor(x + 0.5)), 1., 0., 0.
+    elif order == 1:
+        i = np.floor(x)
+        d = x - i
+        return int(i), 1. - d, d, 0.
+    else:
+        i = np.floor(x + 0.5)
+        d = x - i
+        return int(i) - 1, 0.5 * (0.5 - d) ** 2, 0.75 - d * d, 0.5 * (0.5 + d) ** 2
+
+
+def _w(a, w0, w1, w2):
+    if a == 0:
+        return w0
+    elif a == 1:
+        return w1
+    return w2
+
+
+def deposit_py(X, Q, nx, ny, nz, order, nchunks):
+    n = X.shape[0]
+    m = order + 1
+    rho = np.zeros((nchunks, nx, ny, nz))
+    for c in prange(nchunks):
+        for p in range(c * n // nchunks, (c + 1) * n // nchunks):
+            ix, wx0, wx1, wx2 = shape_weights(X[p, 0], order)
+            iy, wy0, wy1, wy2 = shape_weights(X[p, 1], order)
+            iz, wz0, wz1, wz2 = shape_weights(X[p, 2], order)
+            for a in range(m):
+                i = ix + a
+                if i < 0 or i >= nx:
+                    continue
+                qa = Q[p] * _w(a, wx0, wx1, wx2)
+                for b in range(m):
+                    j = iy + b
+                    if j < 0 or j >= ny:
+                        continue
+                    qab = qa * _w(b, wy0, wy1, wy2)
+                    for d in range(m):
+                        k = iz + d
+                        if k < 0 or k >= nz:
+                            continue
+                        rho[c, i, j, k] += qab * _w(d, wz0, wz1, wz2)
+    return rho
+
+
+def gather_py(F, X, order):
+    n = X.shape[0]
+    nx, ny, nz = F.shape
+    m = order + 1
+    out = np.zeros(n)
+    for p in prange(n):
+        ix, wx0, wx1, wx2 = shape_weights(X[p, 0], order)
+        iy, wy0, wy1, wy2 = shape_weights(X[p, 1], order)
+        iz, wz0, wz1, wz2 = shape_weights(X[p, 2], order)
+        val = 0.
+        for a in range(m):
+            i = ix + a
+            if i < 0 or i >= nx:
+                continue
+            wa = _w(a, wx0, wx1, wx2)
+            for b in range(m):
+                j = iy + b
+                if j < 0 or j >= ny:
+                    continue
+                wab = wa * _w(b, wy0, wy1, wy2)
+                for d in range(m):
+                    k = iz + d
+                    if k < 0 or k >= nz:
+                        continue
+                    val += F[i, j, k] * wab * _w(d, wz0, wz1, wz2)
+        out[p] = val
+    return out
+
+
+def _stencil_np(x, order):
+    """
+    vectorized shape_weights(): returns i0 (n) and weights (order+1, n)
+    """
+    if order == 0:
+        return np.floor(x + 0.5).astype(int), np.ones((1, len(x)))
+    elif order == 1:
+        i = np.floor(x)
+        d = x - i
+        return i.astype(int), np.array([1. - d, d])
+    i = np.floor(x + 0.5)
+    d = x - i
+    return i.astype(int) - 1, np.array([0.5 * (0.5 - d) ** 2, 0.75 - d * d, 0.5 * (0.5 + d) ** 2])
+
+
+def deposit_np(X, Q, nx, ny, nz, order):
+    ix, wx = _stencil_np(X[:, 0], order)
+    iy, wy = _stencil_np(X[:, 1], order)
+    iz, wz = _stencil_np(X[:, 2], order)
+    rho = np.zeros(nx * ny * nz)
+    m = order + 1
+    for a in range(m):
+        for b in range(m):
+            for d in range(m):
+                i, j, k = ix + a, iy + b, iz + d
+                inside = (i >= 0) & (i < nx) & (j >= 0) & (j < ny) & (k >= 0) & (k < nz)
+                inds = (i * ny + j) * nz + k
+                rho += np.bincount(inds[inside], (Q * wx[a] * wy[b] * wz[d])[inside], nx * ny * nz)
+    return rho.reshape((nx, ny, nz))
+
+
+def gather_np(F, X, order):
+    nx, ny, nz = F.shape
+    ix, wx = _stencil_np(X[:, 0], order)
+    iy, wy = _stencil_np(X[:, 1], order)
+    iz, wz = _stencil_np(X[:, 2], order)
+    out = np.zeros(X.shape[0])
+    m = order + 1
+    for a in range(m):
+        for b in range(m):
+            for d in range(m):
+                i, j, k = ix + a, iy + b, iz + d
+                inside = (i >= 0) & (i < nx) & (j >= 0) & (j < ny) & (k >= 0) & (k < nz)
+                out[inside] += F[i[inside], j[inside], k[inside]] * (wx[a] * wy[b] * wz[d])[inside]
+    return out
+
+
+if nb_flag:
+    shape_weights = nb.njit(shape_weights)
+    _w = nb.njit(_w)
+    deposit_nb = nb.njit(parallel=True)(deposit_py)
+    gather_nb = nb.njit(parallel=True)(gather_py)
+
+
+def deposit(X, Q, shape, order=0):
+    """
+    Charge deposition on the 3D mesh
+
+    :param X: array (n, 3) - particle coordinates in units of the mesh steps
+    :param Q: array (n) - particle charges
+    :param shape: mesh shape (nx, ny, nz)
+    :param order: 0 - NGP, 1 - CIC, 2 - TSC
+    :return: array (nx, ny, nz) - charge on the mesh nodes
+    """
+    nx, ny, nz = shape
+    X = np.ascontiguousarray(X, dtype=float)
+    Q = np.ascontiguousarray(Q, dtype=float)
+    if nb_flag:
+        # every chunk of the particles is deposited on its own mesh
+        nchunks = min(_nthreads(), max(int(private_mesh_bytes // (8 * nx * ny * nz)), 1))
+        with _numba_threads(nchunks):
+            return np.sum(deposit_nb(X, Q, nx, ny, nz, order, nchunks), axis=0)
+    return deposit_np(X, Q, nx, ny, nz, order)
+
+
+def gather(F, X, order=1):
+    """
+    Interpolation of the mesh values to the particle positions
+
+    :param F: array (nx, ny, nz) - field on the mesh nodes
+    :param X: array (n, 3) - particle coordinates in units of the mesh steps
+    :param order: 0 - NGP, 1 - CIC (trilinear), 2 - TSC
+    :return: array (n)
+    """
+    X = np.ascontiguousarray(X, dtype=float)
+    F = np.ascontiguousarray(F, dtype=float)
+    if nb_flag:
+        with _numba_threads(_nthreads()):
+            return gather_nb(F, X, order)
+    return gather_np(F, X, order)
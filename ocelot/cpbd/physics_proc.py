@@ -21,6 +21,9 @@ class PhysProc:
     :attribute s_start: - position of start element in lattice - assigned in navigator.add_physics_proc()
     :attribute s_stop: - position of stop element in lattice.sequence - assigned in navigator.add_physics_proc()
     :attribute z0: - current position of navigator - assigned in track.track() before p.apply()
+    :attribute kick_additive: - False, True if apply() only reads the beam and adds the momentum kicks (px, py, p).
+                                The kick-additive processes of one Navigator stop are calculated concurrently
+                                and their kicks are added in the order of the processes, see track.apply_phys_procs()
     """
 
     def __init__(self, step=1):
@@ -31,6 +34,7 @@ class PhysProc:
         self.s_start = None
         self.s_stop = None
         self.z0 = None
+        self.kick_additive = False
 
     def prepare(self, lat):
         """
@@ -122,7 +126,7 @@ class SmoothBeam(PhysProc):
 
         # Zin = np.copy(p_array.tau())
         Zin = p_array.tau()
-        inds = np.argsort(Zin, axis=0)
+        inds = p_array.binning().sort_index()
         Zout = np.copy(Zin[inds])
         N = Zin.shape[0]
         S = np.zeros(N + 1)
@@ -135,7 +139,7 @@ class SmoothBeam(PhysProc):
         Zout2[0] = Zout[0]
         for i in range(1, N - 1):
             m = min(i, N - i + 1)
-            m = np.int(np.floor(myfunc(0.5 * m, 0.5 * self.mslice) + 0.500001))
+            m = int(np.floor(myfunc(0.5 * m, 0.5 * self.mslice) + 0.500001))
             Zout2[i] = (S[i + m + 1] - S[i - m]) / (2 * m + 1)
         # Zout[inds] = Zout2
         p_array.tau()[inds] = Zout2
@@ -1,12 +1,93 @@
 __author__ = 'Sergey Tomin'
 
 import logging
+import functools
+import threading
+from collections import OrderedDict
 from ocelot.common.globals import m_e_GeV, speed_of_light
 from ocelot.cpbd.elements import *
 
 logger = logging.getLogger(__name__)
 
 
+class MatrixCache:
+    """
+    Bounded LRU cache for functions which calculate transfer matrices.
+
+    A matrix is stored with the key made of the function name and its arguments, i.e. element parameters,
+    length z and energy. Any change of the element parameters gives a new key, so stale matrices are never
+    returned and they are removed from the cache as least recently used.
+    A copy of the cached matrix is returned, so the cached values can not be changed by the caller.
+
+    Example:
+    --------
+    cache = MatrixCache(maxsize=1000)
+
+    @cache
+    def matrix(z, k1, energy):
+        ...
+
+    cache.info() -> {'hits': 10, 'misses': 2, 'size': 2, 'maxsize': 1000}
+
+    :param maxsize: maximum number of the stored matrices
+    """
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, func):
+        name = func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            key = (name, args, tuple(sorted(kwargs.items())))
+            try:
+                with self._lock:
+                    value = self._data[key]
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                return np.copy(value)
+            except KeyError:
+                pass
+            except TypeError:
+                # unhashable arguments
+                return func(*args, **kwargs)
+            value = func(*args, **kwargs)
+            with self._lock:
+                self.misses += 1
+                self._data[key] = np.copy(value)
+                if len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+            return value
+        return wrapper
+
+    def info(self):
+        """
+        cache statistics
+
+        :return: dict with number of hits, misses, current size and maximum size of the cache
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
+
+    def clear(self):
+        """
+        remove all matrices from the cache and reset statistics
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+r_matrix_cache = MatrixCache(maxsize=4096)
+
+
 def rot_mtx(angle):
     cs = np.cos(angle)
     sn = np.sin(angle)
@@ -18,6 +99,7 @@ def rot_mtx(angle):
                      [0., 0., 0., 0., 0., 1.]])
 
 
+@r_matrix_cache
 def uni_matrix(z, k1, hx, sum_tilts=0., energy=0.):
     """
     universal matrix. The function creates R-matrix from given parameters.
@@ -99,6 +181,7 @@ def create_r_matrix(element):
         S.Tomin, Varenna, 2017.
         """
 
+        @r_matrix_cache
         def undulator_r_z(z, lperiod, Kx, Ky, energy):
             gamma = energy / m_e_GeV
             r = np.eye(6)
@@ -124,6 +207,7 @@ def create_r_matrix(element):
 
     elif element.__class__ == Cavity:
 
+        @r_matrix_cache
         def cavity_R_z(z, V, E, freq, phi=0.):
             """
             :param z: length
@@ -277,6 +361,7 @@ def create_r_matrix(element):
                                           phi=element.phi)
 
     elif element.__class__ == Solenoid:
+        @r_matrix_cache
         def sol(l, k, energy):
             """
             K.Brown, A.Chao.
@@ -311,6 +396,7 @@ def create_r_matrix(element):
         R - matrix for TDS - NOT TESTED
         """
 
+        @r_matrix_cache
         def tds_R_z(z, energy, freq, v, phi):
             """
 
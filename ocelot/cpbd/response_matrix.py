@@ -14,6 +14,82 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def cumulative_transfer_maps(lattice, indices, energy=0., order=1):
+    """
+    One pass through the lattice with accumulation of the transfer maps from the lattice start.
+
+    :param lattice: MagneticLattice
+    :param indices: sorted list of the element indices. The maps are stored at the entrance of these elements,
+                    index len(lattice.sequence) means the end of the lattice
+    :param energy: initial energy [GeV]
+    :param order: 1 - only R matrices, 2 - R and T matrices (elem.transfer_map.t_mat_z_e() if exists)
+    :return: Rs - array (len(indices), 6, 6), Ts - array (len(indices), 6, 6, 6) or None, energies - array
+    """
+    indices = np.asarray(indices, dtype=int)
+    Rs = np.zeros((len(indices), 6, 6))
+    Ts = np.zeros((len(indices), 6, 6, 6)) if order > 1 else None
+    energies = np.zeros(len(indices))
+    Ra = np.eye(6)
+    Ta = np.zeros((6, 6, 6))
+    E = energy
+    n = 0
+    for i, elem in enumerate(lattice.sequence + [None]):
+        while n < len(indices) and indices[n] == i:
+            Rs[n] = Ra
+            if order > 1:
+                Ts[n] = Ta
+            energies[n] = E
+            n += 1
+        if n == len(indices):
+            break
+        tm = elem.transfer_map
+        Rb = tm.R(E)
+        if order > 1:
+            if hasattr(tm, "t_mat_z_e"):
+                Tb = tm.t_mat_z_e(elem.l, E)
+                Ta = np.einsum('il,ljk->ijk', Rb, Ta) + np.einsum('ilm,lj,mk->ijk', Tb, Ra, Ra)
+            else:
+                Ta = np.einsum('il,ljk->ijk', Rb, Ta)
+        Ra = np.dot(Rb, Ra)
+        E += tm.delta_e
+    return Rs, Ts, energies
+
+
+def first_order_response(Rb, Ra_inv, i, j):
+    """
+    Matrix element R_ij of the transfer maps between all pairs of the points a and b.
+    R(a->b) = Rb * Ra^-1, where Ra and Rb are the cumulative R matrices from the lattice start
+
+    :param Rb: array (nb, 6, 6), cumulative R matrices at points b
+    :param Ra_inv: array (na, 6, 6), inverse cumulative R matrices at points a
+    :param i: index
+    :param j: index
+    :return: array (nb, na)
+    """
+    return np.einsum('bk,ak->ba', Rb[:, i, :], Ra_inv[:, :, j])
+
+
+def second_order_response(Rb, Tb, Ra_inv, Ta, i, j, k):
+    """
+    Matrix element T_ijk of the transfer maps between all pairs of the points a and b.
+    (Rb, Tb) = (R, T)(a->b) o (Ra, Ta), see transfer_maps_mult(), so
+    T(a->b)_ijk = sum_lm [Tb - R(a->b) Ta]_ilm Ra^-1_lj Ra^-1_mk
+
+    :param Rb: array (nb, 6, 6), cumulative R matrices at points b
+    :param Tb: array (nb, 6, 6, 6), cumulative T matrices at points b
+    :param Ra_inv: array (na, 6, 6), inverse cumulative R matrices at points a
+    :param Ta: array (na, 6, 6, 6), cumulative T matrices at points a
+    :return: array (nb, na)
+    """
+    vj = Ra_inv[:, :, j]
+    vk = Ra_inv[:, :, k]
+    term1 = np.einsum('blm,al,am->ba', Tb[:, i], vj, vk)
+    g = np.einsum('anlm,al,am->an', Ta, vj, vk)
+    h = np.einsum('apn,an->ap', Ra_inv, g)
+    term2 = np.einsum('bp,ap->ba', Rb[:, i, :], h)
+    return term1 - term2
+
+
 class MeasureResponseMatrix:
     def __init__(self, lattice, hcors, vcors, bpms):
         self.lat = lattice
@@ -24,6 +100,25 @@ class MeasureResponseMatrix:
     def calculate(self):
         pass
 
+    def _cumulative_maps(self, energy, order=1):
+        """
+        cumulative transfer maps at the entrance of the correctors and at the exit of the BPMs
+
+        :return: (Rcor_inv, Tcor) for [hcors, vcors], (Rbpm, Tbpm) and the mask of the BPMs downstream the correctors
+        """
+        cors = self.hcors + self.vcors
+        cor_inx = np.array([cor.lat_inx for cor in cors], dtype=int)
+        bpm_inx = np.array([self.lat.get_elem_index(bpm) for bpm in self.bpms], dtype=int)
+        indices = np.append(cor_inx, bpm_inx + 1)
+        unique_inx, inverse = np.unique(indices, return_inverse=True)
+        Rs, Ts, _ = cumulative_transfer_maps(self.lat, unique_inx, energy=energy, order=order)
+        Rcor_inv = np.linalg.inv(Rs[inverse[:len(cors)]])
+        Rbpm = Rs[inverse[len(cors):]]
+        Tcor = Ts[inverse[:len(cors)]] if order > 1 else None
+        Tbpm = Ts[inverse[len(cors):]] if order > 1 else None
+        mask = bpm_inx[:, np.newaxis] >= cor_inx[np.newaxis, :]
+        return (Rcor_inv, Tcor), (Rbpm, Tbpm), mask
+
     def read_virtual_orbit(self, p_init=None, write2bpms=True):
         """
         searching closed orbit by function closed_orbit(lattice) and searching coordinates of beam at the bpm positions
@@ -295,27 +390,9 @@ class LinacRmatrixRM(MeasureResponseMatrix):
         ny = len(self.vcors)
         self.resp = np.zeros((2 * m, nx + ny))
 
-        for j, cor in enumerate([item for sublist in [self.hcors, self.vcors] for item in sublist]):
-            print(j, "/", nx + ny, cor.id)
-            Ra = np.eye(6)
-            E = Einit
-            for i, elem in enumerate(self.lat.sequence):
-                if i < cor.lat_inx:
-                    E += elem.transfer_map.delta_e
-                    continue
-
-                Rb = elem.transfer_map.R(E)
-                Ra = np.dot(Rb, Ra)
-                E += elem.transfer_map.delta_e
-                if elem in self.bpms:
-
-                    n = self.bpms.index(elem)
-
-                    if cor.__class__ == Hcor:
-                        self.resp[n, j] = Ra[0, 1]
-
-                    else:
-                        self.resp[n + m, j] = Ra[2, 3]
+        (Rcor_inv, _), (Rbpm, _), mask = self._cumulative_maps(Einit, order=1)
+        self.resp[:m, :nx] = first_order_response(Rbpm, Rcor_inv[:nx], 0, 1) * mask[:, :nx]
+        self.resp[m:, nx:] = first_order_response(Rbpm, Rcor_inv[nx:], 2, 3) * mask[:, nx:]
         return self.resp
 
 
@@ -326,7 +403,9 @@ class LinacDisperseSimRM(MeasureResponseMatrix):
 
     def calculate(self, tw_init=None):
         """
-        calculation of ideal dispersive response matrix
+        calculation of ideal dispersive response matrix by tracking of the orbits with the kicked correctors.
+        Unlike LinacDisperseTmatrixRM, the response includes the real orbit in the lattice
+        (e.g. misaligned quadrupoles) and the full tracking method of the lattice.
 
         :param lattice: class MagneticLattice
         :param tw_init: if tw_init == None, function tries to find periodical solution
@@ -381,30 +460,9 @@ class LinacDisperseTmatrixRM(MeasureResponseMatrix):
         ny = len(self.vcors)
         self.resp = np.zeros((2 * m, nx + ny))
 
-        for j, cor in enumerate([item for sublist in [self.hcors, self.vcors] for item in sublist]):
-            print(j, "/", nx + ny, cor.id)
-            Ra = np.eye(6)
-            Ta = np.zeros((6, 6, 6))
-            E = tw_init.E
-            for i, elem in enumerate(self.lat.sequence):
-                if i < cor.lat_inx:
-                    E += elem.transfer_map.delta_e
-                    continue
-                #Tc = np.zeros((6, 6, 6))
-                Rb = elem.transfer_map.R(E)
-                Tb = deepcopy(elem.transfer_map.t_mat_z_e(elem.l, E))
-                #Ra = dot(Rb, Ra)
-                Ra, Ta = transfer_maps_mult(Ra, Ta, Rb, Tb)
-                E += elem.transfer_map.delta_e
-                if elem in self.bpms:
-
-                    n = self.bpms.index(elem)
-
-                    if cor.__class__ == Hcor:
-                        self.resp[n, j] = Ta[0, 1, 5]
-
-                    else:
-                        self.resp[n + m, j] = Ra[2, 3, 5]
+        (Rcor_inv, Tcor), (Rbpm, Tbpm), mask = self._cumulative_maps(tw_init.E, order=2)
+        self.resp[:m, :nx] = second_order_response(Rbpm, Tbpm, Rcor_inv[:nx], Tcor[:nx], 0, 1, 5) * mask[:, :nx]
+        self.resp[m:, nx:] = second_order_response(Rbpm, Tbpm, Rcor_inv[nx:], Tcor[nx:], 2, 3, 5) * mask[:, nx:]
         return self.resp
 
 
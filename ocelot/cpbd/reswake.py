@@ -5,6 +5,7 @@ from scipy.integrate import simps
 import numpy as np
 from numpy.fft import fft, irfft, ifft
 from ocelot.common.globals import *
+from ocelot.cpbd.table_cache import table_cache
 
 def wake2impedance(s, w):
     """
@@ -58,7 +59,7 @@ def imp_resistiveAC_SI(f, cond, a, tau, L):
     return Z
 
 
-def ResistiveZaZb(xb, bunch, a, conductivity, tau, Ind):
+def ResistiveZaZb(xb, bunch, a, conductivity, tau, Ind, cache=table_cache):
     """
 
     :param xb:
@@ -67,6 +68,7 @@ def ResistiveZaZb(xb, bunch, a, conductivity, tau, Ind):
     :param conductivity:
     :param tau:
     :param Ind:
+    :param cache: TableCache of the impedances, see ocelot.cpbd.table_cache, None - no cache
     :return:
     """
     nb = len(xb)
@@ -75,7 +77,13 @@ def ResistiveZaZb(xb, bunch, a, conductivity, tau, Ind):
 
     dt = ds/speed_of_light
     f = 1./dt*np.arange(n)/n
-    Za = 1e-12*imp_resistiveAC_SI(f[:nb], conductivity, a, tau, Ind) # -> v/pC/m
+    # the impedance depends only on the pipe, the material and the sampling [nb, ds]
+    if cache is None:
+        Za = 1e-12*imp_resistiveAC_SI(f[:nb], conductivity, a, tau, Ind) # -> v/pC/m
+    else:
+        params = {"nb": nb, "ds": ds, "a": a, "conductivity": conductivity, "tau": tau, "Ind": Ind}
+        Za, = cache.get("resistive_impedance", params,
+                        lambda: (1e-12*imp_resistiveAC_SI(f[:nb], conductivity, a, tau, Ind),))
 
     xb1 = np.linspace(xb[0], xb[0]+ds*(n-1), num=n)
 
@@ -112,7 +120,7 @@ def LossShape(bunch, wake):
     return loss, spread, peak
 
 
-def pipe_wake(z, current, tube_radius, tube_len, conductivity, tau, roughness, d_oxid):
+def pipe_wake(z, current, tube_radius, tube_len, conductivity, tau, roughness, d_oxid, cache=table_cache):
     """
 
     :param z:
@@ -123,6 +131,7 @@ def pipe_wake(z, current, tube_radius, tube_len, conductivity, tau, roughness, d
     :param tau:
     :param roughness:
     :param d_oxid:
+    :param cache: TableCache of the impedances, see ocelot.cpbd.table_cache, None - no cache
     :return:
     """
 
@@ -142,7 +151,7 @@ def pipe_wake(z, current, tube_radius, tube_len, conductivity, tau, roughness, d
     Ind = mu_0*((eps_r-1.)/eps_r*d_oxid + 0.01035*roughness)
 
     # the result is in V
-    W = ResistiveZaZb(xb, yb, tube_radius, conductivity, tau, Ind)#*Q*L
+    W = ResistiveZaZb(xb, yb, tube_radius, conductivity, tau, Ind, cache=cache)#*Q*L
 
     W = W.real*Q*tube_len
     n = len(current)
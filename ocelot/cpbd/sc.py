@@ -11,8 +11,13 @@ from ocelot.common.globals import *
 from ocelot.cpbd.coord_transform import *
 from scipy import interpolate
 import multiprocessing
+import os
+import pickle
+from collections import OrderedDict
 from scipy.special import exp1, k1
 from ocelot.cpbd.physics_proc import PhysProc
+from ocelot.cpbd.particle_mesh import deposit, gather
+from ocelot.cpbd import convolution
 from ocelot.common.math_op import conj_sym
 from ocelot.cpbd.beam import s_to_cur
 from ocelot.common import conf
@@ -29,12 +34,16 @@ try:
     pyfftw_flag = True
     from pyfftw.interfaces.numpy_fft import fftn
     from pyfftw.interfaces.numpy_fft import ifftn
+    from pyfftw.interfaces.numpy_fft import rfftn
+    from pyfftw.interfaces.numpy_fft import irfftn
     import pyfftw
 except:
     pyfftw_flag = False
     logger.debug("cs.py: module PYFFTW is not installed. Install it to speed up calculation")
     from numpy.fft import ifftn
     from numpy.fft import fftn
+    from numpy.fft import rfftn
+    from numpy.fft import irfftn
 
 try:
     import numexpr as ne
@@ -71,6 +80,33 @@ def smooth_z(Zin, mslice):
     return Zout
 
 
+def subsample_indices(n, subsample):
+    """
+    Indices of the random subsample of the particles
+
+    :param n: number of particles
+    :param subsample: None - all particles, int - number of particles, float < 1 - fraction of particles
+    :return: sorted array of indices or slice(None) for all particles
+    """
+    if subsample is None:
+        return slice(None)
+    m = int(subsample) if subsample >= 1 else int(np.ceil(subsample * n))
+    if m >= n:
+        return slice(None)
+    return np.sort(np.random.choice(n, m, replace=False))
+
+
+def moments_changed(moments, moments_ref, tol):
+    """
+    True if the relative change of any moment exceeds tol
+
+    :param moments: array of the beam moments
+    :param moments_ref: array of the beam moments at the last field solution
+    :param tol: relative tolerance
+    """
+    return np.any(np.abs(moments - moments_ref) > tol * np.abs(moments_ref))
+
+
 class SpaceCharge(PhysProc):
     """
     Space Charge physics process
@@ -86,6 +122,31 @@ class SpaceCharge(PhysProc):
     by convolution of the free-space Green's function with the charge distribution.
     The convolution equation is solved with the help of the Fast Fourier Transform (FFT). The same algorithm for
     solution of the 3D Poisson equation is used, for example, in ASTRA
+
+    The convolution uses the real-to-complex FFT on one preallocated padded buffer. The doubled Green's function
+    is mirror symmetric, so its FFT is real and only the real half spectrum is stored.
+    With kernel_cache = True the FFT of the Green's function is cached and reused while the mesh shape and
+    the mesh steps are the same. The mesh steps follow the beam size, so with the cache they are rounded up
+    to the grid with the relative step kernel_step_tol and the kernel is reused for the kicks with slightly
+    different beam sizes. Without the cache the mesh steps are exact.
+
+    Attributes:
+        self.kernel_cache = False - cache of the Green's function FFT, one kernel on the 127^3 mesh takes ~65 MB
+        self.kernel_cache_size = 4 - max number of the cached kernels
+        self.kernel_step_tol = 0.01 - relative quantization of the mesh steps with the kernel_cache,
+                                      0 - no quantization (the cache is hit only with the same mesh steps)
+        self.kernel_stats = {"hits": 0, "misses": 0} - number of the cached and calculated kernels
+        self.deposit_order = 0 - charge deposition on the mesh: 0 - NGP, 1 - CIC, 2 - TSC.
+                                 Fields are interpolated with the same order (trilinear for NGP).
+        self.fftw_planner = "FFTW_ESTIMATE" - FFTW planner effort (with PYFFTW)
+        self.fftw_wisdom_file = None - file to load FFTW wisdom in prepare() and to save it in finalize()
+        self.subsample = None - number (int) or fraction (float < 1) of the randomly chosen particles for the
+                                mesh field, the charge is rescaled to the total charge. None - all particles
+        self.field_reuse_tol = 0. - if > 0, the mesh field is reused (following the bunch centroid) while
+                                    the relative changes of the rms sizes and of the charge since the last
+                                    field solution are below field_reuse_tol
+        self.solve_stats = {"solves": 0, "reused": 0} - number of the field solutions and of the reused fields
+                                                        since prepare()
     """
     def __init__(self, step=1):
         PhysProc.__init__(self)
@@ -99,9 +160,95 @@ class SpaceCharge(PhysProc):
         self.random_mesh = False  # random mesh if True
         self.random_seed = 10     # random seeding number. if None seeding is random
 
+        self.kernel_cache = False
+        self.kernel_cache_size = 4
+        self.kernel_step_tol = 0.01
+        self.kernel_stats = {"hits": 0, "misses": 0}
+        self.deposit_order = 0
+        self.fftw_planner = "FFTW_ESTIMATE"
+        self.fftw_wisdom_file = None
+        self._kernels = OrderedDict()
+        self._fft_plans = {}
+        self.fft_axes = (0, 1, 2)
+        self.subsample = None
+        self.field_reuse_tol = 0.
+        self.solve_stats = {"solves": 0, "reused": 0}
+        self._field = None
+
     def prepare(self, lat):
         if self.random_seed is not None:
             np.random.seed(self.random_seed)
+        self.solve_stats = {"solves": 0, "reused": 0}
+        self._field = None
+        if pyfftw_flag and self.fftw_wisdom_file is not None and os.path.isfile(self.fftw_wisdom_file):
+            with open(self.fftw_wisdom_file, "rb") as f:
+                pyfftw.import_wisdom(pickle.load(f))
+
+    def finalize(self, *args, **kwargs):
+        logger.debug("SpaceCharge: field solutions: " + str(self.solve_stats["solves"]) +
+                     ", reused fields: " + str(self.solve_stats["reused"]))
+        self._field = None
+        if pyfftw_flag and self.fftw_wisdom_file is not None:
+            with open(self.fftw_wisdom_file, "wb") as f:
+                pickle.dump(pyfftw.export_wisdom(), f)
+
+    def mesh_steps(self, steps):
+        """
+        Mesh steps rounded up to the grid (1 + kernel_step_tol)**n if the kernel_cache is used and kernel_step_tol > 0
+
+        :param steps: array of the mesh steps [hx, hy, hz]
+        :return: array of the mesh steps
+        """
+        if not self.kernel_cache or self.kernel_step_tol <= 0:
+            return steps
+        dlog = np.log1p(self.kernel_step_tol)
+        return np.exp(np.ceil(np.log(steps) / dlog) * dlog)
+
+    def fft_plan(self, shape):
+        """
+        Preallocated padded buffer and, with PYFFTW, the reusable FFTW plans of the real-to-complex FFT
+        over the axes self.fft_axes
+
+        :param shape: shape of the padded real array
+        :return: a, b, fft, ifft - a is the real buffer, b is the half spectrum, fft: a -> b, ifft: b -> a.
+                 Without PYFFTW b, fft and ifft are None.
+        """
+        shape = tuple(shape)
+        if shape not in self._fft_plans:
+            if pyfftw_flag:
+                nthreads = max(int(conf.OCELOT_NUM_THREADS), 1)
+                axes = self.fft_axes
+                b_shape = list(shape)
+                b_shape[axes[-1]] = shape[axes[-1]] // 2 + 1
+                a = pyfftw.empty_aligned(shape, dtype="float64")
+                b = pyfftw.empty_aligned(tuple(b_shape), dtype="complex128")
+                fft = pyfftw.FFTW(a, b, axes=axes, direction="FFTW_FORWARD", flags=(self.fftw_planner,),
+                                  threads=nthreads)
+                ifft = pyfftw.FFTW(b, a, axes=axes, direction="FFTW_BACKWARD", flags=(self.fftw_planner,),
+                                   threads=nthreads)
+                self._fft_plans[shape] = (a, b, fft, ifft)
+            else:
+                self._fft_plans[shape] = (np.zeros(shape), None, None, None)
+        return self._fft_plans[shape]
+
+    def rfft(self, a):
+        """
+        real-to-complex FFT of the buffer a from fft_plan()
+        """
+        a, b, fft, ifft = self.fft_plan(a.shape)
+        if pyfftw_flag:
+            return fft()
+        return rfftn(a, axes=self.fft_axes)
+
+    def irfft(self, b, shape):
+        """
+        complex-to-real inverse FFT, with PYFFTW the result is written in the buffer from fft_plan()
+        """
+        if pyfftw_flag:
+            a, b_plan, fft, ifft = self.fft_plan(shape)
+            b_plan[:] = b
+            return ifft()
+        return irfftn(b, s=[shape[i] for i in self.fft_axes], axes=self.fft_axes)
 
     def sym_kernel(self, ijk2, hxyz):
         i2 = ijk2[0]
@@ -129,6 +276,36 @@ class SpaceCharge(PhysProc):
 
         return kern
 
+    def kernel_fft(self, shape, steps):
+        """
+        FFT of the Green's function on the doubled mesh, the result is cached for (shape, steps)
+
+        :param shape: shape of the charge mesh (Nx, Ny, Nz)
+        :param steps: mesh steps [hx, hy, hz]
+        :return: real array (2*Nx-1, 2*Ny-1, Nz) - half spectrum of the mirror symmetric kernel
+        """
+        key = (tuple(shape), tuple(steps))
+        if self.kernel_cache and key in self._kernels:
+            self._kernels.move_to_end(key)
+            self.kernel_stats["hits"] += 1
+            return self._kernels[key]
+        K2_fft = self.build_kernel_fft(shape, steps)
+        self.kernel_stats["misses"] += 1
+        if self.kernel_cache:
+            self._kernels[key] = K2_fft
+            while len(self._kernels) > self.kernel_cache_size:
+                self._kernels.popitem(last=False)
+        return K2_fft
+
+    def build_kernel_fft(self, shape, steps):
+        Nx, Ny, Nz = shape
+        K2 = self.fft_plan((2*Nx-1, 2*Ny-1, 2*Nz-1))[0]
+        K2[0:Nx, 0:Ny, 0:Nz] = self.sym_kernel(shape, steps)
+        K2[0:Nx, 0:Ny, Nz:2*Nz-1] = K2[0:Nx, 0:Ny, Nz-1:0:-1] #z-mirror
+        K2[0:Nx, Ny:2*Ny-1,:] = K2[0:Nx, Ny-1:0:-1, :]        #y-mirror
+        K2[Nx:2*Nx-1, :, :] = K2[Nx-1:0:-1, :, :]             #x-mirror
+        return np.real(self.rfft(K2)).copy()
+
     def potential(self, q, steps):
         hx = steps[0]
         hy = steps[1]
@@ -136,58 +313,58 @@ class SpaceCharge(PhysProc):
         Nx = q.shape[0]
         Ny = q.shape[1]
         Nz = q.shape[2]
-        out = np.zeros((2*Nx-1, 2*Ny-1, 2*Nz-1))
-        out[:Nx, :Ny, :Nz] = q
-        K1 = self.sym_kernel(q.shape, steps)
-        K2 = np.zeros((2*Nx-1, 2*Ny-1, 2*Nz-1))
-        K2[0:Nx, 0:Ny, 0:Nz] = K1
-        K2[0:Nx, 0:Ny, Nz:2*Nz-1] = K2[0:Nx, 0:Ny, Nz-1:0:-1] #z-mirror
-        K2[0:Nx, Ny:2*Ny-1,:] = K2[0:Nx, Ny-1:0:-1, :]        #y-mirror
-        K2[Nx:2*Nx-1, :, :] = K2[Nx-1:0:-1, :, :]             #x-mirror
+        K2_fft = self.kernel_fft(q.shape, steps)
         t0 = time.time()
-        if pyfftw_flag:
-            nthreads = int(conf.OCELOT_NUM_THREADS)
-            if nthreads < 1:
-                nthreads = 1
-            K2_fft = pyfftw.builders.fftn(K2, axes=None, overwrite_input=False, planner_effort='FFTW_ESTIMATE',
-                                       threads=nthreads, auto_align_input=False, auto_contiguous=False, avoid_copy=True)
-            out_fft = pyfftw.builders.fftn(out, axes=None, overwrite_input=False, planner_effort='FFTW_ESTIMATE',
-                                          threads=nthreads, auto_align_input=False, auto_contiguous=False, avoid_copy=True)
-            out_ifft = pyfftw.builders.ifftn(out_fft()*K2_fft(), axes=None, overwrite_input=False, planner_effort='FFTW_ESTIMATE',
-                                          threads=nthreads, auto_align_input=False, auto_contiguous=False, avoid_copy=True)
-            out = np.real(out_ifft())
-
-        else:
-            out = np.real(ifftn(fftn(out)*fftn(K2)))
+        out = self.fft_plan((2*Nx-1, 2*Ny-1, 2*Nz-1))[0]
+        out[:] = 0.
+        out[:Nx, :Ny, :Nz] = q
+        out_fft = self.rfft(out)
+        out_fft *= K2_fft
+        out = self.irfft(out_fft, out.shape)
         t1 = time.time()
         logger.debug('fft time:' + str(t1-t0) + ' sec')
-        out[:Nx, :Ny, :Nz] = out[:Nx,:Ny,:Nz]/(4*pi*epsilon_0*hx*hy*hz)
-        return out[:Nx, :Ny, :Nz]
+        return out[:Nx, :Ny, :Nz]/(4*pi*epsilon_0*hx*hy*hz)
 
-    def el_field(self, X, Q, gamma, nxyz):
-        N = X.shape[0]
-        X[:, 2] = X[:, 2] * gamma
+    def mesh_geometry(self, X, Q, nxyz):
+        """
+        Mesh steps and the position of the bunch centroid on the mesh
+
+        :param X: array (N, 3) - particle coordinates in the rest frame of the bunch
+        :param Q: array (N) - particle charges
+        :param nxyz: mesh shape
+        :return: steps, X_mid, x0 - mesh steps, centroid of the bunch and its position on the mesh
+                 in units of the mesh steps. The mesh coordinates of the particles are (X - X_mid)/steps + x0
+        """
         XX = np.max(X, axis=0) - np.min(X, axis=0)
+        if not np.all(XX > 0):
+            raise ValueError(self.__class__.__name__ + ": the bunch has zero extent along " +
+                             ", ".join("xyz"[i] for i in np.flatnonzero(~(XX > 0))) +
+                             ", the mesh steps can not be defined (e.g. pencil beam)")
         if self.random_mesh:
             XX = XX * np.random.uniform(low=1, high=1.1)
         logger.debug('mesh steps:' + str(XX))
-        # here we use a fast 3D "near-point" interpolation
-        # we need a stand-alone module with 1D,2D,3D parricles-to-grid functions
-        steps = XX / (nxyz - 3)
-        X = X / steps
-        X_min = np.min(X, axis=0)
+        steps = self.mesh_steps(XX / (nxyz - 3))
         X_mid = np.dot(Q, X) / np.sum(Q)
-        X_off = np.floor(X_min - X_mid) + X_mid
+        x0 = -np.floor((np.min(X, axis=0) - X_mid) / steps)
         if self.random_mesh:
-            X_off = X_off + np.random.uniform(low=-0.5, high=0.5)
-        X = X - X_off
+            x0 = x0 - np.random.uniform(low=-0.5, high=0.5)
+        return steps, X_mid, x0
+
+    def mesh_field(self, X, Q, steps, nxyz):
+        """
+        Electric field on the mesh in the rest frame of the bunch
+
+        :param X: array (N, 3) - particle coordinates in units of the mesh steps
+        :param Q: array (N) - particle charges
+        :param steps: mesh steps [hx, hy, hz]
+        :param nxyz: mesh shape
+        :return: Ex, Ey, Ez - arrays with the shape nxyz
+        """
         nx = nxyz[0]
         ny = nxyz[1]
         nz = nxyz[2]
-        nzny = nz * ny
-        Xi = np.int_(np.floor(X) + 1)
-        inds = np.int_(Xi[:, 0] * nzny + Xi[:, 1] * nz + Xi[:, 2])  # 3d -> 1d
-        q = np.bincount(inds, Q, nzny * nx).reshape(nxyz)
+        # potential mesh node i is at X = i - 0.5
+        q = deposit(X + 0.5, Q, nxyz, order=self.deposit_order)
         p = self.potential(q, steps)
         Ex = np.zeros(p.shape)
         Ey = np.zeros(p.shape)
@@ -195,12 +372,57 @@ class SpaceCharge(PhysProc):
         Ex[:nx - 1, :, :] = (p[:nx - 1, :, :] - p[1:nx, :, :]) / steps[0]
         Ey[:, :ny - 1, :] = (p[:, :ny - 1, :] - p[:, 1:ny, :]) / steps[1]
         Ez[:, :, :nz - 1] = (p[:, :, :nz - 1] - p[:, :, 1:nz]) / steps[2]
-        Exyz = np.zeros((N, 3))
-        Exyz[:, 0] = ndimage.map_coordinates(Ex, np.c_[X[:, 0], X[:, 1] + 0.5, X[:, 2] + 0.5].T, order=1) * gamma
-        Exyz[:, 1] = ndimage.map_coordinates(Ey, np.c_[X[:, 0] + 0.5, X[:, 1], X[:, 2] + 0.5].T, order=1) * gamma
-        Exyz[:, 2] = ndimage.map_coordinates(Ez, np.c_[X[:, 0] + 0.5, X[:, 1] + 0.5, X[:, 2]].T, order=1)
+        return Ex, Ey, Ez
+
+    def gather_field(self, field, X, gamma):
+        """
+        Electric field from mesh_field() at the particle positions, the transverse components are multiplied by gamma
+
+        :param field: mesh field
+        :param X: array (N, 3) - particle coordinates in units of the mesh steps
+        :param gamma: Lorentz factor
+        :return: array (N, 3)
+        """
+        Ex, Ey, Ez = field
+        order = max(self.deposit_order, 1)
+        Exyz = np.zeros((X.shape[0], 3))
+        Exyz[:, 0] = gather(Ex, X + [0, 0.5, 0.5], order) * gamma
+        Exyz[:, 1] = gather(Ey, X + [0.5, 0, 0.5], order) * gamma
+        Exyz[:, 2] = gather(Ez, X + [0.5, 0.5, 0], order)
         return Exyz
 
+    def el_field(self, X, Q, gamma, nxyz):
+        """
+        Electric field at the particle positions.
+        The mesh field is calculated from the random subsample of the particles if self.subsample is set and
+        it is reused while the relative changes of the rms sizes and of the charge are below self.field_reuse_tol
+
+        :param X: array (N, 3) - particle coordinates, X[:, 2] is scaled by gamma in place
+        :param Q: array (N) - particle charges
+        :param gamma: Lorentz factor
+        :param nxyz: mesh shape
+        :return: array (N, 3)
+        """
+        X[:, 2] = X[:, 2] * gamma
+        moments = None
+        if self.field_reuse_tol > 0:
+            moments = np.append(np.std(X, axis=0), np.sum(Q))
+            if self._field is not None and not moments_changed(moments, self._field[3], self.field_reuse_tol):
+                field, steps, x0 = self._field[:3]
+                self.solve_stats["reused"] += 1
+                X_mid = np.dot(Q, X) / np.sum(Q)
+                return self.gather_field(field, (X - X_mid) / steps + x0, gamma)
+        steps, X_mid, x0 = self.mesh_geometry(X, Q, nxyz)
+        X = (X - X_mid) / steps + x0
+        inds = subsample_indices(len(Q), self.subsample)
+        Qs = Q[inds]
+        if len(Qs) < len(Q):
+            Qs = Qs * (np.sum(Q) / np.sum(Qs))
+        field = self.mesh_field(X[inds], Qs, steps, nxyz)
+        self.solve_stats["solves"] += 1
+        if self.field_reuse_tol > 0:
+            self._field = (field, steps, x0, moments)
+        return self.gather_field(field, X, gamma)
 
     def apply(self, p_array, zstep):
         logger.debug(" apply: zstep = " + str(zstep))
@@ -248,16 +470,215 @@ class SpaceCharge(PhysProc):
         xp_2_xxstg_mad(xp, p_array.rparticles, gamref)
 
 
+class SpaceCharge25D(SpaceCharge):
+    """
+    2.5D space charge physics process for the long bunches (gamma*sigma_z >> sigma_x, sigma_y), e.g. in linacs
+    above ~100 MeV
+
+    Attributes:
+        self.step = 1 [in Navigator.unit_step] - step of the Space Charge kick applying
+        self.nmesh_xyz = [63, 63, 31] - transverse mesh and number of the longitudinal slices.
+                                        With solver="radial" nmesh_xyz[0] is the number of the radial mesh nodes
+        self.solver = "fft" - transverse field: "fft" - 2D Poisson equation for each slice,
+                                                "radial" - Gauss law for the round beams
+    Description:
+        The coordinate transform to the velocity direction, the Lorentz transformation and the kick are the same
+    as in SpaceCharge, only the field solver in the rest frame of the bunch is different.
+    The transverse field of each slice is the field of the infinitely long beam with the transverse distribution
+    and the line charge density of the slice. With solver="fft" the 2D potential is the convolution with the
+    integrated 2D Green's function, it is calculated with the FFT for all slices at once.
+    With solver="radial" the radial field is found from the charge enclosed in the circle of radius r
+    around the slice centroid (CIC deposition in r).
+    The longitudinal field is the on-axis field of the line charge with the uniform round transverse profile
+    of the same rms size as the bunch.
+    """
+    def __init__(self, step=1):
+        SpaceCharge.__init__(self, step)
+        self.nmesh_xyz = [63, 63, 31]
+        self.solver = "fft"
+        self.fft_axes = (0, 1)
+
+    def build_kernel_fft(self, shape, steps):
+        Nx, Ny = shape
+        hx, hy = steps
+        x = hx*np.r_[0:Nx+1] - hx/2
+        y = hy*np.r_[0:Ny+1] - hy/2
+        x, y = np.ix_(x, y)
+        # antiderivative of -ln(r) over x and y
+        IG = -0.5*(x*y*np.log(x*x + y*y) - 3*x*y + x*x*np.arctan(y/x) + y*y*np.arctan(x/y))
+        K2 = np.zeros((2*Nx-1, 2*Ny-1))
+        K2[0:Nx, 0:Ny] = IG[1:, 1:] - IG[:-1, 1:] - IG[1:, :-1] + IG[:-1, :-1]
+        K2[0:Nx, Ny:2*Ny-1] = K2[0:Nx, Ny-1:0:-1]  # y-mirror
+        K2[Nx:2*Nx-1, :] = K2[Nx-1:0:-1, :]        # x-mirror
+        return np.real(rfftn(K2))[:, :, np.newaxis].copy()
+
+    def potential(self, q, steps):
+        """
+        2D potential of the slices
+
+        :param q: array (Nx, Ny, Nz) - charge on the mesh
+        :param steps: mesh steps [hx, hy, hz]
+        :return: array (Nx, Ny, Nz)
+        """
+        hx, hy, hz = steps
+        Nx, Ny, Nz = q.shape
+        K2_fft = self.kernel_fft(q.shape[:2], steps[:2])
+        out = self.fft_plan((2*Nx-1, 2*Ny-1, Nz))[0]
+        out[:] = 0.
+        out[:Nx, :Ny, :] = q
+        out_fft = self.rfft(out)
+        out_fft *= K2_fft
+        out = self.irfft(out_fft, out.shape)
+        return out[:Nx, :Ny, :]/(2*pi*epsilon_0*hx*hy*hz)
+
+    def slice_offsets(self, X, xc, yc, steps):
+        """
+        Transverse particle coordinates relative to the centroids of the slices
+
+        :param X: array (N, 3) - particle coordinates in units of the mesh steps
+        :param xc: array (nz) - horizontal centroids of the slices in units of the mesh steps
+        :param yc: array (nz) - vertical centroids of the slices in units of the mesh steps
+        :param steps: mesh steps [hx, hy, hz]
+        :return: x, y
+        """
+        iz = np.clip(np.floor(X[:, 2] + 1.).astype(int), 0, len(xc) - 1)
+        return (X[:, 0] - xc[iz]) * steps[0], (X[:, 1] - yc[iz]) * steps[1]
+
+    def radial_potential(self, X, Q, steps, nxyz):
+        """
+        Radial field and 2D potential of the round slices
+
+        :param X: array (N, 3) - particle coordinates in units of the mesh steps
+        :param Q: array (N) - particle charges
+        :param steps: mesh steps [hx, hy, hz]
+        :param nxyz: [nr, -, nz] - number of the radial mesh nodes and the slices
+        :return: f, p, qz, xc, yc, hr - E_r/r on the radial nodes r = (i + 0.5)*hr, potential on the radial nodes
+                 r = i*hr, slice charges, slice centroids in units of the mesh steps and radial mesh step
+        """
+        nr, nz = nxyz[0], nxyz[2]
+        zc = X[:, 2] + 0.5
+        iz = np.minimum(np.floor(zc + 0.5).astype(int), nz - 1)
+        qs = np.bincount(iz, Q, nz)
+        qs[qs == 0] = 1.
+        xc = np.bincount(iz, Q * X[:, 0], nz) / qs
+        yc = np.bincount(iz, Q * X[:, 1], nz) / qs
+        x, y = self.slice_offsets(X, xc, yc, steps)
+        r = np.sqrt(x*x + y*y)
+        if not np.max(r) > 0:
+            raise ValueError("SpaceCharge25D: the radial solver needs particles off the slice centroids, "
+                             "all particles are on the axis of their slices (e.g. one particle per slice)")
+        hr = np.max(r) / (nr - 2)
+        order = min(self.deposit_order, 1)
+        q = deposit(np.c_[r / hr, np.ones(len(r)), zc], Q, (nr, 3, nz), order=order).sum(axis=1)
+        # E_r/r at r = (i + 0.5)*hr from the enclosed charge
+        rh = (np.arange(nr) + 0.5) * hr
+        f = np.cumsum(q, axis=0) / (2*pi*epsilon_0*steps[2]*rh[:, np.newaxis]**2)
+        # potential -ln(r)/(2*pi*epsilon_0) per unit line charge outside of the slice
+        p = np.zeros((nr, nz))
+        p[-1] = -np.sum(q, axis=0) / steps[2] * np.log((nr - 1) * hr) / (2*pi*epsilon_0)
+        p[:-1] = p[-1] + np.cumsum((f * rh[:, np.newaxis])[-2::-1], axis=0)[::-1] * hr
+        return f, p, np.sum(q, axis=0), xc, yc, hr
+
+    def line_charge_field(self, qz, hz, a):
+        """
+        On-axis longitudinal field of the line charge with the uniform round profile,
+        the line charge density is linearly interpolated between the slices
+
+        :param qz: array (nz) - slice charges
+        :param hz: slice length
+        :param a: radius of the transverse profile
+        :return: array (nz) - field at the slices
+        """
+        nz = len(qz)
+        d = hz * np.arange(-(nz - 1), nz)
+        # second antiderivative of the on-axis field of the disk: (s|s| - s*sqrt(s^2 + a^2))/2/a^2 - asinh(s/a)/2
+        R = lambda s: -(s / (np.abs(s) + np.sqrt(s*s + a*a)) + np.arcsinh(s / a)) / (4*pi*epsilon_0)
+        K = (R(d + hz) - 2*R(d) + R(d - hz)) / hz**2
+        return convolution.convolve(qz, K, 2*nz - 1)[nz - 1:]
+
+    def mesh_field(self, X, Q, steps, nxyz):
+        nz = nxyz[2]
+        sigma_x = np.sqrt(np.cov(X[:, 0], aweights=Q)) * steps[0]
+        sigma_y = np.sqrt(np.cov(X[:, 1], aweights=Q)) * steps[1]
+        a = np.sqrt(2 * (sigma_x**2 + sigma_y**2))
+        if self.solver == "radial":
+            f, p, qz, xc, yc, hr = self.radial_potential(X, Q, steps, nxyz)
+            p = p[:, np.newaxis, :]
+        else:
+            nx, ny = nxyz[0], nxyz[1]
+            # potential mesh node i is at X = i - 0.5
+            q = deposit(X + 0.5, Q, nxyz, order=self.deposit_order)
+            qz = np.sum(q, axis=(0, 1))
+            p = self.potential(q, steps)
+            Ex = np.zeros(p.shape)
+            Ey = np.zeros(p.shape)
+            Ex[:nx - 1, :, :] = (p[:nx - 1, :, :] - p[1:nx, :, :]) / steps[0]
+            Ey[:, :ny - 1, :] = (p[:, :ny - 1, :] - p[:, 1:ny, :]) / steps[1]
+        # longitudinal field: on-axis field of the line charge and the correction from the 2D potential
+        # of the slices relative to the on-axis potential of the uniform disk
+        p = p - qz / steps[2] * (0.5 - np.log(a)) / (2*pi*epsilon_0)
+        Ez = np.zeros(p.shape)
+        Ez[:, :, :nz - 1] = (p[:, :, :nz - 1] - p[:, :, 1:nz]) / steps[2]
+        Ez_line = self.line_charge_field(qz, steps[2], a)
+        if self.solver == "radial":
+            return f, Ez, Ez_line, xc, yc, hr, steps
+        return Ex, Ey, Ez, Ez_line
+
+    def gather_field(self, field, X, gamma):
+        N = X.shape[0]
+        Exyz = np.zeros((N, 3))
+        if self.solver == "radial":
+            f, Ez, Ez_line, xc, yc, hr, steps = field
+            nr = f.shape[0]
+            x, y = self.slice_offsets(X, xc, yc, steps)
+            r = np.sqrt(x*x + y*y)
+            Xr = np.c_[np.clip(r / hr - 0.5, 0., nr - 1), np.zeros(N), X[:, 2] + 0.5]
+            f = gather(f[:, np.newaxis, :], Xr, 1)
+            # E_r/r ~ 1/r^2 outside of the radial mesh
+            out = r > (nr - 0.5) * hr
+            f[out] *= ((nr - 0.5) * hr / r[out])**2
+            Exyz[:, 0] = f * x * gamma
+            Exyz[:, 1] = f * y * gamma
+            Xp = np.c_[np.minimum(r / hr, nr - 1), np.zeros(N), X[:, 2]]
+        else:
+            Ex, Ey, Ez, Ez_line = field
+            order = max(self.deposit_order, 1)
+            Exyz[:, 0] = gather(Ex, X + [0, 0.5, 0.5], order) * gamma
+            Exyz[:, 1] = gather(Ey, X + [0.5, 0, 0.5], order) * gamma
+            Xp = X + [0.5, 0.5, 0]
+        Exyz[:, 2] = gather(Ez, Xp, 1) + np.interp(X[:, 2] + 0.5, np.arange(len(Ez_line)), Ez_line)
+        return Exyz
+
+
 class LSC(PhysProc):
     """
     Longitudinal Space Charge
     smooth_param - 0.1 smoothing parameter, resolution = np.std(p_array.tau())*smooth_param
+    subsample - None, number (int) or fraction (float < 1) of the randomly chosen particles for the current profile
+    field_reuse_tol - 0., if > 0 the wake is reused (following the bunch centroid) while the relative changes
+                      of the bunch length, the transverse size, the charge and the energy since the last
+                      calculation are below field_reuse_tol
+    solve_stats - {"solves": 0, "reused": 0} number of the wake calculations and of the reused wakes
     """
     def __init__(self, step=1):
         PhysProc.__init__(self, step)
         self.smooth_param = 0.1
         self.step_profile = False
         self.napply = 0
+        self.subsample = None
+        self.field_reuse_tol = 0.
+        self.solve_stats = {"solves": 0, "reused": 0}
+        self._wake = None
+        self.kick_additive = True
+
+    def prepare(self, lat):
+        self.solve_stats = {"solves": 0, "reused": 0}
+        self._wake = None
+
+    def finalize(self, *args, **kwargs):
+        logger.debug("LSC: wake calculations: " + str(self.solve_stats["solves"]) +
+                     ", reused wakes: " + str(self.solve_stats["reused"]))
+        self._wake = None
 
     def imp_lsc(self, gamma, sigma, w, dz):
         """
@@ -305,31 +726,34 @@ class LSC(PhysProc):
         Fourier transform with exp(iwt)
         s - Meter
         w - V/C
-        f - Hz
-        y - Om
+        f - Hz, the first n//2 + 1 frequencies, n = len(s)
+        y - Om, the first n//2 + 1 points of the spectrum (w is real, the second half is conj(y[n - k]))
         """
         ds = s[1] - s[0]
         dt = ds / speed_of_light
         n = len(s)
-        f = 1 / dt * np.arange(0, n) / n
+        f = 1 / dt * np.arange(0, n // 2 + 1) / n
         shift = 1#np.exp(1j * f * t0 * 2 * np.pi)
-        y = dt * np.fft.fft(w, n) * shift
+        y = dt * convolution.rfft(w, n) * shift
         return f, y
 
-    def impedance2wake(self, f, y):
+    def impedance2wake(self, f, y, n=None):
         """
         Fourier transform with exp(-iwt)
-        f - Hz
-        y - Om
+        f - Hz, the first n//2 + 1 frequencies as returned by wake2impedance()
+        y - Om, the first n//2 + 1 points of the spectrum
+        n - number of points of the wake, if None n = 2*(len(f) - 1)
         s - Meter
         w - V/C
         """
+        if n is None:
+            n = 2 * (len(f) - 1)
+        assert len(f) == len(y) == n // 2 + 1, "f and y must be the first n//2 + 1 points of the spectrum"
         df = f[1] - f[0]
-        n = len(f)
         s = 1 / df * np.arange(0, n) / n * speed_of_light
         # general case
         # w1 = n * df * np.fft.ifft(conj_sym(y), n).real
-        w = n * df * np.fft.irfft(y, n)
+        w = n * df * convolution.irfft(y, n)
         return s, w
 
     def wake_lsc(self, s, bunch, gamma, sigma, dz):
@@ -350,11 +774,11 @@ class LSC(PhysProc):
 
         f, Zb = self.wake2impedance(sb1, bunch1 * speed_of_light)
 
-        Z = np.zeros(n, dtype=np.complex)
+        Z = np.zeros(nb + 1, dtype=complex)
         Z[0:nb] = Za * Zb[0:nb]
-        Z[nb:n] = np.flipud(np.conj(Z[0:nb]))
+        Z[nb] = np.conj(Z[nb - 1])
 
-        xa, wa = self.impedance2wake(f, Z)
+        xa, wa = self.impedance2wake(f, Z, n)
         res = -wa[0:nb]
         return res
 
@@ -385,14 +809,25 @@ class LSC(PhysProc):
             # sigma = min(np.std(p_array.x()[indx]), np.std(p_array.y()[indx]))
         q = np.sum(p_array.q_array)
         gamma = p_array.E / m_e_GeV
-        v = np.sqrt(1 - 1 / gamma ** 2) * speed_of_light
-        B = s_to_cur(p_array.tau(), sigma_tau * self.smooth_param, q, v)
-        bunch = B[:, 1] / (q * speed_of_light)
-        x = B[:, 0]
-
-        W = - self.wake_lsc(x, bunch, gamma, sigma, dz) * q
-
-        indx = np.argsort(p_array.tau(), kind="quicksort")
+        moments = np.array([sigma_tau, sigma, q, gamma])
+        if (self.field_reuse_tol > 0 and self._wake is not None and
+                not moments_changed(moments, self._wake[2], self.field_reuse_tol)):
+            self.solve_stats["reused"] += 1
+            x = self._wake[0] + mean_b
+            W = self._wake[1] * dz
+        else:
+            v = np.sqrt(1 - 1 / gamma ** 2) * speed_of_light
+            inds = subsample_indices(p_array.n, self.subsample)
+            B = s_to_cur(p_array.tau()[inds], sigma_tau * self.smooth_param, q, v)
+            bunch = B[:, 1] / (q * speed_of_light)
+            x = B[:, 0]
+
+            W = - self.wake_lsc(x, bunch, gamma, sigma, dz) * q
+            self.solve_stats["solves"] += 1
+            if self.field_reuse_tol > 0:
+                self._wake = (x - mean_b, W / dz, moments)
+
+        indx = p_array.binning().sort_index()
         tau_sort = p_array.tau()[indx]
         dE = np.interp(tau_sort, x, W)
 
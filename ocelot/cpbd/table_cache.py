@@ -0,0 +1,184 @@
+"""
+On-disk cache of the tables which are expensive to calculate and depend only on a few parameters,
+e.g. the wake tables of the corrugated structures (WakeTableDechirperOffAxis) or the resistive wall impedance
+of a round pipe (reswake.pipe_wake).
+
+The tables are stored in binary files cache_dir/<name>/<hash>.npz, where hash is the content hash of the parameters
+(geometry, material and sampling of the table), so the next scripts with the same parameters read the table
+from the disk instead of calculating it again.
+The files are written to a temporary file and renamed, so several processes can share the cache directory.
+The least recently used tables are removed if the total size of the cache exceeds the limit.
+
+By default the cache directory is taken from the environment variable OCELOT_CACHE_DIR, the cache is disabled
+if it is not set: table_cache.cache_dir = "dir" enables the cache.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import numpy as np
+from ocelot.common import conf
+
+logger = logging.getLogger(__name__)
+
+
+class TableCache:
+    """
+    Content-addressed on-disk cache of the calculated tables.
+
+    tables = cache.get("name", {"a": 0.01, "sigma": 30e-6, "s": s_array}, lambda: calculate(...))
+    cache.info() -> {'hits': 1, 'misses': 1, 'files': 1, 'size': 1120512, 'max_size': 1000000000}
+    cache.clear() - remove all tables from the disk
+    Copies of the cache refer to the same cache.
+
+    :param cache_dir: directory of the cache, None - the tables are not cached
+    :param max_size: maximum total size of the tables on the disk in bytes
+    """
+    def __init__(self, cache_dir=None, max_size=1e9):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @staticmethod
+    def key(name, params):
+        """
+        content hash of the parameters of the table
+
+        :param name: name of the table
+        :param params: dict of the parameters, values are numbers, strings or arrays
+        :return: hex string
+        """
+        h = hashlib.sha1(str(name).encode())
+        for k in sorted(params):
+            v = params[k]
+            h.update(str(k).encode())
+            if isinstance(v, np.ndarray):
+                v = np.ascontiguousarray(v)
+                h.update((str(v.dtype) + str(v.shape)).encode())
+                h.update(v.tobytes())
+            elif isinstance(v, (float, np.floating)):
+                h.update(float(v).hex().encode())
+            else:
+                h.update(repr(v).encode())
+        return h.hexdigest()
+
+    def filename(self, name, params):
+        return os.path.join(self.cache_dir, name, self.key(name, params) + ".npz")
+
+    def get(self, name, params, func):
+        """
+        table from the cache
+
+        :param name: name of the table, subdirectory of the cache
+        :param params: dict of all parameters the table depends on
+        :param func: function without arguments which calculates the table if it is not in the cache,
+                     returns tuple of arrays
+        :return: tuple of arrays
+        """
+        if self.cache_dir is None:
+            return tuple(func())
+        filename = self.filename(name, params)
+        if os.path.isfile(filename):
+            try:
+                with np.load(filename) as data:
+                    tables = tuple(data["arr_" + str(i)] for i in range(len(data.files)))
+                os.utime(filename)
+                with self._lock:
+                    self.hits += 1
+                return tables
+            except (OSError, ValueError, KeyError):
+                logger.warning("TableCache: can not read " + filename)
+        tables = tuple(func())
+        self.save(filename, tables)
+        with self._lock:
+            self.misses += 1
+        return tables
+
+    def save(self, filename, tables):
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            tmp = filename + "." + str(os.getpid()) + "_" + str(threading.get_ident()) + ".tmp"
+            with open(tmp, "wb") as f:
+                np.savez(f, *tables)
+            os.replace(tmp, filename)
+        except OSError:
+            logger.warning("TableCache: can not write " + filename)
+            return
+        self.shrink()
+
+    def files(self):
+        """
+        tables on the disk
+
+        :return: list of (modification time, size, filename)
+        """
+        files = []
+        if self.cache_dir is None or not os.path.isdir(self.cache_dir):
+            return files
+        for root, dirs, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith(".npz"):
+                    continue
+                filename = os.path.join(root, name)
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    # removed by another process
+                    continue
+                files.append((st.st_mtime, st.st_size, filename))
+        return files
+
+    def shrink(self):
+        """
+        remove the least recently used tables until the total size is not larger than max_size
+        """
+        files = sorted(self.files())
+        size = sum(f[1] for f in files)
+        for mtime, fsize, filename in files:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            size -= fsize
+
+    def info(self):
+        """
+        cache statistics
+
+        :return: dict with number of hits and misses, number and total size of the tables on the disk
+                 and maximum size of the cache
+        """
+        files = self.files()
+        return {"hits": self.hits, "misses": self.misses, "files": len(files), "size": sum(f[1] for f in files),
+                "max_size": self.max_size}
+
+    def clear(self):
+        """
+        remove all tables from the disk and reset statistics
+        """
+        for mtime, fsize, filename in self.files():
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+        if self.cache_dir is not None and os.path.isdir(self.cache_dir):
+            for root, dirs, names in os.walk(self.cache_dir, topdown=False):
+                if root != self.cache_dir and not os.listdir(root):
+                    try:
+                        os.rmdir(root)
+                    except OSError:
+                        pass
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+table_cache = TableCache(cache_dir=conf.OCELOT_CACHE_DIR)
@@ -4,7 +4,11 @@ from ocelot.cpbd.optics import *
 from ocelot.cpbd.beam import *
 from ocelot.cpbd.errors import *
 from ocelot.cpbd.elements import *
+from ocelot.common import conf
 from time import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+import multiprocessing
 from scipy.stats import truncnorm
 import copy
 import sys
@@ -20,11 +24,11 @@ except:
 
 
 def aperture_limit(lat, xlim = 1, ylim = 1):
-    tws=twiss(lat, Twiss(), nPoints=1000)
-    bxmax = max([tw.beta_x for tw in tws])
-    bymax = max([tw.beta_y for tw in tws])
-    bx0 = tws[0].beta_x
-    by0 = tws[0].beta_y
+    tws=twiss(lat, Twiss(), nPoints=1000, return_table=True)
+    bxmax = np.max(tws.beta_x)
+    bymax = np.max(tws.beta_y)
+    bx0 = tws.beta_x[0]
+    by0 = tws.beta_y[0]
     px_lim = float(xlim)/np.sqrt(bxmax*bx0)
     py_lim = float(ylim)/np.sqrt(bymax*by0)
     xlim = float(xlim)*np.sqrt(bx0/bxmax)
@@ -128,24 +132,123 @@ def harmonic_position(data1D, nu = None, diap = 0.1, nearest = False):
     return nearest_nu
 
 
-def freq_analysis(track_list, lat, nturns, harm=True, diap=0.10, nearest=False, nsuperperiods=1):
-
-    def beta_freq(lat):
+def _windowed_dft_amplitude(data, window, nu):
+    """
+    amplitude of the windowed DFT of every row of the data on its own frequency nu[i]
+    """
+    n = np.arange(data.shape[1])
+    return np.abs(np.sum(data * window * np.exp(-2j * np.pi * nu[:, np.newaxis] * n), axis=1))
 
-        tws = twiss(lat, Twiss())
-        nux = tws[-1].mux/2./pi*nsuperperiods
-        nuy = tws[-1].muy/2./pi*nsuperperiods
-        print ("freq. analysis: Qx = ", nux, " Qy = ", nuy)
-        nux = abs(int(nux+0.5) - nux)
-        nuy = abs(int(nuy+0.5) - nuy)
-        print("freq. analysis: nux = ", nux)
-        print("freq. analysis: nuy = ", nuy)
-        return nux, nuy
 
+def find_tunes(data, nu=None, diap=0.1, window=True, niter=0):
+    """
+    Batched frequency analysis of the turn-by-turn data of all particles at once.
+    The main harmonic is searched in the spectrum of the windowed data (one rfft along the turn axis)
+    and refined with the interpolation between the neighbouring bins of the spectrum.
+    Optionally, the tune is refined further by maximization of the windowed DFT amplitude (NAFF-like).
+
+    :param data: array (n_particles, n_turns) - turn-by-turn coordinates
+    :param nu: None or expected tune, if not None the harmonic is searched in [nu - diap, nu + diap]
+    :param diap: half width of the search range
+    :param window: True - Hann window is applied to the data, False - no window
+    :param niter: number of the golden section iterations of the DFT amplitude maximization,
+                  0 - interpolation only
+    :return: array (n_particles) - tunes in the range [0, 0.5]
+    """
+    data = np.atleast_2d(np.asarray(data, dtype=float))
+    nturns = data.shape[1]
+    data = data - np.mean(data, axis=1)[:, np.newaxis]
+    w = np.hanning(nturns) if window else np.ones(nturns)
+    ft = np.abs(np.fft.rfft(data * w, axis=1))
+    freq = np.fft.rfftfreq(nturns)
+    ft[:, 0] = 0.
+    if nu is not None and diap is not None:
+        in_range = (freq >= nu - diap) & (freq <= nu + diap)
+        if np.any(in_range[1:]):
+            ft[:, ~in_range] = 0.
+    k = np.argmax(ft, axis=1)
+    rows = np.arange(len(k))
+    a0 = ft[rows, k]
+    a_left = ft[rows, np.maximum(k - 1, 0)]
+    a_right = ft[rows, np.minimum(k + 1, len(freq) - 1)]
+    a0_safe = np.where(a0 > 0, a0, 1.)
+    sign = np.where(a_right > a_left, 1., -1.)
+    alpha = np.maximum(a_right, a_left) / a0_safe
+    if window:
+        # interpolation for the Hann window
+        delta = (2. * alpha - 1.) / (alpha + 1.)
+    else:
+        delta = alpha / (1. + alpha)
+    delta = np.where(a0 > 0, np.clip(delta, 0., 1.), 0.)
+    tunes = (k + sign * delta) / nturns
+
+    if niter > 0:
+        # golden section search of the DFT amplitude maximum near the interpolated tune
+        gr = (np.sqrt(5.) - 1.) / 2.
+        a = tunes - 1. / nturns
+        b = tunes + 1. / nturns
+        c = b - gr * (b - a)
+        d = a + gr * (b - a)
+        fc = _windowed_dft_amplitude(data, w, c)
+        fd = _windowed_dft_amplitude(data, w, d)
+        for i in range(niter):
+            left = fc > fd
+            b = np.where(left, d, b)
+            a = np.where(left, a, c)
+            x_new = np.where(left, b - gr * (b - a), a + gr * (b - a))
+            f_new = _windowed_dft_amplitude(data, w, x_new)
+            c, d = np.where(left, x_new, d), np.where(left, c, x_new)
+            fc, fd = np.where(left, f_new, fd), np.where(left, fc, f_new)
+        tunes = (a + b) / 2.
+    return np.abs(tunes)
+
+
+def beta_freq(lat, nsuperperiods=1):
+
+    tws = twiss(lat, Twiss())
+    nux = tws[-1].mux/2./pi*nsuperperiods
+    nuy = tws[-1].muy/2./pi*nsuperperiods
+    print ("freq. analysis: Qx = ", nux, " Qy = ", nuy)
+    nux = abs(int(nux+0.5) - nux)
+    nuy = abs(int(nuy+0.5) - nuy)
+    print("freq. analysis: nux = ", nux)
+    print("freq. analysis: nuy = ", nuy)
+    return nux, nuy
+
+
+def freq_analysis(track_list, lat, nturns, harm=True, diap=0.10, nearest=False, nsuperperiods=1, refined=False,
+                  niter=0):
+    """
+    Frequency analysis of the survived particles, the tunes are written in pxy.mux and pxy.muy
+
+    :param track_list: list of Track_info after track_nturns() with save_track=True
+    :param lat: MagneticLattice
+    :param nturns: number of turns
+    :param harm: if True, the harmonic nearest to the tunes of the lattice is searched
+    :param diap: half width of the search range around the tunes of the lattice
+    :param nearest: see harmonic_position()
+    :param nsuperperiods: number of superperiods
+    :param refined: if False, harmonic_position() is used for each particle,
+                    if True, the tunes of all particles are found at once with find_tunes()
+    :param niter: number of the refinement iterations, see find_tunes()
+    :return: track_list
+    """
     nux, nuy = None, None
     if harm == True:
-        nux, nuy = beta_freq(lat)
+        nux, nuy = beta_freq(lat, nsuperperiods)
     #fma(pxy_list, nux = nux, nuy = nuy)
+    if refined:
+        stable = [pxy for pxy in track_list if pxy.turn == nturns-1 and len(pxy.p_list) == nturns + 1]
+        if len(stable) == 0:
+            return track_list
+        tbt = np.array([pxy.p_list for pxy in stable])
+        mux = find_tunes(tbt[:, :, 0], nux, diap, niter=niter)
+        muy = find_tunes(tbt[:, :, 2], nuy, diap, niter=niter)
+        for n, pxy in enumerate(stable):
+            pxy.mux = mux[n]
+            pxy.muy = muy[n]
+        return track_list
+
     for n, pxy in enumerate(track_list):
         if pxy.turn == nturns-1:
             if len(pxy.p_list) == 1:
@@ -263,29 +366,98 @@ def ellipse_track_list(beam, n_t_sigma = 3, num = 1000, type = "contour"):
     return track_list
 
 
-def track_nturns(lat, nturns, track_list, nsuperperiods=1, save_track=True, print_progress=True):
-    xlim, ylim, px_lim, py_lim = aperture_limit(lat, xlim = 1, ylim = 1)
-    navi = Navigator(lat)
+def track_nturns_array(lat, nturns, rparticles, energy=0., nsuperperiods=1, save_track=True, stride=1,
+                       filename=None, print_progress=False, aperture=None, t_maps=None):
+    """
+    Multi-turn tracking of the fixed particle array. Particles outside of the aperture (see aperture_limit())
+    are marked as lost and are not tracked further, turn-by-turn data is written in the preallocated buffer.
+
+    :param lat: MagneticLattice of one superperiod
+    :param nturns: number of turns
+    :param rparticles: array (6, n) - initial coordinates of the particles
+    :param energy: beam energy in [GeV]
+    :param nsuperperiods: number of superperiods in the ring
+    :param save_track: if True, the coordinates are saved every "stride" turns
+    :param stride: the coordinates are saved after turns i for which (i + 1) % stride == 0
+    :param filename: None or file name. If given, turn-by-turn buffer is memory-mapped to the ".npy" file
+    :param print_progress: True, print the turn number
+    :param aperture: None or (xlim, ylim, px_lim, py_lim), if None aperture_limit(lat) is used
+    :param t_maps: None or list of the transfer maps of one superperiod, if None get_map() is used
+    :return: alive, lost_turn, tbt:
+            alive - bool array (n) - True for survived particles,
+            lost_turn - int array (n) - turn on which the particle was lost, -1 for survived particles,
+            tbt - None or array (nturns // stride + 1, 6, n) - the initial coordinates and the coordinates after
+            the saved turns, NaN after the particle loss.
+    """
+    if aperture is None:
+        aperture = aperture_limit(lat, xlim=1, ylim=1)
+    xlim, ylim, px_lim, py_lim = aperture
+    if t_maps is None:
+        t_maps = get_map(lat, lat.totalLen, Navigator(lat))
+
+    rparticles = np.array(rparticles, dtype=float)
+    n = rparticles.shape[1]
+    alive = np.ones(n, dtype=bool)
+    lost_turn = -np.ones(n, dtype=int)
+    tbt = None
+    if save_track:
+        shape = (nturns // stride + 1, 6, n)
+        if filename is not None:
+            tbt = np.lib.format.open_memmap(filename, mode="w+", dtype=float, shape=shape)
+        else:
+            tbt = np.empty(shape)
+        tbt[:] = np.nan
+        tbt[0] = rparticles
 
-    t_maps = get_map(lat, lat.totalLen, navi)
-    track_list_const = copy.copy(track_list)
     p_array = ParticleArray()
-    p_list = [p.particle for p in track_list]
-    p_array.list2array(p_list)
-
+    p_array.rparticles = rparticles
+    p_array.E = energy
+    # indices of the tracked particles in the initial array
+    indx = np.arange(n)
     for i in range(nturns):
         if print_progress: print(i)
-        for n in range(nsuperperiods):
+        for _ in range(nsuperperiods):
             for tm in t_maps:
                 tm.apply(p_array)
-            p_indx = p_array.rm_tails(xlim, ylim, px_lim, py_lim)
+            p_idxs = p_array.rm_tails(xlim, ylim, px_lim, py_lim)
+            if len(p_idxs) > 0:
+                alive[indx[p_idxs]] = False
+                lost_turn[indx[p_idxs]] = i
+                indx = np.delete(indx, p_idxs)
+        if save_track and (i + 1) % stride == 0:
+            tbt[(i + 1) // stride][:, indx] = p_array.rparticles
+        if len(indx) == 0:
+            break
+    if filename is not None and tbt is not None:
+        tbt.flush()
+    return alive, lost_turn, tbt
+
+
+def survived_turns(alive, lost_turn, nturns):
+    """
+    The last turn which the particle survived (see Track_info.turn)
 
-            track_list = np.delete(track_list, p_indx)
-        for n, pxy in enumerate(track_list):
-            pxy.turn = i
-            if save_track:
-                pxy.p_list.append(p_array.rparticles[:, n])
-    return np.array(track_list_const)
+    :param alive: bool array - True for survived particles
+    :param lost_turn: int array - turn on which the particle was lost
+    :param nturns: number of turns
+    :return: int array
+    """
+    return np.where(alive, nturns - 1, np.maximum(lost_turn - 1, 0))
+
+
+def track_nturns(lat, nturns, track_list, nsuperperiods=1, save_track=True, print_progress=True):
+    p_list = [p.particle for p in track_list]
+    rparticles = np.array([[p.x, p.px, p.y, p.py, p.tau, p.p] for p in p_list]).T
+    alive, lost_turn, tbt = track_nturns_array(lat, nturns, rparticles, energy=p_list[0].E,
+                                               nsuperperiods=nsuperperiods, save_track=save_track,
+                                               print_progress=print_progress)
+    turns = survived_turns(alive, lost_turn, nturns)
+    for n, pxy in enumerate(track_list):
+        pxy.turn = int(turns[n])
+        if save_track:
+            nsaved = nturns + 1 if alive[n] else lost_turn[n] + 1
+            pxy.p_list = [pxy.p_list[0]] + list(tbt[1:nsaved, :, n])
+    return np.array(track_list)
 
 
 def track_nturns_mpi(mpi_comm, lat, nturns, track_list, errors=None, nsuperperiods=1, save_track=True):
@@ -379,6 +551,248 @@ def da_mpi(lat, nturns, x_array, y_array, errors=None, nsuperperiods=1):
         return da.reshape(ny, nx)
 
 
+# lattice of the worker process of track_nturns_pool(), it is created once by _init_pool_worker()
+_worker_lat = None
+
+
+def _pool_sequence(lat):
+    """
+    copies of the lattice elements without transfer maps, which can not be pickled.
+    The same element in several places of the sequence is copied once.
+    """
+    copies = {}
+    sequence = []
+    for element in lat.sequence:
+        if id(element) not in copies:
+            element_copy = copy.copy(element)
+            element_copy.__dict__.pop("transfer_map", None)
+            copies[id(element)] = element_copy
+        sequence.append(copies[id(element)])
+    return sequence
+
+
+def _init_pool_worker(sequence, method):
+    """
+    initializer of the worker process: the transfer maps are created once per worker
+    """
+    global _worker_lat
+    _worker_lat = MagneticLattice(sequence, method=method)
+
+
+def _pool_context():
+    """
+    "forkserver" (or "spawn" where it is not available) start method of the worker processes.
+    The forked workers can deadlock if the main process runs threads, e.g. after the numba parallel functions.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def _track_block(args):
+    """
+    Tracking of the particle block [start:stop] from the shared memory in the worker process
+
+    :return: start, lost_turn, mux, muy - mux and muy are None if tunes are not requested
+    """
+    shm_name, n, start, stop, nturns, nsuperperiods, energy, aperture, tunes, nux, nuy, diap, nearest, refined, \
+        niter = args
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        rparticles = np.array(np.ndarray((6, n), dtype=float, buffer=shm.buf)[:, start:stop])
+    finally:
+        shm.close()
+    alive, lost_turn, tbt = track_nturns_array(_worker_lat, nturns, rparticles, energy=energy,
+                                               nsuperperiods=nsuperperiods, save_track=tunes, aperture=aperture)
+    mux, muy = None, None
+    if tunes:
+        mux = -0.001 * np.ones(stop - start)
+        muy = -0.001 * np.ones(stop - start)
+        if refined and np.any(alive):
+            mux[alive] = find_tunes(tbt[:, 0, alive].T, nux, diap, niter=niter)
+            muy[alive] = find_tunes(tbt[:, 2, alive].T, nuy, diap, niter=niter)
+        elif not refined:
+            for k in np.flatnonzero(alive):
+                mux[k] = harmonic_position(tbt[:, 0, k], nux, diap, nearest)
+                muy[k] = harmonic_position(tbt[:, 2, k], nuy, diap, nearest)
+    return start, lost_turn, mux, muy
+
+
+def track_nturns_pool(lat, nturns, rparticles, energy=0., nsuperperiods=1, tunes=False, harm=True, diap=0.10,
+                      nearest=False, refined=False, niter=0, nproc=None, nblocks=None):
+    """
+    Multi-turn tracking in the pool of the worker processes on one machine (alternative to track_nturns_mpi()).
+    The initial coordinates are placed in the shared memory and every worker tracks its block of particles
+    with track_nturns_array(). Only the lost turns and the tunes are returned to the main process.
+    The lattice is sent to every worker once. The workers are started with "forkserver" (or "spawn") method,
+    so the script which calls it has to be protected by if __name__ == "__main__":
+
+    :param lat: MagneticLattice of one superperiod
+    :param nturns: number of turns
+    :param rparticles: array (6, n) - initial coordinates of the particles
+    :param energy: beam energy in [GeV]
+    :param nsuperperiods: number of superperiods in the ring
+    :param tunes: if True, the tunes of the survived particles are calculated (see freq_analysis())
+    :param harm: see freq_analysis()
+    :param diap: see freq_analysis()
+    :param nearest: see freq_analysis()
+    :param refined: see freq_analysis()
+    :param niter: see freq_analysis()
+    :param nproc: number of the worker processes, if None OCELOT_NUM_THREADS is used
+    :param nblocks: number of the particle blocks, if None nproc. The tracking time of a block is dominated by
+                    the per-map overhead, so the blocks should be as large as possible.
+    :return: alive, lost_turn, mux, muy - see track_nturns_array(), mux and muy are None if tunes is False.
+            Tunes of the lost particles are -0.001.
+    """
+    if nproc is None:
+        nproc = int(conf.OCELOT_NUM_THREADS)
+    nproc = max(nproc, 1)
+    if nblocks is None:
+        nblocks = nproc
+    rparticles = np.asarray(rparticles, dtype=float)
+    n = rparticles.shape[1]
+    nblocks = max(min(nblocks, n), 1)
+
+    aperture = aperture_limit(lat, xlim=1, ylim=1)
+    nux, nuy = None, None
+    if tunes and harm:
+        nux, nuy = beta_freq(lat, nsuperperiods)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(rparticles.nbytes, 1))
+    try:
+        np.ndarray((6, n), dtype=float, buffer=shm.buf)[:] = rparticles
+        bounds = np.linspace(0, n, nblocks + 1).astype(int)
+        tasks = [(shm.name, n, bounds[i], bounds[i + 1], nturns, nsuperperiods, energy, aperture, tunes, nux, nuy,
+                  diap, nearest, refined, niter) for i in range(nblocks) if bounds[i + 1] > bounds[i]]
+        with ProcessPoolExecutor(max_workers=min(nproc, len(tasks)), mp_context=_pool_context(),
+                                 initializer=_init_pool_worker,
+                                 initargs=(_pool_sequence(lat), lat.method)) as executor:
+            results = list(executor.map(_track_block, tasks))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    lost_turn = -np.ones(n, dtype=int)
+    mux = -0.001 * np.ones(n) if tunes else None
+    muy = -0.001 * np.ones(n) if tunes else None
+    for start, lost_turn_block, mux_block, muy_block in results:
+        stop = start + len(lost_turn_block)
+        lost_turn[start:stop] = lost_turn_block
+        if tunes:
+            mux[start:stop] = mux_block
+            muy[start:stop] = muy_block
+    alive = lost_turn < 0
+    return alive, lost_turn, mux, muy
+
+
+def _grid_particles(x_array, y_array):
+    """
+    initial coordinates on the grid in the same order as in create_track_list()
+    """
+    x, y = np.meshgrid(x_array, y_array)
+    rparticles = np.zeros((6, x.size))
+    rparticles[0] = x.flatten()
+    rparticles[2] = y.flatten()
+    return rparticles
+
+
+def _lattice_with_errors(lat, errors, nsuperperiods):
+    lat_copy = create_copy(lat, nsuperperiods=nsuperperiods)
+    errors_seed(lat_copy, errors)
+    return MagneticLattice(lat_copy.sequence, method=lat_copy.method)
+
+
+def da_pool(lat, nturns, x_array, y_array, errors=None, nsuperperiods=1, nproc=None):
+    """
+    Dynamic aperture with the process pool (see track_nturns_pool()), alternative to da_mpi()
+
+    :param lat: MagneticLattice of one superperiod
+    :param nturns: number of turns
+    :param x_array: horizontal initial coordinates
+    :param y_array: vertical initial coordinates
+    :param errors: None or the list of errors, see errors_seed()
+    :param nsuperperiods: number of superperiods in the ring
+    :param nproc: number of the worker processes, if None OCELOT_NUM_THREADS is used
+    :return: array (ny, nx) - the last turn which the particle survived
+    """
+    if errors is not None:
+        lat = _lattice_with_errors(lat, errors, nsuperperiods)
+        nsuperperiods = 1
+    alive, lost_turn, _, _ = track_nturns_pool(lat, nturns, _grid_particles(x_array, y_array),
+                                               nsuperperiods=nsuperperiods, nproc=nproc)
+    da = survived_turns(alive, lost_turn, nturns)
+    return da.reshape(len(y_array), len(x_array))
+
+
+def fma_pool(lat, nturns, x_array, y_array, nsuperperiods=1, refined=False, niter=0, nproc=None):
+    """
+    Frequency map analysis with the process pool (see track_nturns_pool()), alternative to fma()
+
+    :param lat: MagneticLattice of one superperiod
+    :param nturns: number of turns
+    :param x_array: horizontal initial coordinates
+    :param y_array: vertical initial coordinates
+    :param nsuperperiods: number of superperiods in the ring
+    :param refined: see freq_analysis()
+    :param niter: see freq_analysis()
+    :param nproc: number of the worker processes, if None OCELOT_NUM_THREADS is used
+    :return: ctr_da, da_mux, da_muy - arrays (ny, nx), see contour_da() and freq_analysis()
+    """
+    alive, lost_turn, mux, muy = track_nturns_pool(lat, nturns, _grid_particles(x_array, y_array),
+                                                   nsuperperiods=nsuperperiods, tunes=True, refined=refined,
+                                                   niter=niter, nproc=nproc)
+    turns = survived_turns(alive, lost_turn, nturns)
+    ctr_da = np.where(turns >= 0.9 * (nturns - 1), nturns, 0)
+    shape = (len(y_array), len(x_array))
+    return ctr_da.reshape(shape), mux.reshape(shape), muy.reshape(shape)
+
+
+def da_rays(lat, nturns, xmax=0.03, ymax=0.03, nrays=21, resolution=1.e-4, energy=0., nsuperperiods=1):
+    """
+    Dynamic aperture by the bisection of the survival boundary along the rays from the origin.
+    The particles of all rays are tracked together with track_nturns_array() and lost particles are not
+    tracked further, so only ~log2(max(xmax, ymax)/resolution) tracking runs of nrays particles are needed.
+
+    :param lat: MagneticLattice of one superperiod
+    :param nturns: number of turns
+    :param xmax: horizontal half axis of the search region
+    :param ymax: vertical half axis of the search region
+    :param nrays: number of rays in the upper half plane, angles are in [0, pi]
+    :param resolution: resolution of the boundary along the ray in [m]
+    :param energy: beam energy in [GeV]
+    :param nsuperperiods: number of superperiods in the ring
+    :return: x_da, y_da - arrays (nrays), the outermost survived points of the rays (DA contour)
+    """
+    aperture = aperture_limit(lat, xlim=1, ylim=1)
+    t_maps = get_map(lat, lat.totalLen, Navigator(lat))
+    angles = np.linspace(0, np.pi, nrays)
+    ray_x = xmax * np.cos(angles)
+    ray_y = ymax * np.sin(angles)
+
+    def survived(r, indx):
+        rparticles = np.zeros((6, len(indx)))
+        rparticles[0] = r * ray_x[indx]
+        rparticles[2] = r * ray_y[indx]
+        alive, _, _ = track_nturns_array(lat, nturns, rparticles, energy=energy, nsuperperiods=nsuperperiods,
+                                         save_track=False, aperture=aperture, t_maps=t_maps)
+        return alive
+
+    # the boundary is between r_in (survived) and r_out (lost) in units of the ray length
+    r_in = np.zeros(nrays)
+    r_out = np.ones(nrays)
+    r_in[survived(r_out, np.arange(nrays))] = 1.
+    ray_length = np.sqrt(ray_x ** 2 + ray_y ** 2)
+    # only the rays which are not resolved yet are tracked
+    indx = np.flatnonzero((r_out - r_in) * ray_length > resolution)
+    while len(indx) > 0:
+        r_mid = (r_in[indx] + r_out[indx]) / 2.
+        alive = survived(r_mid, indx)
+        r_in[indx[alive]] = r_mid[alive]
+        r_out[indx[~alive]] = r_mid[~alive]
+        indx = np.flatnonzero((r_out - r_in) * ray_length > resolution)
+    return r_in * ray_x, r_in * ray_y
+
+
 def tracking_step(lat, particle_list, dz, navi):
     """
     tracking for a fixed step dz
@@ -392,6 +806,8 @@ def tracking_step(lat, particle_list, dz, navi):
         dz = lat.totalLen - navi.z0
 
     t_maps = get_map(lat, dz, navi)
+    if navi.compiled and particle_list.__class__ == ParticleArray:
+        t_maps = fuse_linear_maps(t_maps, energy=particle_list.E)
     for tm in t_maps:
         start = time()
         tm.apply(particle_list)
@@ -400,6 +816,80 @@ def tracking_step(lat, particle_list, dz, navi):
     return
 
 
+_proc_pools = {}
+
+
+def proc_pool(nthreads):
+    """
+    thread pool for the kick-additive physics processes
+
+    :param nthreads: number of threads
+    :return: ThreadPoolExecutor
+    """
+    if nthreads not in _proc_pools:
+        _proc_pools[nthreads] = ThreadPoolExecutor(max_workers=nthreads)
+    return _proc_pools[nthreads]
+
+
+def apply_kicks_concurrently(p_array, procs, steps, nthreads):
+    """
+    The kick-additive physics processes are applied in the thread pool to the copies of p_array with the same
+    particles (the longitudinal binning is shared). The momentum kicks are added to p_array in the order of procs.
+
+    :param p_array: ParticleArray
+    :param procs: list of PhysProc with kick_additive = True
+    :param steps: list of the steps of the processes
+    :param nthreads: number of threads
+    :return: p_array
+    """
+    p_array.binning()
+    copies = []
+    for proc in procs:
+        p_copy = copy.copy(p_array)
+        p_copy.rparticles = p_array.rparticles.copy()
+        copies.append(p_copy)
+    futures = [proc_pool(nthreads).submit(proc.apply, p_copy, dz) for proc, p_copy, dz in zip(procs, copies, steps)]
+    for future in futures:
+        future.result()
+    momenta = p_array.rparticles[1::2].copy()
+    for proc, p_copy in zip(procs, copies):
+        if p_copy.rparticles.shape != p_array.rparticles.shape:
+            raise ValueError(proc.__class__.__name__ + " is not kick-additive: the number of particles is changed")
+        p_array.rparticles[1::2] += p_copy.rparticles[1::2] - momenta
+    return p_array
+
+
+def apply_phys_procs(p_array, proc_list, phys_steps, z0, nthreads=None):
+    """
+    applies the physics processes of one Navigator stop. The consecutive kick-additive processes
+    (PhysProc.kick_additive = True) are calculated concurrently from the same beam and their kicks are added
+    in the order of proc_list, the other processes are applied one by one.
+
+    :param p_array: ParticleArray
+    :param proc_list: list of PhysProc
+    :param phys_steps: list of the steps of the processes
+    :param z0: position of the Navigator
+    :param nthreads: number of threads, None or 1 - the processes are applied one by one,
+                     e.g. conf.OCELOT_NUM_THREADS - the kick-additive processes are calculated concurrently
+    :return: p_array
+    """
+    nthreads = 1 if nthreads is None else int(nthreads)
+    for p in proc_list:
+        p.z0 = z0
+    i = 0
+    while i < len(proc_list):
+        j = i
+        while j < len(proc_list) and getattr(proc_list[j], "kick_additive", False):
+            j += 1
+        if nthreads > 1 and j - i > 1 and p_array.__class__ == ParticleArray:
+            apply_kicks_concurrently(p_array, proc_list[i:j], phys_steps[i:j], nthreads)
+            i = j
+        else:
+            proc_list[i].apply(p_array, phys_steps[i])
+            i += 1
+    return p_array
+
+
 def track(lattice, p_array, navi, print_progress=True, calc_tws=True, bounds=None):
     """
     tracking through the lattice
@@ -425,9 +915,7 @@ def track(lattice, p_array, navi, print_progress=True, calc_tws=True, bounds=Non
         dz, proc_list, phys_steps = navi.get_next()
         tracking_step(lat=lattice, particle_list=p_array, dz=dz, navi=navi)
         #part = p_array[0]
-        for p, z_step in zip(proc_list, phys_steps):
-            p.z0 = navi.z0
-            p.apply(p_array, z_step)
+        apply_phys_procs(p_array, proc_list, phys_steps, navi.z0, nthreads=navi.proc_threads)
         #p_array[0] = part
         if p_array.n == 0:
             _logger.debug(" Tracking stop: p_array.n = 0")
@@ -8,6 +8,9 @@ Added wake table WakeTableDechirperOffAxis on 11.2019
 from ocelot.adaptors import *
 from ocelot.adaptors.astra2ocelot import *
 from ocelot.cpbd.physics_proc import PhysProc
+from ocelot.cpbd.convolution import convolve
+from ocelot.cpbd.binning import s2currents, triang_filter, weights
+from ocelot.cpbd.table_cache import table_cache
 
 import logging
 
@@ -22,14 +25,6 @@ except:
     nb_flag = False
 
 
-def triang_filter(x, filter_order):
-    Ns = x.shape[0]
-    for i in range(filter_order):
-        x[1:Ns] = (x[1:Ns] + x[0:Ns - 1]) * 0.5
-        x[0:Ns - 1] = (x[1:Ns] + x[0:Ns - 1]) * 0.5
-    return x
-
-
 def Der(x, y):
     # numerical derivative
     n = x.shape[0]
@@ -90,30 +85,8 @@ def s2current(s_array, q_array, n_points, filter_order, mean_vel):
     :param mean_vel: mean velocity
     :return:
     """
-    s0 = np.min(s_array)
-    s1 = np.max(s_array)
-    NF2 = int(np.floor(filter_order / 2.))
-    n_points = n_points + 2 * NF2
-
-    ds = (s1 - s0) / (n_points - 2 - 2 * NF2)
-    s = s0 + np.arange(-NF2, n_points - NF2) * ds
-    # here we need a fast 1D linear interpolation of charges on the grid
-    # in sc.py we use a fast 3D "near-point" interpolation
-    # we need a stand-alone module with 1D,2D,3D particles-to-grid functions
-    Ip = (s_array - s0) / ds
-    I0 = np.floor(Ip)
-    dI0 = Ip - I0
-    I0 = I0 + NF2
-    Ro = np.zeros(n_points)
-    # with numba project charge on grid
-    Ro = project_on_grid(Ro, I0, dI0, q_array)
-
-    if filter_order > 0:
-        triang_filter(Ro, filter_order)
-    I = np.zeros([n_points, 2])
-    I[:, 0] = s
-    I[:, 1] = Ro * mean_vel / ds
-    return I
+    # the same as the generalized currents of several charge arrays, see binning.s2currents()
+    return s2currents(s_array, q_array, n_points, filter_order, mean_vel)[0]
 
 
 class WakeTable:
@@ -187,19 +160,26 @@ class WakeTableDechirperOffAxis(WakeTable):
     :param length: length of the corrugated structure in [m]
     :param sigma: characteristic (rms) longitudinal beam size in [m]
     :param orient: "horz" or "vert" plate orientation
+    :param cache: TableCache of the calculated wake tables, see ocelot.cpbd.table_cache, None - no cache
     :return: hor_wake_table, vert_wake_table
     """
 
     def __init__(self, b=500 * 1e-6, a=0.01, width=0.02, t=0.25 * 1e-3, p=0.5 * 1e-3, length=1, sigma=30e-6,
-                 orient="horz"):
+                 orient="horz", cache=table_cache):
         WakeTable.__init__(self)
-        weke_horz, wake_vert = self.calculate_wake_tables(b=b, a=a, width=width, t=t, p=p, length=length, sigma=sigma)
+        params = {"b": b, "a": a, "width": width, "t": t, "p": p, "length": length, "sigma": sigma,
+                  "n_modes": 300, "s_max": 50., "ds": 0.01}
+        if cache is None:
+            weke_horz, wake_vert = self.calculate_wake_tables(**params)
+        else:
+            weke_horz, wake_vert = cache.get("dechirper_off_axis", params,
+                                             lambda: self.calculate_wake_tables(**params))
         if orient == "horz":
             self.TH = self.process_wake_table(weke_horz)
         else:
             self.TH = self.process_wake_table(wake_vert)
 
-    def calculate_wake_tables(self, b, a, width, t, p, length, sigma):
+    def calculate_wake_tables(self, b, a, width, t, p, length, sigma, n_modes=300, s_max=50., ds=0.01):
         """
         Function creates two wake tables for horizontal and vertical corrugated plates
 
@@ -210,7 +190,9 @@ class WakeTableDechirperOffAxis(WakeTable):
         :param p: period of corrugation in [m]
         :param length: length of the corrugated structure in [m]
         :param sigma: characteristic longitudinal beam size in [m]]
-        :param filename: save to files if filename is not None
+        :param n_modes: number of the modes of the series
+        :param s_max: length of the wake tables in sigma
+        :param ds: step of the wake tables in sigma
         :return: hor_wake_table, vert_wake_table
         """
         p = p * 1e3  # m -> mm
@@ -227,8 +209,8 @@ class WakeTableDechirperOffAxis(WakeTable):
         y = y0
         x0 = D / 2.
         x = x0
-        Nm = 300
-        s = np.arange(0, 50 + 0.01, 0.01) * sigma
+        Nm = n_modes
+        s = np.arange(0, s_max + ds, ds) * sigma
         ns = len(s)
 
         t2p = t / p
@@ -361,11 +343,12 @@ class Wake(PhysProc):
         self.factor = 1.
         self.step = step
         self.TH = None
+        self.kick_additive = True
 
-    def convolution(self, xu, u, xw, w):
-        # convolution of equally spaced functions
+    def convolution(self, xu, u, xw, w, n=None):
+        # convolution of equally spaced functions, n - None or number of the first points of the convolution
         hx = xu[1] - xu[0]
-        wc = np.convolve(u, w) * hx
+        wc = convolve(u, w, n) * hx
         nw = w.shape[0]
         nu = u.shape[0]
         x0 = xu[0] + xw[0]
@@ -379,7 +362,7 @@ class Wake(PhysProc):
         xwi = xb - xb[0]
         wake1 = np.interp(xwi, xw, wake, 0, 0)
         wake1[0] = wake1[0] * 0.5
-        xW, Wake = self.convolution(xb, bunch, xwi, wake1)
+        xW, Wake = self.convolution(xb, bunch, xwi, wake1, n=nb)
         return xW[0:nb], Wake[0:nb]
 
     def add_wake(self, I, T):
@@ -414,28 +397,38 @@ class Wake(PhysProc):
             W = W - int_bunch * Cinv / c
         return x, W
 
-    def add_total_wake(self, X, Y, Z, q, TH, Ns, NF):
+    def add_total_wake(self, X, Y, Z, q, TH, Ns, NF, binning=None):
+        """
+        :param binning: None or LongitudinalBinning of the particles X, Y, Z, q (ParticleArray.binning()),
+                        the generalized currents are taken from the binning
+        """
         T, H = TH
         c = speed_of_light
         Np = X.shape[0]
         X2 = X ** 2
         Y2 = Y ** 2
         XY = X * Y
-        # generalized currents;
-        I00 = s2current(Z, q, Ns, NF, c)
-        Nw = I00.shape[0]
+        # generalized currents, all in one pass over the particles
+        names = ["q"]
         if (H[0, 2] > 0) or (H[2, 3] > 0) or (H[2, 4] > 0):
-            qn = q * Y
-            I01 = s2current(Z, qn, Ns, NF, c)
+            names.append("y")
         if (H[0, 1] > 0) or (H[1, 3] > 0) or (H[1, 4] > 0):
-            qn = q * X
-            I10 = s2current(Z, qn, Ns, NF, c)
+            names.append("x")
         if H[1, 2] > 0:
-            qn = q * XY
-            I11 = s2current(Z, qn, Ns, NF, c)
+            names.append("xy")
         if H[1, 1] > 0:
-            qn = q * (X2 - Y2)
-            I20_02 = s2current(Z, qn, Ns, NF, c)
+            names.append("x2-y2")
+        if binning is None:
+            currents = s2currents(Z, np.array([weights[name](X, Y, q) for name in names]), Ns, NF, c)
+        else:
+            currents = binning.currents(Ns, NF, c, names)
+        currents = dict(zip(names, currents))
+        I00 = currents["q"]
+        I01 = currents.get("y")
+        I10 = currents.get("x")
+        I11 = currents.get("xy")
+        I20_02 = currents.get("x2-y2")
+        Nw = I00.shape[0]
         # longitudinal wake
         # mn=0
         x, Wz = self.add_wake(I00, T[int(H[0, 0])])
@@ -507,7 +500,7 @@ class Wake(PhysProc):
             p = np.interp(Z, x, Wx, 0, 0)
             Px = Px + p * X
             Py = Py - p * Y
-        I00[:, 0] = - I00[:, 0]
+        I00 = np.column_stack((- I00[:, 0], I00[:, 1]))
         # Z=-Z
         return Px, Py, Pz, I00
 
@@ -533,7 +526,7 @@ class Wake(PhysProc):
 
         ps = p_array.rparticles
         Px, Py, Pz, I00 = self.add_total_wake(ps[0], ps[2], ps[4], p_array.q_array, self.TH,
-                                              self.w_sampling, self.filter_order)
+                                              self.w_sampling, self.filter_order, binning=p_array.binning())
 
         L = self.s_stop - self.s_start
         if L == 0:
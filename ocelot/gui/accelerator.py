@@ -12,6 +12,7 @@ import matplotlib.patches as mpatches
 import matplotlib.path as mpath
 import matplotlib.pyplot as plt
 from ocelot.cpbd.optics import *
+from ocelot.cpbd.beam import TwissTable
 import numpy as np
 from copy import deepcopy
 
@@ -468,12 +469,14 @@ def plot_elems(fig, ax, lat, s_point=0, nturns=1, y_lim=None, y_scale=1, legend=
 
 
 def plot_disp(ax, tws, top_plot, font_size):
-    S = [p.s for p in tws]  # map(lambda p:p.s, tws)
+    if not isinstance(tws, TwissTable):
+        tws = TwissTable.from_list(tws)
+    S = tws.s
     d_Ftop = []
     Fmin = []
     Fmax = []
     for elem in top_plot:
-        Ftop = [p.__dict__[elem] for p in tws]
+        Ftop = getattr(tws, elem)
 
         Fmin.append(min(Ftop))
         Fmax.append(max(Ftop))
@@ -562,9 +565,11 @@ def plot_opt_func(lat, tws, top_plot=["Dx"], legend=True, fig_name=None, grid=Tr
     ax_el.grid(grid)
 
     fig.subplots_adjust(hspace=0)
-    beta_x = [p.beta_x for p in tws]
-    beta_y = [p.beta_y for p in tws]
-    S = [p.s for p in tws]
+    if not isinstance(tws, TwissTable):
+        tws = TwissTable.from_list(tws)
+    beta_x = tws.beta_x
+    beta_y = tws.beta_y
+    S = tws.s
 
     plt.xlim(S[0], S[-1])
 
@@ -614,11 +619,13 @@ def plot_opt_func_reduced(lat, tws, top_plot=["Dx"], legend=True, fig_name=None,
     ax_el.grid(grid)
 
     fig.subplots_adjust(hspace=0)
-    beta_x = [p.beta_x for p in tws]  # list(map(lambda p:p.beta_x, tws))
-    beta_y = [p.beta_y for p in tws]  # list(map(lambda p:p.beta_y, tws))
-    D_x = [p.Dx for p in tws]  # list(map(lambda p:p.beta_x, tws))
-    D_y = [p.Dy for p in tws]  # list(map(lambda p:p.beta_y, tws))
-    S = [p.s for p in tws]  # list(map(lambda p:p.s, tws))
+    if not isinstance(tws, TwissTable):
+        tws = TwissTable.from_list(tws)
+    beta_x = tws.beta_x
+    beta_y = tws.beta_y
+    D_x = tws.Dx
+    D_y = tws.Dy
+    S = tws.s
 
     plt.xlim(S[0], S[-1])
 
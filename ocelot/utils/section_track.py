@@ -399,18 +399,12 @@ class SectionTrack:
 
         self.folder_check_create(tws_file_name)
 
-        bx = np.array([tw.beta_x for tw in twiss_list])
-        by = np.array([tw.beta_y for tw in twiss_list])
-        ax = np.array([tw.alpha_x for tw in twiss_list])
-        ay = np.array([tw.alpha_x for tw in twiss_list])
-        s = np.array([tw.s for tw in twiss_list])
-        E = np.array([tw.E for tw in twiss_list])
-
-        emit_x = np.array([tw.emit_x for tw in twiss_list])
-        emit_y = np.array([tw.emit_y for tw in twiss_list])
-
-        np.savez_compressed(tws_file_name, beta_x=bx, beta_y=by, alpha_x=ax, alpha_y=ay, E=E, s=s,
-                            emit_x=emit_x, emit_y=emit_y)
+        if not isinstance(twiss_list, TwissTable):
+            twiss_list = TwissTable.from_list(twiss_list)
+
+        np.savez_compressed(tws_file_name, beta_x=twiss_list.beta_x, beta_y=twiss_list.beta_y,
+                            alpha_x=twiss_list.alpha_x, alpha_y=twiss_list.alpha_y, E=twiss_list.E, s=twiss_list.s,
+                            emit_x=twiss_list.emit_x, emit_y=twiss_list.emit_y)
 
     def load_twiss_file(self):
         return np.load(self.tws_file)
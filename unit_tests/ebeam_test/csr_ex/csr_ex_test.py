@@ -347,6 +347,113 @@ def test_track_undulator_endings_with_csr(lattice, p_array, parameter=None, upda
     assert check_result(result1 + result2)
 
 
+def test_csr_kernel_cache(lattice, p_array, parameter=None, update_ref_values=False):
+    """CSR tracking with the kernels from the memory and the disk cache"""
+    import shutil
+    from ocelot.cpbd.csr import KernelCache
+
+    for elem in lattice.sequence:
+        if elem.__class__ == Bend:
+            elem.tilt = 0
+    lattice.update_transfer_maps()
+
+    cache_dir = FILE_DIR + '/kernel_cache'
+    cache = KernelCache(cache_dir=cache_dir)
+    p_arrays = []
+    for kernel_cache in [cache, cache, KernelCache(cache_dir=cache_dir)]:
+        csr = CSR()
+        csr.traj_step = 0.0002
+        csr.apply_step = 0.0005
+        csr.kernel_cache = kernel_cache
+        # exact keys, the tracking has to reproduce the reference without the cache
+        csr.kernel_gamma_tol = 0.
+        csr.kernel_dw_tol = 0.
+        navi = Navigator(lattice)
+        navi.add_physics_proc(csr, lattice.sequence[0], lattice.sequence[-1])
+        navi.unit_step = 0.05
+        tws_track, p = track(lattice, copy.deepcopy(p_array), navi)
+        p_arrays.append(obj2dict(p))
+    info_disk = kernel_cache.info()
+    shutil.rmtree(cache_dir)
+
+    tws_track_p_array_ref = json_read(REF_RES_DIR + 'test_track_with_csr.json')
+    result1 = check_dict(p_arrays[0], tws_track_p_array_ref['p_array'], TOL, assert_info=' p_array - ')
+    result2 = check_dict(p_arrays[1], p_arrays[0], TOL, assert_info=' p_array memory cache - ')
+    result3 = check_dict(p_arrays[2], p_arrays[0], TOL, assert_info=' p_array disk cache - ')
+    result4 = check_value(cache.info()["hits"], cache.info()["misses"], assert_info=' memory hits - \n')
+    result5 = check_value(info_disk["disk_hits"], cache.info()["misses"], assert_info=' disk hits - \n')
+    result6 = check_value(info_disk["misses"], 0, assert_info=' disk misses - \n')
+    assert check_result(result1 + result2 + result3 + [result4, result5, result6])
+
+
+def test_csr_kernel_threads(lattice, p_array, parameter=None, update_ref_values=False):
+    """CSR kernels of one step calculated in parallel with numba and numpy back ends"""
+
+    csr = CSR()
+    csr.kernel_cache = None
+    navi = Navigator(lattice)
+    navi.add_physics_proc(csr, lattice.sequence[0], lattice.sequence[-1])
+    n = csr.csr_traj.shape[1]
+    itr_ra = np.arange(n//2, n//2 + 20)
+    Ndw = [300, 1.e-7]
+    gamma = p_array.E / m_e_GeV
+
+    result = []
+    for eval in [csr.k0_fin_anf.eval, csr.k0_fin_anf.K0_fin_anf_np]:
+        csr.k0_fin_anf.eval = eval
+        csr.kernel_threads = 1
+        K1 = csr.kernels(itr_ra, Ndw, gamma)
+        csr.kernel_threads = 4
+        K1_threads = csr.kernels(itr_ra, Ndw, gamma)
+        for i in range(len(itr_ra)):
+            result += check_matrix(K1_threads[i], K1[i], 0., assert_info=' K1 ' + eval.__name__ + ' - ')
+    assert check_result(result)
+
+
+def test_csr_traj_cache(lattice, p_array, parameter=None, update_ref_values=False):
+    """preallocated and cached trajectory of the reference particle, endpoint mode of rk_track_in_field"""
+    from ocelot.cpbd.csr import csr_traj_cache
+    from ocelot.cpbd.high_order import arcline, rk_track_in_field
+
+    csr_traj_cache.clear()
+    trajs = []
+    for traj_cache in [csr_traj_cache, csr_traj_cache, None]:
+        csr = CSR()
+        csr.traj_cache = traj_cache
+        navi = Navigator(lattice)
+        navi.add_physics_proc(csr, lattice.sequence[0], lattice.sequence[-1])
+        trajs.append(csr.csr_traj)
+
+    # trajectory appended element by element
+    traj = np.transpose([[0, 0, 0, 0, 0, 0, 1.]])
+    for elem in lattice.sequence:
+        if elem.l == 0:
+            continue
+        R_vect = [0, 0, 0.]
+        if elem.__class__ in [Bend, RBend, SBend] and elem.angle != 0:
+            R = -elem.l / elem.angle
+            R_vect = [-R * np.sin(elem.tilt), R * np.cos(elem.tilt), 0]
+        traj = arcline(traj, elem.l, csr.traj_step, R_vect)
+
+    result1 = check_matrix(trajs[0].flatten(), traj.flatten(), TOL, 'absolute', assert_info=' trajectory - ')
+    result2 = check_value(trajs[1] is trajs[0], True, assert_info=' cached trajectory - \n')
+    result3 = check_matrix(trajs[2].flatten(), trajs[0].flatten(), TOL, 'absolute', assert_info=' not cached - ')
+    result4 = check_value(csr_traj_cache.info()["hits"], 1, assert_info=' hits - \n')
+
+    energy = p_array.E
+    mag_field = lambda x, y, z: (0.01, 0.3, 0)
+    y0 = np.array([[0, 0.001], [0, 0.0001], [0, 0.001], [0, 0], [0, 0], [0, 0.01]])
+    u = rk_track_in_field(y0, 1., 101, energy, mag_field)
+    u_end = rk_track_in_field(y0, 1., 101, energy, mag_field, endpoint=True)
+    x1 = u[1 + 9::9]
+    y1 = u[3 + 9::9]
+    dz = u[4 + 9::9] - u[4:-9:9]
+    path = np.sum(dz * np.sqrt(1 + x1 * x1 + y1 * y1), axis=0)
+    result5 = check_matrix(u_end[:9].flatten(), u[-9:].flatten(), TOL, 'absolute', assert_info=' endpoint - ')
+    result6 = check_matrix(u_end[9], path, TOL, 'absolute', assert_info=' path - ')
+    assert check_result(result1 + [result2] + result3 + [result4] + result5 + result6)
+
+
 def setup_module(module):
 
     f = open(pytest.TEST_RESULTS_FILE, 'a')
@@ -41,6 +41,18 @@ def test_twiss(lattice, update_ref_values=False):
     assert check_result(result)
 
 
+def test_twiss_table(lattice, update_ref_values=False):
+    """Twiss parameters calculation with TwissTable"""
+
+    tws = twiss(lattice, Twiss())
+    tws_table = twiss(lattice, Twiss(), return_table=True)
+
+    result1 = check_dict(obj2dict(tws_table), obj2dict(tws), TOL, 'absotute', assert_info=' tws_table - ')
+    result2 = check_matrix(tws_table.beta_x, np.array([tw.beta_x for tw in tws]), TOL, assert_info=' beta_x - ')
+    result3 = check_value(tws_table[-1].id, tws[-1].id, assert_info=' id - ')
+    assert check_result(result1 + result2 + result3)
+
+
 def test_lattice_transfer_map_after_matching(lattice, update_ref_values=False):
     """After matching R maxtrix calculcation test"""
     
@@ -81,6 +93,184 @@ def test_twiss_after_matching(lattice, update_ref_values=False):
     assert check_result(result)
 
 
+def test_matrix_cache(lattice, update_ref_values=False):
+    """R matrix calculation with cached and recalculated element matrices"""
+    from ocelot.cpbd.r_matrix import r_matrix_cache
+
+    r_matrix_cache.clear()
+    r_matrix = lattice_transfer_map(lattice, 0.0)
+    misses = r_matrix_cache.info()["misses"]
+    r_matrix_2 = lattice_transfer_map(lattice, 0.0)
+    result1 = check_matrix(r_matrix_2, r_matrix, TOL, assert_info=' r_matrix cached - ')
+    result2 = check_value(r_matrix_cache.info()["misses"], misses, assert_info=' misses - ')
+    result3 = check_value(r_matrix_cache.info()["hits"] > 0, True, assert_info=' hits - ')
+
+    r_matrix_cache.enabled = False
+    r_matrix_3 = lattice_transfer_map(lattice, 0.0)
+    r_matrix_cache.enabled = True
+    result4 = check_matrix(r_matrix_3, r_matrix, TOL, assert_info=' r_matrix not cached - ')
+    assert check_result(result1 + [result2, result3] + result4)
+
+
+def test_update_transfer_maps(lattice, update_ref_values=False):
+    """incremental update of the transfer maps after change of the element parameters"""
+    lattice.update_transfer_maps()
+    tms = {elem: elem.transfer_map for elem in lattice.sequence}
+    bend = lattice.sequence[lattice.find_indices(Bend)[0]]
+    k1_b, k1_q = bend.k1, Q2.k1
+    bend.k1 = -0.07
+    Q2.k1 = 1.5
+    lattice.update_transfer_maps()
+
+    result = []
+    for elem in lattice.sequence:
+        updated = tms[elem] is not elem.transfer_map
+        expected = elem in (bend, Q2) or (elem.__class__ == Edge and elem.k1 == -0.07)
+        result.append(check_value(updated, expected, assert_info=' ' + elem.id + ' updated - '))
+    r_matrix = lattice_transfer_map(lattice, 0.0)
+    r_matrix_full = lattice_transfer_map(lattice.update_transfer_maps(full=True), 0.0)
+    result += check_matrix(r_matrix, r_matrix_full, TOL, assert_info=' r_matrix - ')
+
+    bend.k1, Q2.k1 = k1_b, k1_q
+    lattice.update_transfer_maps()
+    assert check_result(result)
+
+
+def test_get_transfer_maps(lattice, update_ref_values=False):
+    """R matrices between elements from the cached cumulative maps"""
+
+    r_matrix = lattice_transfer_map(lattice, 0.0)
+    R, T, B = lattice.get_transfer_maps(energy=0.0)
+    result1 = check_matrix(R, r_matrix, TOL, assert_info=' R lattice - ')
+
+    sub_lattice = MagneticLattice(lattice.get_sequence_part(Q2, Q4), method=lattice.method)
+    r_matrix = lattice_transfer_map(sub_lattice, 0.0)
+    R, T, B = lattice.get_transfer_maps(start=Q2, stop=Q4, energy=0.0)
+    result2 = check_matrix(R, r_matrix, TOL, 'absotute', assert_info=' R Q2 -> Q4 - ')
+
+    k1 = Q3.k1
+    Q3.k1 = -1.8
+    lattice.update_transfer_maps()
+    r_matrix = lattice_transfer_map(sub_lattice.update_transfer_maps(), 0.0)
+    R, T, B = lattice.get_transfer_maps(start=Q2, stop=Q4, energy=0.0)
+    result3 = check_matrix(R, r_matrix, TOL, 'absotute', assert_info=' R Q2 -> Q4 after Q3 change - ')
+
+    # transfer map is replaced directly as in match(), the lattice is updated afterwards
+    Q3.k1 = -1.5
+    Q3.transfer_map = lattice.method.create_tm(Q3)
+    lattice.update_transfer_maps()
+    r_matrix = lattice_transfer_map(sub_lattice.update_transfer_maps(), 0.0)
+    R, T, B = lattice.get_transfer_maps(start=Q2, stop=Q4, energy=0.0)
+    result3 += check_matrix(R, r_matrix, TOL, 'absotute', assert_info=' R Q2 -> Q4 after Q3 map change - ')
+    Q3.k1 = k1
+    lattice.update_transfer_maps()
+    assert check_result(result1 + result2 + result3)
+
+
+def test_get_transfer_maps_second_order(lattice, cell, update_ref_values=False):
+    """second order maps between elements from the cached cumulative maps"""
+    import copy
+
+    cell = copy.deepcopy(cell)
+    # misaligned quadrupoles give nonzero B
+    cell[3].dx = 1e-3
+    cell[5].dy = -1e-3
+    lat = MagneticLattice(cell, method=MethodTM({"global": SecondTM}))
+    quads = [elem for elem in lat.sequence if elem.__class__ == Quadrupole]
+    sextupoles = [elem for elem in lat.sequence if elem.__class__ == Sextupole]
+    result = []
+    for start, stop in [(None, None), (quads[1], sextupoles[0]), (lat.sequence[1], lat.sequence[-2])]:
+        ia = 0 if start is None else lat.sequence.index(start)
+        ib = len(lat.sequence) if stop is None else lat.sequence.index(stop) + 1
+        sub_lat = MagneticLattice(lat.sequence[ia:ib], method=lat.method)
+        R_ref = lattice_transfer_map(sub_lat, 1.0)
+        R, T, B = lat.get_transfer_maps(start=start, stop=stop, energy=1.0, order=2)
+        info = ' ' + ('start' if start is None else start.id) + ' -> ' + ('end' if stop is None else stop.id)
+        result += check_matrix(R, R_ref, TOL, 'absolute', assert_info=info + ' R - ')
+        result += check_matrix(T.flatten(), sub_lat.T.flatten(), TOL, 'absolute', assert_info=info + ' T - ')
+        result += check_matrix(B, sub_lat.B, TOL, 'absolute', assert_info=info + ' B - ')
+    assert check_result(result)
+
+
+def test_transfer_maps_mult(lattice, update_ref_values=False):
+    """second order map concatenation: loop, numpy and batched pairwise reduction"""
+    from ocelot.cpbd.optics import transfer_maps_mult_py, transfer_maps_mult_np, transfer_maps_mult_batch
+
+    np.random.seed(1)
+    Rs = np.random.rand(5, 6, 6)
+    Ts = np.random.rand(5, 6, 6, 6)
+    Bs = np.random.rand(5, 6, 1)
+    R, T, B = np.eye(6), np.zeros((6, 6, 6)), np.zeros((6, 1))
+    R_np, T_np = np.eye(6), np.zeros((6, 6, 6))
+    for i in range(5):
+        R, T = transfer_maps_mult_py(R, T, Rs[i], Ts[i])
+        R_np, T_np = transfer_maps_mult_np(R_np, T_np, Rs[i], Ts[i])
+        B = np.dot(Rs[i], B) + Bs[i]
+    R_b, T_b, B_b = transfer_maps_mult_batch(Rs, Ts, Bs)
+
+    result1 = check_matrix(R_np, R, TOL, assert_info=' R numpy - ')
+    result2 = check_matrix(T_np.flatten(), T.flatten(), TOL, assert_info=' T numpy - ')
+    result3 = check_matrix(R_b, R, TOL, assert_info=' R batch - ')
+    result4 = check_matrix(T_b.flatten(), T.flatten(), TOL, assert_info=' T batch - ')
+    result5 = check_matrix(B_b, B, TOL, assert_info=' B batch - ')
+    assert check_result(result1 + result2 + result3 + result4 + result5)
+
+
+def test_second_order_mult(lattice, update_ref_values=False):
+    """sparse second order kernels (numba and numpy) in comparison with the dense einsum with misalignments"""
+    from ocelot.cpbd.optics import SecondOrderMult, sparse_second_order, transform_vec_ent, transform_vec_ext
+
+    np.random.seed(2)
+    R = np.random.rand(6, 6)
+    T = np.random.rand(6, 6, 6)
+    T[:, 4, :] = 0.
+    X0 = np.random.randn(6, 2500) * 1e-3
+    mult = SecondOrderMult()
+    mult.chunk_size = 1000
+    result = []
+    for dx, dy, tilt in [(0., 0., 0.), (1e-4, -2e-4, 0.1)]:
+        X_ref = transform_vec_ent(np.copy(X0), dx, dy, tilt)
+        X_ref = np.matmul(R, X_ref) + np.einsum('ijk,j...,k...->i...', T, X_ref, X_ref)
+        X_ref = transform_vec_ext(X_ref, dx, dy, tilt)
+        for apply in [mult.numba_apply, mult.numpy_apply]:
+            for sparse in [None, sparse_second_order(T)]:
+                X = np.copy(X0)
+                apply(X, R, T, dx, dy, tilt, sparse=sparse)
+                result += check_matrix(X, X_ref, 1e-15, tolerance_type='absolute',
+                                       assert_info=' ' + apply.__name__ + ' tilt=' + str(tilt) + ' - ')
+    assert check_result(result)
+
+
+def test_update_transfer_maps_in_place(lattice, update_ref_values=False):
+    """update of the transfer maps after change of the list attribute in place"""
+    m = Multipole(kn=[0, .5, 1])
+    d = Drift(l=1.)
+    lat = MagneticLattice((d, m, d))
+    m.kn[1] = .1
+    lat.update_transfer_maps()
+    r_matrix = lattice_transfer_map(lat, 0.0)
+    result = check_value(r_matrix[0, 1], 1.9, tolerance=TOL, assert_info=' R12 - \n')
+    assert check_result([result])
+
+
+def test_update_transfer_maps_method(lattice, update_ref_values=False):
+    """all transfer maps are recalculated after change of lattice.method or its parameters"""
+    d = Drift(l=1.)
+    sf = Sextupole(l=0.1, k2=10.)
+    lat = MagneticLattice((d, sf, d))
+    lat.method = MethodTM({"global": SecondTM})
+    lat.update_transfer_maps()
+    result = [check_value(elem.transfer_map.__class__ == SecondTM, True,
+                          assert_info=' ' + elem.__class__.__name__ + ' SecondTM - \n') for elem in lat.sequence]
+
+    # parameters of the method are changed in place
+    lat.method.params[Sextupole] = KickTM
+    lat.update_transfer_maps()
+    result.append(check_value(sf.transfer_map.__class__ == KickTM, True, assert_info=' Sextupole KickTM - \n'))
+    result.append(check_value(d.transfer_map.__class__ == SecondTM, True, assert_info=' Drift SecondTM - \n'))
+    assert check_result(result)
+
+
 def setup_module(module):
 
     f = open(pytest.TEST_RESULTS_FILE, 'a')
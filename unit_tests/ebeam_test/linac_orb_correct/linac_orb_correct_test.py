@@ -70,6 +70,39 @@ def test_response_matrix(lattice, update_ref_values=False):
     assert check_result(result)
 
 
+def test_dispersive_response_matrix(lattice, cell, update_ref_values=False):
+    """Dispersive responce maxtrix calculation test, comparison with tracking of R and T from each corrector"""
+
+    lat = MagneticLattice(cell, method=MethodTM({"global": SecondTM}))
+    orb = Orbit(lat)
+    tws0 = Twiss()
+    tws0.E = 0.13
+    method = LinacDisperseTmatrixRM(lattice=lat, hcors=orb.hcors, vcors=orb.vcors, bpms=orb.bpms)
+    resp = method.calculate(tw_init=tws0)
+
+    m = len(orb.bpms)
+    resp_ref = np.zeros_like(resp)
+    for j, cor in enumerate(orb.hcors + orb.vcors):
+        Ra = np.eye(6)
+        Ta = np.zeros((6, 6, 6))
+        E = tws0.E
+        for i, elem in enumerate(lat.sequence):
+            if i >= cor.lat_inx:
+                Ra, Ta = transfer_maps_mult(Ra, Ta, elem.transfer_map.R(E), elem.transfer_map.t_mat_z_e(elem.l, E))
+                if elem in orb.bpms:
+                    n = orb.bpms.index(elem)
+                    if cor.__class__ == Hcor:
+                        resp_ref[n, j] = Ta[0, 1, 5]
+                    else:
+                        resp_ref[n + m, j] = Ta[2, 3, 5]
+            E += elem.transfer_map.delta_e
+    # elements are shared with the lattice fixture
+    lattice.update_transfer_maps()
+
+    result = check_matrix(resp, resp_ref, 1e-10, 'absotute', assert_info=' dispersive response_matrix - ')
+    assert check_result(result)
+
+
 def test_save_load_rm(lattice, update_ref_values=False):
     """Responce maxtrix calculation test"""
 
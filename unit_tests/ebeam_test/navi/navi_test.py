@@ -502,6 +502,50 @@ def teardown_module(module):
     f.close()
 
 
+def test_lattice_positions(lattice, p_array, parameter=None, update_ref_values=False):
+    """
+    test cumulative positions and element indices of the lattice used by Navigator
+    """
+    s_ref = [np.sum(np.array([elem.l for elem in lattice.sequence[:i]])) for i in range(len(lattice.sequence) + 1)]
+    result1 = check_matrix(lattice.s_positions, np.array(s_ref), tolerance=TOL, tolerance_type='absolute', assert_info=' s_positions - ')
+    indx = [lattice.get_elem_index(elem) for elem in lattice.sequence]
+    indx_ref = [lattice.sequence.index(elem) for elem in lattice.sequence]
+    result2 = check_matrix(np.array(indx), np.array(indx_ref), tolerance=TOL, assert_info=' indices - ')
+
+    D1.l = 0.5
+    lattice.update_transfer_maps()
+    result3 = check_value(lattice.s_positions[-1], 1.55, tolerance=TOL, assert_info=' totalLen - ')
+    D1.l = 0.4
+    lattice.update_transfer_maps()
+    assert check_result(result1 + result2 + [result3])
+
+
+def test_navi_compiled(lattice, p_array, parameter=None, update_ref_values=False):
+    """
+    test tracking with fused linear transfer maps
+    """
+    lat = MagneticLattice(lattice.sequence)
+    p_array.rparticles[:] = np.random.randn(6, p_array.n) * 1e-4
+
+    p_array_1 = copy.deepcopy(p_array)
+    navi = Navigator(lat)
+    navi.unit_step = 0.2
+    navi.add_physics_proc(LogProc(), D0, D2)
+    track(lat, p_array_1, navi, calc_tws=False, print_progress=False)
+
+    p_array_2 = copy.deepcopy(p_array)
+    navi = Navigator(lat)
+    navi.unit_step = 0.2
+    navi.add_physics_proc(LogProc(), D0, D2)
+    navi.compiled = True
+    track(lat, p_array_2, navi, calc_tws=False, print_progress=False)
+
+    result1 = check_matrix(p_array_2.rparticles, p_array_1.rparticles, tolerance=1e-12, tolerance_type='absolute',
+                           assert_info=' rparticles - ')
+    result2 = check_value(p_array_2.s, p_array_1.s, tolerance=TOL, assert_info=' s - ')
+    assert check_result(result1 + [result2])
+
+
 def setup_function(function):
     
     f = open(pytest.TEST_RESULTS_FILE, 'a')
@@ -38,6 +38,38 @@ def test_s2current(lattice, p_array, parameter=None, update_ref_values=False):
     assert check_result(result1 + result2)
 
 
+def test_binning(lattice, p_array, parameter=None, update_ref_values=False):
+    """longitudinal binning shared by the physics processes and its invalidation"""
+
+    p = copy.deepcopy(p_array)
+    p.rparticles[0] += 1e-4 * p.rparticles[4] / np.std(p.rparticles[4])
+    binning = p.binning()
+    inds = binning.sort_index()
+    I_q, I_x, I_xy = binning.currents(300, 5, speed_of_light, ["q", "x", "xy"])
+    I_x2 = p.binning().currents(300, 5, speed_of_light, ["x", "x2-y2"])[1]
+    inds2 = p.binning().sort_index()
+
+    X, Y = p.x(), p.y()
+    result = check_matrix(inds, np.argsort(p.tau()), assert_info=' sort index - ')
+    for I, q in [(I_q, p.q_array), (I_x, p.q_array * X), (I_xy, p.q_array * (X * Y)),
+                 (I_x2, p.q_array * (X ** 2 - Y ** 2))]:
+        I_ref = s2current(s_array=p.tau(), q_array=q, n_points=300, filter_order=5, mean_vel=speed_of_light)
+        result += check_matrix(I.flatten(), I_ref.flatten(), TOL, assert_info=' current - ')
+    info = binning.info()
+    result += [check_value(p.binning() is binning, True, assert_info=' cached binning - \n'),
+               check_value(inds2 is inds, True, assert_info=' cached sort index - \n'),
+               check_value(info["sorts"], 1, assert_info=' sorts - \n'),
+               check_value(info["depositions"], 2, assert_info=' depositions - \n')]
+
+    p.rparticles[5] += 0.001
+    result.append(check_value(p.binning() is binning, True, assert_info=' binning after energy kick - \n'))
+    p.rparticles[4, 0] += 1e-6
+    result.append(check_value(p.binning() is binning, False, assert_info=' binning after move - \n'))
+    p_copy = copy.deepcopy(p)
+    result.append(check_value(p_copy._binning is None, True, assert_info=' binning of the copy - \n'))
+    assert check_result(result)
+
+
 @pytest.mark.parametrize('parameter', [0, 1])
 def test_track_smooth(lattice, p_array, parameter, update_ref_values=False):
     """
@@ -376,6 +408,33 @@ def test_track_lsc(lattice, p_array, parameter=None, update_ref_values=False):
     result2 = check_dict(p, tws_track_p_array_ref['p_array'], tolerance=TOL, assert_info=' p - ')
     assert check_result(result1 + result2)
 
+def test_track_kick_additive(lattice, p_array, parameter=None, update_ref_values=False):
+    """concurrent kick-additive physics processes (CSR, LSC, Wake) in comparison with the serial application"""
+
+    p_arrays = []
+    for proc_threads in [1, 4]:
+        navi = Navigator(lattice)
+        navi.unit_step = 0.1
+        navi.proc_threads = proc_threads
+        csr = CSR()
+        csr.energy = p_array.E
+        lsc = LSC()
+        ws = Wake()
+        ws.wake_table = WakeTableDechirperOffAxis(b=500 * 1e-6)
+        ap = RectAperture(xmax=0.01, ymax=0.01)
+        navi.add_physics_proc(csr, lattice.sequence[0], lattice.sequence[-1])
+        navi.add_physics_proc(lsc, lattice.sequence[0], lattice.sequence[-1])
+        navi.add_physics_proc(ap, lattice.sequence[0], lattice.sequence[-1])
+        navi.add_physics_proc(ws, m1, m1)
+        tws_track, p = track(lattice, copy.deepcopy(p_array), navi, calc_tws=False)
+        p_arrays.append(p)
+
+    result = check_matrix(p_arrays[1].rparticles.flatten(), p_arrays[0].rparticles.flatten(), TOL, 'absolute',
+                          assert_info=' p_array - ')
+    result2 = check_value(p_arrays[1].n, p_arrays[0].n, assert_info=' n - \n')
+    assert check_result(result + [result2])
+
+
 def test_track_spontan_rad_effects(lattice, p_array, parameter=None, update_ref_values=False):
     """
     test PhysicsProc LaserModulator
@@ -487,7 +487,9 @@ def test_twiss(section_lat, p_array, parameter=None, update_ref_values=False):
 
     tws_ref = json_read(REF_RES_DIR + sys._getframe().f_code.co_name + '.json')
 
-    result2 = check_dict(tws, tws_ref['tws'], tolerance=1.0e-10, tolerance_type='absolute',  assert_info=' tws - ')
+    # the Navigator steps follow lattice.s_positions (cumulative sum of the lengths), the reference was calculated
+    # with the pairwise sums of the lengths: beta functions up to ~200 m differ by ~1e-12 relative
+    result2 = check_dict(tws, tws_ref['tws'], tolerance=1.0e-9, tolerance_type='absolute', assert_info=' tws - ')
     assert check_result(result2)
 
 
@@ -539,7 +541,9 @@ def test_twiss_section_lat(section_lat, p_array, parameter=None, update_ref_valu
 
     tws_ref = json_read(REF_RES_DIR + sys._getframe().f_code.co_name + '.json')
 
-    result2 = check_dict(tws, tws_ref['tws'], tolerance=1.0e-10, tolerance_type='absolute', assert_info=' tws - ')
+    # the Navigator steps follow lattice.s_positions (cumulative sum of the lengths), the reference was calculated
+    # with the pairwise sums of the lengths: beta functions up to ~200 m differ by ~1e-12 relative
+    result2 = check_dict(tws, tws_ref['tws'], tolerance=1.0e-9, tolerance_type='absolute', assert_info=' tws - ')
     assert check_result(result2)
 
 
@@ -145,6 +145,216 @@ def test_get_current(lattice, p_array, parameter, update_ref_values=False):
     assert check_result(result1+result2)
 
 
+def test_sc_kernel_cache(lattice, p_array, parameter=None, update_ref_values=False):
+    """Space charge field with the cached Green's function FFT"""
+
+    nmesh = np.array([31, 31, 31])
+    X = np.copy(p_array.rparticles[[0, 2, 4]].T)
+    gamma = p_array.E / m_e_GeV
+
+    sc = SpaceCharge()
+    E_ref = sc.el_field(np.copy(X), p_array.q_array, gamma, nmesh)
+
+    # exact mesh steps
+    sc = SpaceCharge()
+    sc.kernel_cache = True
+    sc.kernel_step_tol = 0.
+    E1 = sc.el_field(np.copy(X), p_array.q_array, gamma, nmesh)
+    E2 = sc.el_field(np.copy(X), p_array.q_array, gamma, nmesh)
+    result1 = check_matrix(E1, E_ref, TOL, assert_info=' E - ')
+    result2 = check_matrix(E2, E_ref, TOL, assert_info=' E cached - ')
+    result3 = check_value(len(sc._kernels), 1, assert_info=' number of kernels - ')
+
+    # quantized mesh steps (default kernel_step_tol)
+    sc = SpaceCharge()
+    sc.kernel_cache = True
+    E3 = sc.el_field(np.copy(X), p_array.q_array, gamma, nmesh)
+    result4 = check_value(np.linalg.norm(E3 - E_ref) / np.linalg.norm(E_ref), 0., 0.02, 'absolute',
+                          assert_info=' E quantized - \n')
+
+    # the kernel is reused while the bunch size grows slightly from kick to kick. The bunch is scaled so that
+    # the exact mesh steps are just above the nodes of the quantization grid.
+    steps = SpaceCharge().mesh_geometry(X, p_array.q_array, nmesh)[0]
+    dlog = np.log1p(sc.kernel_step_tol)
+    X0 = X * np.exp(np.floor(np.log(steps) / dlog) * dlog) * 1.0001 / steps
+    sc = SpaceCharge()
+    sc.kernel_cache = True
+    for scale in [1., 1.001, 1.002, 1.003]:
+        sc.el_field(X0 * scale, p_array.q_array, gamma, nmesh)
+    result5 = check_value(sc.kernel_stats["hits"], 3, assert_info=' kernel hits - \n')
+    result6 = check_value(sc.kernel_stats["misses"], 1, assert_info=' kernel misses - \n')
+    assert check_result(result1 + result2 + [result3, result4, result5, result6])
+
+
+def test_sc_potential_fft(lattice, p_array, parameter=None, update_ref_values=False):
+    """Real-to-complex FFT potential in comparison with the complex FFT on the doubled mesh"""
+    from ocelot.cpbd import sc as sc_module
+    from ocelot.common.globals import epsilon_0
+
+    Nx, Ny, Nz = 7, 6, 5
+    steps = np.array([1e-4, 2e-4, 3e-5])
+    np.random.seed(3)
+    q1 = np.random.rand(Nx, Ny, Nz)
+    q2 = np.random.rand(Nx, Ny, Nz)
+
+    def potential_ref(q):
+        K2 = np.zeros((2*Nx-1, 2*Ny-1, 2*Nz-1))
+        K2[0:Nx, 0:Ny, 0:Nz] = SpaceCharge().sym_kernel(q.shape, steps)
+        K2[0:Nx, 0:Ny, Nz:2*Nz-1] = K2[0:Nx, 0:Ny, Nz-1:0:-1]
+        K2[0:Nx, Ny:2*Ny-1, :] = K2[0:Nx, Ny-1:0:-1, :]
+        K2[Nx:2*Nx-1, :, :] = K2[Nx-1:0:-1, :, :]
+        out = np.zeros((2*Nx-1, 2*Ny-1, 2*Nz-1))
+        out[:Nx, :Ny, :Nz] = q
+        out = np.real(np.fft.ifftn(np.fft.fftn(out)*np.fft.fftn(K2)))
+        return out[:Nx, :Ny, :Nz]/(4*pi*epsilon_0*np.prod(steps))
+
+    result = []
+    flags = [False, True] if sc_module.pyfftw_flag else [False]
+    pyfftw_flag = sc_module.pyfftw_flag
+    try:
+        for flag in flags:
+            sc_module.pyfftw_flag = flag
+            # the padded buffer from fft_plan is reused, the second call must not see the first charge density
+            sc = SpaceCharge()
+            U1 = np.copy(sc.potential(q1, steps))
+            U2 = np.copy(sc.potential(q2, steps))
+            result.append(check_value(len(sc._fft_plans), 1, assert_info=' number of fft plans - \n'))
+            for U, q, name in [(U1, q1, 'q1'), (U2, q2, 'q2')]:
+                U_ref = potential_ref(q)
+                err = np.max(np.abs(U - U_ref)) / np.max(np.abs(U_ref))
+                result.append(check_value(err, 0., 1e-12, 'absolute',
+                                          assert_info=' pyfftw ' + str(flag) + ' U(' + name + ') - \n'))
+    finally:
+        sc_module.pyfftw_flag = pyfftw_flag
+    assert check_result(result)
+
+
+def test_lsc_wake_impedance(lattice, p_array, parameter=None, update_ref_values=False):
+    """wake -> impedance -> wake with the half spectrum of the real wake"""
+    from ocelot.common.globals import speed_of_light
+
+    lsc = LSC()
+    np.random.seed(4)
+    result = []
+    for n in [64, 65]:
+        s = np.arange(n) * 1e-6
+        w = np.random.rand(n)
+        f, y = lsc.wake2impedance(s, w)
+        y_ref = (s[1] - s[0]) / speed_of_light * np.fft.fft(w)
+        result.append(check_value(len(f), n // 2 + 1, assert_info=' len(f), n=' + str(n) + ' - \n'))
+        result += check_matrix(np.abs(y - y_ref[:n // 2 + 1]), np.zeros(n // 2 + 1), 1e-9 * np.max(np.abs(y_ref)),
+                               'absolute', assert_info=' impedance, n=' + str(n) + ' - ')
+        s1, w1 = lsc.impedance2wake(f, y, n)
+        result += check_matrix(s1, s, 1e-12, 'absolute', assert_info=' s, n=' + str(n) + ' - ')
+        result += check_matrix(w1, w, TOL, 'absolute', assert_info=' wake, n=' + str(n) + ' - ')
+    assert check_result(result)
+
+
+def test_particle_mesh(lattice, p_array, parameter=None, update_ref_values=False):
+    """NGP/CIC/TSC charge deposition and field gather"""
+    from ocelot.cpbd import particle_mesh
+
+    nmesh = np.array([31, 31, 31])
+    X = np.copy(p_array.rparticles[[0, 2, 4]].T)
+    gamma = p_array.E / m_e_GeV
+    Xm = (X - np.min(X, axis=0)) / (np.max(X, axis=0) - np.min(X, axis=0)) * 28 + 1
+    Q = p_array.q_array
+
+    result = []
+    for order in [0, 1, 2]:
+        q = particle_mesh.deposit(Xm, Q, nmesh, order)
+        q_np = particle_mesh.deposit_np(Xm, Q, nmesh[0], nmesh[1], nmesh[2], order)
+        f = particle_mesh.gather(q, Xm, order)
+        f_np = particle_mesh.gather_np(q, Xm, order)
+        result += check_matrix(q.flatten(), q_np.flatten(), TOL, assert_info=' deposit ' + str(order) + ' - ')
+        result += check_matrix(f, f_np, TOL, assert_info=' gather ' + str(order) + ' - ')
+        result.append(check_value(np.sum(q), np.sum(Q), TOL, assert_info=' total charge ' + str(order) + ' - \n'))
+
+    sc = SpaceCharge()
+    sc.kernel_cache = False
+    E_ngp = sc.el_field(np.copy(X), Q, gamma, nmesh)
+    for order in [1, 2]:
+        sc = SpaceCharge()
+        sc.deposit_order = order
+        E = sc.el_field(np.copy(X), Q, gamma, nmesh)
+        result.append(check_value(np.linalg.norm(E - E_ngp) / np.linalg.norm(E_ngp), 0., 0.1, 'absolute',
+                                  assert_info=' E order ' + str(order) + ' - \n'))
+    assert check_result(result)
+
+
+def test_sc_25d(lattice, p_array, parameter=None, update_ref_values=False):
+    """2.5D space charge field of the long bunch in comparison with the 3D field"""
+
+    X = np.copy(p_array.rparticles[[0, 2, 4]].T)
+    gamma = 0.5 / m_e_GeV
+    Q = p_array.q_array
+
+    # smooth 3D field as the reference, 20000 particles are too few for the NGP on the fine mesh
+    sc = SpaceCharge()
+    sc.deposit_order = 2
+    E_3d = sc.el_field(np.copy(X), Q, gamma, np.array([31, 31, 31]))
+    result = []
+    for solver in ["fft", "radial"]:
+        sc = SpaceCharge25D()
+        sc.solver = solver
+        E = sc.el_field(np.copy(X), Q, gamma, np.array(sc.nmesh_xyz))
+        for i in range(3):
+            err = np.linalg.norm(E[:, i] - E_3d[:, i]) / np.linalg.norm(E_3d[:, i])
+            result.append(check_value(err, 0., 0.1, 'absolute', assert_info=' ' + solver + ' E' + 'xyz'[i] + ' - \n'))
+
+    # pencil beam: the error is raised before any division by the zero mesh step
+    X_pencil = np.copy(X)
+    X_pencil[:, 0] = 1e-6
+    X_pencil[:, 1] = -1e-6
+    for solver in ["fft", "radial"]:
+        sc = SpaceCharge25D()
+        sc.solver = solver
+        with np.errstate(all="raise"), pytest.raises(ValueError, match="zero extent along x, y"):
+            sc.el_field(np.copy(X_pencil), Q, gamma, np.array(sc.nmesh_xyz))
+    assert check_result(result)
+
+
+def test_sc_subsample_reuse(lattice, p_array, parameter=None, update_ref_values=False):
+    """Space charge field from the subsample of the particles and reuse of the field"""
+
+    nmesh = np.array([31, 31, 31])
+    X = np.copy(p_array.rparticles[[0, 2, 4]].T)
+    gamma = p_array.E / m_e_GeV
+    Q = p_array.q_array
+
+    sc = SpaceCharge()
+    sc.deposit_order = 1
+    E_ref = sc.el_field(np.copy(X), Q, gamma, nmesh)
+
+    sc = SpaceCharge()
+    sc.deposit_order = 1
+    sc.subsample = 0.5
+    E = sc.el_field(np.copy(X), Q, gamma, nmesh)
+    result1 = check_value(np.linalg.norm(E - E_ref)/np.linalg.norm(E_ref), 0., 0.1, 'absolute', assert_info=' E subsample - \n')
+
+    sc = SpaceCharge()
+    sc.deposit_order = 1
+    sc.field_reuse_tol = 0.01
+    E1 = sc.el_field(np.copy(X), Q, gamma, nmesh)
+    E2 = sc.el_field(np.copy(X) + 1e-4, Q, gamma, nmesh)
+    result2 = check_matrix(E1, E_ref, TOL, assert_info=' E - ')
+    result3 = check_matrix(E2, E1, TOL, assert_info=' E reused - ')
+    result4 = check_dict([sc.solve_stats], [{"solves": 1, "reused": 1}], assert_info=' solve_stats - ')
+    sc.el_field(np.copy(X) * 1.1, Q, gamma, nmesh)
+    result5 = check_dict([sc.solve_stats], [{"solves": 2, "reused": 1}], assert_info=' solve_stats 2 - ')
+
+    lsc = LSC()
+    lsc.apply(p_array, 0.1)
+    p_ref = np.copy(p_array.rparticles[5])
+    lsc.field_reuse_tol = 0.01
+    lsc.apply(p_array, 0.1)
+    p1 = np.copy(p_array.rparticles[5])
+    lsc.apply(p_array, 0.1)
+    result6 = check_matrix(p_array.rparticles[5] - p1, p1 - p_ref, TOL, assert_info=' LSC reused - ')
+    result7 = check_dict([lsc.solve_stats], [{"solves": 2, "reused": 1}], assert_info=' LSC solve_stats - ')
+    assert check_result([result1] + result2 + result3 + result4 + result5 + result6 + result7)
+
+
 def track_wrapper(lattice, p_array, param, bounds=None):
 
     if not hasattr(pytest, 'sp_track_list') or not hasattr(pytest, 'sp_p_array'):
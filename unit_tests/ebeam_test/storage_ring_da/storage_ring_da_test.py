@@ -119,6 +119,64 @@ def test_freq_analysis(lattice, tws, update_ref_values=False):
     assert check_result(result)
 
 
+def test_da_fma_pool(lattice, tws, update_ref_values=False):
+    """DA and FMA with the process pool in comparison with the serial tracking"""
+
+    ksi_x, ksi_y, nsuperperiods = compensate_chromaticity_wrapper(lattice)
+    nturns = 128
+    x_array = np.linspace(-0.01, 0.01, 10)
+    y_array = np.linspace(0.0001, 0.005, 8)
+    pxy_list = create_track_list(x_array, y_array, p_array=[0.0])
+    pxy_list = track_nturns(lattice, nturns, pxy_list, nsuperperiods=nsuperperiods, save_track=True, print_progress=False)
+    da = np.array([pxy.turn for pxy in pxy_list]).reshape(len(y_array), len(x_array))
+    ctr_da = contour_da(pxy_list, nturns).reshape(len(y_array), len(x_array))
+    pxy_list = freq_analysis(pxy_list, lattice, nturns, harm=True, nsuperperiods=nsuperperiods)
+    mux = np.array([pxy.mux for pxy in pxy_list]).reshape(len(y_array), len(x_array))
+
+    da_p = da_pool(lattice, nturns, x_array, y_array, nsuperperiods=nsuperperiods, nproc=2)
+    ctr_da_p, mux_p, muy_p = fma_pool(lattice, nturns, x_array, y_array, nsuperperiods=nsuperperiods, nproc=2)
+
+    result1 = check_matrix(da_p, da, assert_info=' da - ')
+    result2 = check_matrix(ctr_da_p, ctr_da, assert_info=' ctr_da - ')
+    result3 = check_matrix(mux_p, mux, TOL, assert_info=' mux - ')
+    assert check_result(result1 + result2 + result3)
+
+
+def test_da_rays(lattice, tws, update_ref_values=False):
+    """DA contour by the bisection along the rays"""
+
+    ksi_x, ksi_y, nsuperperiods = compensate_chromaticity_wrapper(lattice)
+    nturns = 100
+    resolution = 1.0e-4
+    x_da, y_da = da_rays(lattice, nturns, xmax=0.03, ymax=0.03, nrays=7, resolution=resolution,
+                         nsuperperiods=nsuperperiods)
+
+    r_da = np.sqrt(x_da**2 + y_da**2)
+    rparticles = np.zeros((6, len(r_da)))
+    rparticles[0] = x_da
+    rparticles[2] = y_da
+    alive, lost_turn, tbt = track_nturns_array(lattice, nturns, rparticles, nsuperperiods=nsuperperiods,
+                                               save_track=False)
+    result1 = check_matrix(alive.astype(int), np.ones(len(r_da)), assert_info=' contour - ')
+
+    # comparison with the dense scan along the rays without the stability islands
+    angles = np.linspace(0, np.pi, 7)
+    r = np.arange(1, 301) * resolution
+    rparticles = np.zeros((6, len(r) * len(angles)))
+    rparticles[0] = np.outer(np.cos(angles), r).flatten()
+    rparticles[2] = np.outer(np.sin(angles), r).flatten()
+    alive, lost_turn, tbt = track_nturns_array(lattice, nturns, rparticles, nsuperperiods=nsuperperiods,
+                                               save_track=False)
+    alive = alive.reshape(len(angles), len(r))
+    result2 = []
+    for i in range(len(angles)):
+        n_alive = np.argmin(alive[i]) if not alive[i].all() else len(r)
+        if not alive[i, n_alive:].any():
+            r_scan = r[n_alive - 1] if n_alive > 0 else 0.
+            result2.append(check_value(r_da[i], r_scan, resolution, 'absolute', assert_info=' ray ' + str(i) + ' - \n'))
+    assert check_result(result1 + result2)
+
+
 def compensate_chromaticity_wrapper(lattice):
 
     ksi_x = 0.0
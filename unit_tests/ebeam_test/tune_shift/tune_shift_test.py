@@ -102,6 +102,43 @@ def test_freq_analysis(lattice, update_ref_values=False):
     assert check_result(result1+[result2, result3, result4])
 
 
+def test_track_nturns_array(lattice, update_ref_values=False):
+    """Track N turns of the particle array with the turn-by-turn buffer"""
+
+    pxy_list, nturns = track_nturns_wrapper(lattice)
+    p = pxy_list[0].particle
+    rparticles = np.array([[p.x, p.px, p.y, p.py, p.tau, p.p], [1.0, 0., 0., 0., 0., 0.]]).T
+    filename = FILE_DIR + '/tbt.npy'
+    alive, lost_turn, tbt = track_nturns_array(lattice, nturns, rparticles, energy=p.E, stride=2, filename=filename)
+    tbt_file = np.load(filename)
+    os.remove(filename)
+
+    p_list = np.array(pxy_list[0].p_list)
+    result1 = check_matrix(tbt[:, :, 0], p_list[::2], TOL, 'absolute', assert_info=' tbt - ')
+    result2 = check_matrix(alive.astype(int), np.array([1, 0]), assert_info=' alive - ')
+    result3 = check_matrix(lost_turn, np.array([-1, 0]), assert_info=' lost_turn - ')
+    result4 = check_value(int(np.isnan(tbt[1:, :, 1]).all()), 1, assert_info=' lost particle - ')
+    result5 = check_matrix(tbt_file[:, :, 0], tbt[:, :, 0], TOL, assert_info=' tbt file - ')
+    assert check_result(result1 + result2 + result3 + [result4] + result5)
+
+
+def test_find_tunes(lattice, update_ref_values=False):
+    """Batched frequency analysis with the refined tunes"""
+
+    mu_y_h_ref = 0.3034375
+
+    pxy_list, nturns = track_nturns_wrapper(lattice)
+    y = np.array([p[2] for p in pxy_list[0].p_list])
+
+    mu_y = find_tunes(y, niter=30)[0]
+    mu_y_256 = find_tunes(y[:256], niter=30)[0]
+    mu_y_interp = find_tunes(y[:256])[0]
+    result1 = check_value(mu_y, mu_y_h_ref, 1.0e-5, 'absolute', assert_info=' mu_y - \n')
+    result2 = check_value(mu_y_256, mu_y, 1.0e-8, 'absolute', assert_info=' mu_y 256 turns - \n')
+    result3 = check_value(mu_y_interp, mu_y, 1.0e-5, 'absolute', assert_info=' mu_y interpolation - \n')
+    assert check_result([result1, result2, result3])
+
+
 def dft(sample, freqs):
 
     n = len(sample)
@@ -39,6 +39,60 @@ def test_get_long_wake(lattice, p_array, parameter=None, update_ref_values=False
     assert check_result(result1 + result2)
 
 
+def test_convolution(lattice, p_array, parameter=None, update_ref_values=False):
+    """direct and FFT convolution of the convolution engine in comparison with np.convolve"""
+    from ocelot.cpbd import convolution
+
+    np.random.seed(1)
+    result = []
+    for na, nb in [(10, 3000), (3000, 2000), (4097, 4097)]:
+        a = np.random.rand(na)
+        b = np.random.rand(nb)
+        c_ref = np.convolve(a, b)
+        for method in ["auto", "direct", "fft"]:
+            c = convolution.convolve(a, b, method=method)
+            result += check_matrix(c, c_ref, TOL, 'absolute', assert_info=' ' + method + ' ' + str(na) + ' - ')
+            c = convolution.convolve(a, b, n=1500, method=method)
+            result += check_matrix(c, c_ref[:1500], TOL, 'absolute', assert_info=' ' + method + ' causal - ')
+
+    x = np.random.rand(1001)
+    y = convolution.rfft(x, 2048)
+    result += check_matrix(convolution.irfft(y, 2048)[:1001], x, TOL, 'absolute', assert_info=' rfft - ')
+    assert check_result(result)
+
+
+def test_table_cache(lattice, p_array, parameter=None, update_ref_values=False):
+    """wake tables of the corrugated structure from the on-disk cache"""
+    import shutil
+    from ocelot.cpbd.table_cache import TableCache
+
+    cache_dir = FILE_DIR + '/table_cache'
+    cache = TableCache(cache_dir=cache_dir)
+    wt_ref = WakeTableDechirperOffAxis(b=500 * 1e-6, orient="vert", cache=None)
+    wts = [WakeTableDechirperOffAxis(b=500 * 1e-6, orient="vert", cache=c) for c in [cache, cache,
+                                                                                     TableCache(cache_dir=cache_dir)]]
+    info = cache.info()
+    WakeTableDechirperOffAxis(b=400 * 1e-6, orient="vert", cache=cache)
+    cache.max_size = info["size"]
+    cache.shrink()
+    info_shrink = cache.info()
+    cache.clear()
+    info_clear = cache.info()
+    shutil.rmtree(cache_dir)
+
+    result = []
+    for wt in wts:
+        for (R, L, Cinv, nm, W0, N0, W1, N1), row_ref in zip(wt.TH[0], wt_ref.TH[0]):
+            result += check_matrix(W0.flatten(), row_ref[4].flatten(), TOL, assert_info=' W0 - ')
+        result += check_matrix(wt.TH[1].flatten(), wt_ref.TH[1].flatten(), TOL, assert_info=' H - ')
+    result += [check_value(info["hits"], 1, assert_info=' hits - \n'),
+               check_value(info["misses"], 1, assert_info=' misses - \n'),
+               check_value(info["files"], 1, assert_info=' files - \n'),
+               check_value(info_shrink["files"], 1, assert_info=' files after shrink - \n'),
+               check_value(info_clear["files"], 0, assert_info=' files after clear - \n')]
+    assert check_result(result)
+
+
 def setup_module(module):
 
     f = open(pytest.TEST_RESULTS_FILE, 'a')